@@ -1,16 +1,77 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, url_for, abort, stream_with_context, g, send_file
+import flask
+from collections import OrderedDict
+from collections.abc import Iterator
+from dataclasses import dataclass
 from pathlib import Path
 from PIL import Image
+import numpy as np
 import io
 import base64
+import functools
+import hashlib
+import json
+import math
+import os
 import random
+import struct
+import threading
+import time
 import uuid
+import zipfile
+import zlib
+
+import banner_approx
+import banner_bundle
+import banner_diskcache
+import banner_jobs
+import banner_metrics
+import banner_mosaic
+import banner_phash
+import banner_pool
+import banner_sampler
+import banner_sessions
 
 app = Flask(__name__)
 
 # --- Config ---------------------------------------------------------------
 
 NUM_PATTERN_LAYERS = 6  # layers on top of base
+RENDER_CACHE_MAX_ENTRIES = 10000  # encoded images kept for /api/banner/<key>.<ext>
+STREAM_MAX_COUNT = 100000  # soft cap for /api/generate_stream
+STREAM_BATCH_SIZE = 16  # banners rendered per batch while streaming
+REGISTRY_CHECK_INTERVAL = 1.0  # seconds between banner_cropped/ mtime checks
+MOSAIC_MAX_SIDE = 4096  # banners per side of a /api/mosaic.png wall
+MOSAIC_MAX_SCALE = 16  # nearest-neighbor upscale cap for /api/mosaic.png
+MOSAIC_MAX_PIXELS = 1 << 26  # output pixels (after scale) per /api/mosaic.png; larger walls get 400
+APPROX_MAX_LAYERS = 16  # pattern layers /api/approximate may search
+APPROX_MAX_BEAM = 64  # beam width cap for /api/approximate
+APPROX_MAX_SECONDS = 10.0  # time budget cap for /api/approximate
+APPROX_MAX_IMAGE_BYTES = 8 << 20  # largest upload /api/approximate accepts
+JOB_WORKERS = 1  # background jobs rendering at once, next to interactive requests
+JOB_MAX_PENDING = 8  # queued + running jobs before /api/jobs answers 429
+JOB_MAX_COUNT = 1000000  # soft cap on banners per job
+JOB_BATCH_SIZE = 64  # banners rendered between progress updates / cancel checks
+JOB_TTL = 3600.0  # seconds a finished job's zip is kept for download
+SESSION_MAX = 256  # editing sessions kept per process, least recently used dropped first
+SESSION_TTL = 1800.0  # seconds an idle editing session is kept
+SESSION_MAX_BANNERS = 400  # banners per editing session, as for grids
+SESSION_MAX_LAYERS = 16  # pattern layers per banner in an editing session
+SESSION_MAX_BYTES = 256 << 20  # image pixels kept by all editing sessions; LRU sessions dropped past it
+UNIQUE_DISTANCE = 2  # default Hamming distance at which "unique" calls a banner a repeat
+UNIQUE_MAX_DISTANCE = 11  # "unique_distance" cap; see banner_phash.HashIndex
+UNIQUE_INDEX_MAX = 4000000  # hashes remembered for "unique" (~40 bytes each) before starting over
+UNIQUE_MAX_ROUNDS = 8  # candidate batches per "unique" request before returning short
+UNIQUE_FIT_SAMPLE = 4096  # random banners the perceptual hasher is fitted to
+# Async serving mode: BANNERLAB_ASYNC=1 renders and encodes batch requests on
+# a bounded, fair thread pool instead of the request thread; see banner_pool.
+ASYNC_RENDER = os.environ.get("BANNERLAB_ASYNC", "0") == "1"
+RENDER_WORKERS = os.cpu_count() or 1  # render pool threads
+RENDER_MAX_PENDING = 256  # queued + running render tasks before requests get 503
+RENDER_CHUNK_SIZE = 32  # banners per render task
+# Optional SQLite render cache shared by worker processes; unset disables it.
+DISK_CACHE_PATH = os.environ.get("BANNERLAB_DISK_CACHE", "")
+DISK_CACHE_MAX_BYTES = int(os.environ.get("BANNERLAB_DISK_CACHE_MB", "256")) << 20
 
 DYE_COLORS = {
     "white":      (255, 255, 255),
@@ -33,8 +94,49 @@ DYE_COLORS = {
 
 SCRIPT_DIR = Path(__file__).parent.resolve()
 CROPPED_DIR = SCRIPT_DIR / "banner_cropped"
+BUNDLE_PATH = SCRIPT_DIR / banner_bundle.BUNDLE_FILENAME
 
+# Decoded primitives and colorized layers keyed by (pattern filename, rgb).
+# Filled lazily, one load per key however many threads ask at once, and
+# shared by every request thread, so cached images must never be modified
+# in place.
 primitive_cache: dict[str, Image.Image] = {}
+primitive_loader = banner_pool.SingleFlight(primitive_cache)
+colored_layer_cache: dict[tuple[str, tuple[int, int, int]], Image.Image] = {}
+colored_layer_loader = banner_pool.SingleFlight(colored_layer_cache)
+
+# Encoded image bytes keyed by render_key, least recently used first.
+render_cache: OrderedDict[str, bytes] = OrderedDict()
+render_cache_lock = threading.Lock()
+
+# Second, persistent tier behind render_cache; see banner_diskcache.
+disk_cache = (
+    banner_diskcache.DiskCache(DISK_CACHE_PATH, DISK_CACHE_MAX_BYTES) if DISK_CACHE_PATH else None
+)
+
+job_queue = banner_jobs.JobQueue(JOB_WORKERS, JOB_MAX_PENDING, JOB_TTL, suffix=".zip")
+
+render_pool = banner_pool.FairPool(RENDER_WORKERS, RENDER_MAX_PENDING) if ASYNC_RENDER else None
+
+session_store = banner_sessions.SessionStore(SESSION_MAX, SESSION_TTL, SESSION_MAX_BYTES)
+
+# Perceptual hashes of banners served with "unique", and the (registry
+# version, hasher) that computed them; see banner_phash.
+seen_banners = banner_phash.HashIndex()
+banner_hasher: tuple[str, banner_phash.PerceptualHasher] | None = None
+banner_hasher_lock = threading.Lock()
+
+# (registry version, PNG) of the primitive alpha atlas served to clients
+# that composite banners themselves.
+primitive_atlas: tuple[str, bytes] | None = None
+
+# (registry version, coverage and dye contrast tables) for constrained
+# sampling; see banner_sampler.
+sampler_tables: tuple[str, banner_sampler.Tables] | None = None
+
+COLOR_NAMES = list(DYE_COLORS.keys())
+COLOR_INDEX = {c: i for i, c in enumerate(COLOR_NAMES)}
+COLOR_TABLE = np.array([DYE_COLORS[c] for c in COLOR_NAMES], dtype=np.uint32)
 
 # --- Mirror mapping templates ---------------------------------------------
 # HORIZONTAL_MIRROR_MAP:
@@ -125,9 +227,132 @@ VERTICAL_MIRROR_MAP = {
 }
 
 
+# --- Primitive registry ---------------------------------------------------
+
+
+@dataclass(frozen=True)
+class PrimitiveRegistry:
+    """
+    Snapshot of the primitives in CROPPED_DIR with a stable integer ID per
+    file. masks[i] is the (H, W) alpha mask of names[i], memory-mapped from
+    the packed bundle when it is fresh, decoded from the PNGs otherwise.
+    """
+
+    generation: int
+    dir_mtime_ns: int
+    names: list[str]
+    ids: dict[str, int]
+    masks: np.ndarray
+    base_id: int  # -1 when base.png is missing
+    # masks << 8 as intp plus one transparent slot for -1 layers, ready to
+    # index the composite lookup tables (see composite_banner_batch)
+    lut_masks: np.ndarray
+    # Per-ID coverage bitmasks over the H*W pixels (bit i = pixel i, row-major):
+    # opaque_bits where alpha == 255, visible_bits where alpha > 0.
+    opaque_bits: list[int]
+    visible_bits: list[int]
+    full_bits: int
+    # Hash of the primitive PNGs; part of every render cache key.
+    version: str
+
+    def pattern_pool(self, excluded_patterns: list[str] | None = None) -> np.ndarray:
+        """
+        IDs of all non-base patterns not in excluded_patterns. Built per
+        call: it is a mask over a few dozen IDs, and excluded_patterns comes
+        from clients, so memoizing by it would grow without bound.
+        """
+        keep = np.ones(len(self.names), dtype=bool)
+        if self.base_id >= 0:
+            keep[self.base_id] = False
+        for name in excluded_patterns or ():
+            i = self.ids.get(name) if isinstance(name, str) else None
+            if i is not None:
+                keep[i] = False
+        return np.flatnonzero(keep)
+
+    def pattern_files(self, excluded_patterns: list[str] | None = None) -> list[str]:
+        return [self.names[i] for i in self.pattern_pool(excluded_patterns)]
+
+
+registry: PrimitiveRegistry | None = None
+registry_lock = threading.Lock()
+registry_checked_at = 0.0
+
+
+def _dir_mtime_ns(path: Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return -1
+
+
+def _pixel_bits(selected: np.ndarray) -> int:
+    """Pack a flat boolean pixel mask into an int, bit i = pixel i."""
+    return int.from_bytes(np.packbits(selected, bitorder="little").tobytes(), "little")
+
+
+def _build_registry(generation: int, dir_mtime_ns: int) -> PrimitiveRegistry:
+    bundle = banner_bundle.load_bundle(BUNDLE_PATH, CROPPED_DIR)
+    if bundle is not None:
+        names, masks, version = bundle
+    else:
+        version = banner_bundle.source_hash(CROPPED_DIR) if CROPPED_DIR.is_dir() else ""
+        names = list_primitive_files()
+        decoded = [
+            np.asarray(Image.open(CROPPED_DIR / n).convert("RGBA").getchannel("A"))
+            for n in names
+        ]
+        masks = np.stack(decoded) if decoded else np.zeros((0, 40, 20), dtype=np.uint8)
+
+    ids = {name: i for i, name in enumerate(names)}
+    flat = masks.reshape(len(names), -1)
+    lut_masks = np.zeros((len(names) + 1,) + masks.shape[1:], dtype=np.intp)
+    lut_masks[: len(names)] = masks
+    lut_masks <<= 8
+    return PrimitiveRegistry(
+        generation=generation,
+        dir_mtime_ns=dir_mtime_ns,
+        names=list(names),
+        ids=ids,
+        masks=masks,
+        base_id=ids.get("base.png", -1),
+        lut_masks=lut_masks,
+        opaque_bits=[_pixel_bits(row == 255) for row in flat],
+        visible_bits=[_pixel_bits(row > 0) for row in flat],
+        full_bits=(1 << flat.shape[1]) - 1,
+        version=version,
+    )
+
+
+def load_registry() -> PrimitiveRegistry:
+    """
+    Return the current primitive registry.
+
+    The directory is stat'ed at most every REGISTRY_CHECK_INTERVAL seconds;
+    when its mtime changes the registry is rebuilt under a new generation and
+    the per-primitive caches are dropped.
+    """
+    global registry, registry_checked_at
+    current = registry
+    now = time.monotonic()
+    if current is not None and now - registry_checked_at < REGISTRY_CHECK_INTERVAL:
+        return current
+
+    with registry_lock:
+        registry_checked_at = now
+        mtime_ns = _dir_mtime_ns(CROPPED_DIR)
+        if registry is None or registry.dir_mtime_ns != mtime_ns:
+            generation = registry.generation + 1 if registry is not None else 0
+            registry = _build_registry(generation, mtime_ns)
+            primitive_loader.clear()
+            colored_layer_loader.clear()
+        return registry
+
+
 # --- Image helpers --------------------------------------------------------
 
 
+@banner_metrics.timed_stage("colorize")
 def colorize_mask(img: Image.Image, rgb: tuple[int, int, int]) -> Image.Image:
     """Apply an RGB color to an RGBA mask, preserving alpha."""
     img = img.convert("RGBA")
@@ -138,17 +363,36 @@ def colorize_mask(img: Image.Image, rgb: tuple[int, int, int]) -> Image.Image:
 
 
 def load_primitive(filename: str) -> Image.Image:
-    """Load a primitive PNG from CROPPED_DIR with caching."""
-    if filename in primitive_cache:
-        return primitive_cache[filename]
-    path = CROPPED_DIR / filename
-    img = Image.open(path).convert("RGBA")
-    primitive_cache[filename] = img
-    return img
+    """Load a primitive from the registry or CROPPED_DIR with caching."""
+
+    def load() -> Image.Image:
+        reg = load_registry()
+        if filename in reg.ids:
+            return banner_bundle.mask_to_image(reg.masks[reg.ids[filename]])
+        return Image.open(CROPPED_DIR / filename).convert("RGBA")
+
+    return primitive_loader.get(filename, load)
+
+
+def load_colored_layer(filename: str, rgb: tuple[int, int, int]) -> Image.Image:
+    """Return primitive `filename` colorized with `rgb`, cached per (pattern, dye)."""
+    return colored_layer_loader.get(
+        (filename, rgb), lambda: colorize_mask(load_primitive(filename), rgb)
+    )
+
+
+def warm_colored_layer_cache() -> None:
+    """Pre-colorize every (primitive, dye) pair so requests never pay for it."""
+    for filename in load_registry().names:
+        for rgb in DYE_COLORS.values():
+            load_colored_layer(filename, rgb)
 
 
 def list_primitive_files() -> list[str]:
-    """Return all primitive filenames (PNG) in CROPPED_DIR."""
+    """
+    Scan CROPPED_DIR for primitive filenames (PNG). Only used to build the
+    registry; everything else should read load_registry().names.
+    """
     if not CROPPED_DIR.exists():
         return []
     return sorted(
@@ -161,6 +405,7 @@ def list_primitive_files() -> list[str]:
 def generate_random_banner(
     excluded_patterns: list[str] | None = None,
     allowed_colors: list[str] | None = None,
+    constraints: banner_sampler.Constraints | None = None,
 ) -> tuple[Image.Image, list[dict]]:
     """
     Generate a single random banner:
@@ -169,27 +414,30 @@ def generate_random_banner(
       - up to NUM_PATTERN_LAYERS random pattern layers with random dyes
         from allowed_colors, excluding any patterns in excluded_patterns.
 
+    With constraints, the stack is drawn by sample_random_stacks instead.
+
     Returns:
       (PIL.Image, layers)
       where layers is a list of dicts like:
         { "kind": "base"|"pattern", "pattern": "file.png", "color": "magenta" }
     """
-    primitive_files = list_primitive_files()
-    if not primitive_files:
+    reg = load_registry()
+    if not reg.names:
         # Failsafe: blank 20x40 image
         img = Image.new("RGBA", (20, 40), (0, 0, 0, 0))
         return img, []
 
-    base_filename = "base.png"
-    excluded_patterns = excluded_patterns or []
+    if constraints is not None and constraints.active() and reg.base_id >= 0:
+        pattern_ids, color_ids = sample_random_stacks(
+            1, excluded_patterns, allowed_colors, registry=reg, constraints=constraints
+        )
+        layers = stack_to_layers(pattern_ids[0], color_ids[0], reg)
+        return _render_layers(layers), layers
 
-    # Patterns = all primitives except base
-    pattern_files = [f for f in primitive_files if f != base_filename]
+    base_filename = "base.png"
 
-    # Apply pattern exclusions
-    if excluded_patterns:
-        excluded_set = set(excluded_patterns)
-        pattern_files = [f for f in pattern_files if f not in excluded_set]
+    # Patterns = all primitives except base, minus exclusions
+    pattern_files = reg.pattern_files(excluded_patterns)
 
     # Color pool
     all_color_names = list(DYE_COLORS.keys())
@@ -209,8 +457,7 @@ def generate_random_banner(
     # Base layer
     base_color = random.choice(color_pool)
     base_rgb = DYE_COLORS[base_color]
-    base_colored = colorize_mask(base_img, base_rgb)
-    result.alpha_composite(base_colored)
+    result.alpha_composite(load_colored_layer(base_filename, base_rgb))
     layers.append(
         {
             "kind": "base",
@@ -219,91 +466,1510 @@ def generate_random_banner(
         }
     )
 
-    # Pattern layers
-    if pattern_files:
-        num_layers = random.randint(0, NUM_PATTERN_LAYERS)
-        for _ in range(num_layers):
-            pat_file = random.choice(pattern_files)
-            dye_name = random.choice(color_pool)
-            rgb = DYE_COLORS[dye_name]
-            pat_img = load_primitive(pat_file)
-            pat_colored = colorize_mask(pat_img, rgb)
-            result.alpha_composite(pat_colored)
+    # Pattern layers
+    if pattern_files:
+        num_layers = random.randint(0, NUM_PATTERN_LAYERS)
+        for _ in range(num_layers):
+            pat_file = random.choice(pattern_files)
+            dye_name = random.choice(color_pool)
+            rgb = DYE_COLORS[dye_name]
+            result.alpha_composite(load_colored_layer(pat_file, rgb))
+
+            layers.append(
+                {
+                    "kind": "pattern",
+                    "pattern": pat_file,
+                    "color": dye_name,
+                }
+            )
+
+    return result, layers
+
+
+@banner_metrics.timed_stage("composite")
+def render_banner_from_layers(layers: list[dict]) -> Image.Image:
+    """
+    Deterministically render a banner from a list of layer dicts
+    like the ones returned by generate_random_banner.
+
+    Always composites: the render cache holds encoded bytes, which
+    banner_src serves as they are (see cached_banner_image).
+    """
+    return _render_layers(layers)
+
+
+def _render_layers(layers: list[dict]) -> Image.Image:
+    # Skip layers that cannot show (see prune_layers)
+    layers = canonicalize_layers(layers)
+
+    # Find base layer if present
+    base_layer = None
+    for layer in layers:
+        if layer.get("kind") == "base":
+            base_layer = layer
+            break
+
+    if base_layer is None:
+        # Fallback: assume base.png with white if no explicit base
+        base_layer = {"kind": "base", "pattern": "base.png", "color": "white"}
+
+    base_pattern = base_layer.get("pattern", "base.png")
+    base_color_name = base_layer.get("color", "white")
+    base_rgb = DYE_COLORS.get(base_color_name, (255, 255, 255))
+
+    base_img = load_primitive(base_pattern)
+    width, height = base_img.size
+    result = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+
+    # Draw base first
+    result.alpha_composite(load_colored_layer(base_pattern, base_rgb))
+
+    # Draw the rest in order, skipping base since we already handled it
+    for layer in layers:
+        if layer is base_layer:
+            continue
+        if layer.get("kind") == "base":
+            continue  # ignore any extra base layers
+
+        pattern_name = layer.get("pattern")
+        color_name = layer.get("color")
+        if not pattern_name or not color_name:
+            continue
+
+        rgb = DYE_COLORS.get(color_name, (255, 255, 255))
+        try:
+            colored = load_colored_layer(pattern_name, rgb)
+        except FileNotFoundError:
+            continue
+
+        result.alpha_composite(colored)
+
+    return result
+
+
+# --- Output encodings -----------------------------------------------------
+
+# name -> (PIL format, mimetype, file extension, highest level)
+ENCODING_FORMATS = {
+    "png": ("PNG", "image/png", "png", 9),
+    "png8": ("PNG", "image/png", "png", 9),
+    "webp": ("WEBP", "image/webp", "webp", 6),
+}
+
+
+@dataclass(frozen=True)
+class Encoding:
+    """
+    How banner images are serialized.
+
+      "png"   32-bit RGBA PNG (the default)
+      "png8"  indexed-palette PNG. Lossless: nearly every banner holds at
+              most 256 distinct RGBA values; the rest fall back to RGBA.
+      "webp"  lossless WebP
+
+    `level` is the zlib level (0-9) for the PNG encodings and the effort
+    method (0-6) for WebP; None keeps Pillow's default.
+    """
+
+    name: str = "png"
+    level: int | None = None
+
+    @property
+    def mimetype(self) -> str:
+        return ENCODING_FORMATS[self.name][1]
+
+    @property
+    def ext(self) -> str:
+        return ENCODING_FORMATS[self.name][2]
+
+    @property
+    def tag(self) -> str:
+        """Suffix that keeps render cache keys distinct per encoding."""
+        if self == DEFAULT_ENCODING:
+            return ""
+        return self.name if self.level is None else f"{self.name}-{self.level}"
+
+    @classmethod
+    def from_tag(cls, tag: str) -> "Encoding | None":
+        if not tag:
+            return DEFAULT_ENCODING
+        name, _, level = tag.partition("-")
+        if name not in ENCODING_FORMATS:
+            return None
+        if not level:
+            return cls(name)
+        return cls(name, int(level)) if level.isdigit() else None
+
+
+DEFAULT_ENCODING = Encoding()
+
+
+def encode_palette_png(img: Image.Image, level: int | None = None) -> bytes | None:
+    """
+    Write an RGBA image as an exact indexed-palette PNG, or return None if it
+    has more than 256 distinct colors.
+
+    Written directly rather than through Image.save: for a 20x40 banner,
+    Pillow's per-save overhead dominates the actual compression.
+    """
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+    pixels = np.frombuffer(img.tobytes(), dtype=np.uint32)
+    ordered = np.sort(pixels)
+    colors = ordered[np.concatenate(([True], ordered[1:] != ordered[:-1]))]
+    if len(colors) > 256:
+        return None
+
+    width, height = img.size
+    rows = np.zeros((height, width + 1), dtype=np.uint8)  # filter byte 0 per row
+    rows[:, 1:] = np.searchsorted(colors, pixels).reshape(height, width)
+    palette = colors.view(np.uint8).reshape(-1, 4)
+    # Pixels are little-endian RGBA, so sorting by uint32 puts opaque colors
+    # last and tRNS only needs the translucent prefix.
+    translucent = int(np.count_nonzero(palette[:, 3] != 255))
+
+    chunks = [
+        banner_mosaic.PNG_SIGNATURE,
+        banner_mosaic.png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)),
+        banner_mosaic.png_chunk(b"PLTE", palette[:, :3].tobytes()),
+    ]
+    if translucent:
+        chunks.append(banner_mosaic.png_chunk(b"tRNS", palette[:translucent, 3].tobytes()))
+    idat = zlib.compress(rows.tobytes(), -1 if level is None else level)
+    chunks.append(banner_mosaic.png_chunk(b"IDAT", idat))
+    chunks.append(banner_mosaic.png_chunk(b"IEND", b""))
+    return b"".join(chunks)
+
+
+def encode_image(img: Image.Image, encoding: Encoding = DEFAULT_ENCODING) -> bytes:
+    """Encode a PIL image; timed as the "<name>_encode" stage."""
+    fmt = ENCODING_FORMATS[encoding.name][0]
+    with banner_metrics.timed(f"{encoding.name}_encode"):
+        if encoding.name == "png8":
+            data = encode_palette_png(img, encoding.level)
+            if data is not None:
+                return data
+
+        params = {}
+        if fmt == "WEBP":
+            params["lossless"] = True
+            if encoding.level is not None:
+                params["method"] = encoding.level
+        elif encoding.level is not None:
+            params["compress_level"] = encoding.level
+
+        buf = io.BytesIO()
+        img.save(buf, format=fmt, **params)
+        return buf.getvalue()
+
+
+def pil_to_data_url(img: Image.Image, encoding: Encoding = DEFAULT_ENCODING) -> str:
+    """Encode a PIL image as a data: URL."""
+    return bytes_to_data_url(encode_image(img, encoding), encoding)
+
+
+def bytes_to_data_url(data: bytes, encoding: Encoding = DEFAULT_ENCODING) -> str:
+    """Wrap already encoded image bytes in a data: URL."""
+    with banner_metrics.timed("base64"):
+        b64 = base64.b64encode(data).decode("ascii")
+    return f"data:{encoding.mimetype};base64,{b64}"
+
+
+# --- Batch rendering ------------------------------------------------------
+#
+# Layer stacks are (N, L) integer arrays: pattern_ids are registry IDs,
+# color_ids index COLOR_NAMES, and -1 marks an unused layer slot. Column 0 is
+# the base layer. Functions take an optional registry so a whole request can
+# work against one snapshot even if banner_cropped/ changes meanwhile.
+
+
+def _build_composite_tables() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Precompute Pillow's alpha_composite coefficients for every
+    (src alpha, dst alpha) pair, flattened as src << 8 | dst.
+
+    Mirrors AlphaComposite.c: 7 extra bits of precision and rounded /255.
+    With src alpha 0 the blend reduces exactly to the destination pixel.
+    """
+    src, dst = np.meshgrid(np.arange(256), np.arange(256), indexing="ij")
+    out_a255 = src * 255 + dst * (255 - src)
+    coef1 = src * (255 * 255 << 7) // np.maximum(out_a255, 1)
+    coef2 = (255 << 7) - coef1
+    tmp = out_a255 + 0x80
+    alpha = ((tmp >> 8) + tmp) >> 8
+    return (
+        coef1.astype(np.uint32).ravel(),
+        coef2.astype(np.uint32).ravel(),
+        alpha.astype(np.intp).ravel(),
+    )
+
+
+COMPOSITE_COEF1, COMPOSITE_COEF2, COMPOSITE_ALPHA = _build_composite_tables()
+
+
+@banner_metrics.timed_stage("composite")
+def composite_banner_batch(
+    pattern_ids: np.ndarray,
+    color_ids: np.ndarray,
+    chunk_size: int = 16,
+    registry: PrimitiveRegistry | None = None,
+) -> np.ndarray:
+    """
+    Composite N layer stacks in one vectorized pass.
+
+    Returns an (N, H, W, 4) uint8 array, pixel-identical to compositing the
+    same stacks with Pillow as render_banner_from_layers does. Banners are
+    processed chunk_size at a time so the temporaries stay cache-sized.
+    """
+    reg = registry or load_registry()
+    shifted = reg.lut_masks
+    pattern_ids = np.asarray(pattern_ids, dtype=np.intp)
+    color_ids = np.asarray(color_ids, dtype=np.intp)
+    n, depth = pattern_ids.shape
+    height, width = shifted.shape[1:]
+
+    active = pattern_ids >= 0
+    pattern_ids = np.where(active, pattern_ids, len(reg.names))
+    color_ids = np.where(active, color_ids, 0)
+
+    # Sort by stack depth so the rows still drawing at column k are a prefix.
+    last_col = np.where(active.any(axis=1), depth - 1 - active[:, ::-1].argmax(axis=1), -1)
+    order = np.argsort(-last_col, kind="stable")
+
+    out = np.empty((n, height, width, 4), dtype=np.uint8)
+    for start in range(0, n, chunk_size):
+        rows = order[start : start + chunk_size]
+        chunk_last = last_col[rows]
+        dst_rgb = np.zeros((len(rows), 3, height, width), dtype=np.uint32)
+        dst_a = np.zeros((len(rows), height, width), dtype=np.intp)
+        scratch = np.empty_like(dst_rgb)
+
+        for col in range(depth):
+            k = int(np.count_nonzero(chunk_last >= col))
+            if not k:
+                break
+            lut_idx = np.take(shifted, pattern_ids[rows[:k], col], axis=0)
+            lut_idx |= dst_a[:k]
+            src_rgb = COLOR_TABLE[color_ids[rows[:k], col]][:, :, None, None]
+
+            # np.take with intp indices is much faster than fancy indexing here
+            rgb = dst_rgb[:k]
+            tmp = scratch[:k]
+            rgb *= np.take(COMPOSITE_COEF2, lut_idx)[:, None]
+            np.multiply(src_rgb, np.take(COMPOSITE_COEF1, lut_idx)[:, None], out=tmp)
+            rgb += tmp
+            rgb += 0x80 << 7
+            np.right_shift(rgb, 8, out=tmp)
+            rgb += tmp
+            rgb >>= 15
+            np.take(COMPOSITE_ALPHA, lut_idx, out=dst_a[:k])
+
+        out[rows, ..., :3] = dst_rgb.transpose(0, 2, 3, 1)
+        out[rows, ..., 3] = dst_a
+    return out
+
+
+def dye_pool(allowed_colors: list[str] | None = None) -> np.ndarray:
+    """COLOR_NAMES indices of allowed_colors; every dye if none are valid."""
+    pool = np.array(
+        [COLOR_INDEX[c] for c in (allowed_colors or []) if c in DYE_COLORS],
+        dtype=np.intp,
+    )
+    return pool if pool.size else np.arange(len(COLOR_NAMES))
+
+
+@banner_metrics.timed_stage("sample")
+def sample_random_stacks(
+    count: int,
+    excluded_patterns: list[str] | None = None,
+    allowed_colors: list[str] | None = None,
+    rng: np.random.Generator | None = None,
+    registry: PrimitiveRegistry | None = None,
+    constraints: banner_sampler.Constraints | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Draw `count` random layer stacks at once, with the same distribution as
+    generate_random_banner. Active constraints are enforced while drawing;
+    see banner_sampler.
+
+    Returns (pattern_ids, color_ids), each (count, 1 + NUM_PATTERN_LAYERS).
+    """
+    rng = rng or np.random.default_rng()
+    reg = registry or load_registry()
+    pattern_pool = reg.pattern_pool(excluded_patterns)
+    color_pool = dye_pool(allowed_colors)
+
+    if constraints is not None and constraints.active():
+        return banner_sampler.sample_stacks(
+            count,
+            NUM_PATTERN_LAYERS,
+            reg.base_id,
+            pattern_pool,
+            color_pool,
+            reg.names,
+            constraint_tables(reg),
+            constraints,
+            rng,
+        )
+
+    pattern_ids = np.full((count, 1 + NUM_PATTERN_LAYERS), -1, dtype=np.intp)
+    color_ids = np.full((count, 1 + NUM_PATTERN_LAYERS), -1, dtype=np.intp)
+    pattern_ids[:, 0] = reg.base_id
+    color_ids[:, 0] = rng.choice(color_pool, size=count)
+
+    if pattern_pool.size:
+        num_layers = rng.integers(0, NUM_PATTERN_LAYERS + 1, size=count)
+        used = np.arange(NUM_PATTERN_LAYERS)[None, :] < num_layers[:, None]
+        shape = (count, NUM_PATTERN_LAYERS)
+        pattern_ids[:, 1:] = np.where(used, rng.choice(pattern_pool, size=shape), -1)
+        color_ids[:, 1:] = np.where(used, rng.choice(color_pool, size=shape), -1)
+
+    return pattern_ids, color_ids
+
+
+def constraint_tables(registry: PrimitiveRegistry | None = None) -> banner_sampler.Tables:
+    """banner_sampler tables for the registry's masks and DYE_COLORS, built once per version."""
+    global sampler_tables
+    reg = registry or load_registry()
+    cached = sampler_tables
+    if cached is not None and cached[0] == reg.version:
+        return cached[1]
+    tables = banner_sampler.build_tables(reg.masks, COLOR_TABLE)
+    sampler_tables = (reg.version, tables)
+    return tables
+
+
+def stack_to_layers(
+    pattern_row: np.ndarray,
+    color_row: np.ndarray,
+    registry: PrimitiveRegistry | None = None,
+) -> list[dict]:
+    """Convert one row of a batch stack back into layer dicts."""
+    names = (registry or load_registry()).names
+    layers: list[dict] = []
+    for col, (pid, cid) in enumerate(zip(pattern_row.tolist(), color_row.tolist())):
+        if pid < 0:
+            continue
+        layers.append(
+            {
+                "kind": "base" if col == 0 else "pattern",
+                "pattern": names[pid],
+                "color": COLOR_NAMES[cid],
+            }
+        )
+    return layers
+
+
+def generate_random_banner_pixels(
+    count: int,
+    excluded_patterns: list[str] | None = None,
+    allowed_colors: list[str] | None = None,
+    constraints: banner_sampler.Constraints | None = None,
+) -> tuple[np.ndarray, list[list[dict]]]:
+    """
+    Sample and composite `count` random banners in one batch.
+
+    Returns ((count, H, W, 4) uint8 pixels, per-banner layer dicts).
+    """
+    reg = load_registry()
+    if reg.base_id < 0:
+        # Failsafe: blank banners
+        height, width = reg.masks.shape[1:]
+        return np.zeros((count, height, width, 4), dtype=np.uint8), [[] for _ in range(count)]
+
+    pattern_ids, color_ids = sample_random_stacks(
+        count, excluded_patterns, allowed_colors, registry=reg, constraints=constraints
+    )
+    pixels = composite_banner_batch(pattern_ids, color_ids, registry=reg)
+    layers = [stack_to_layers(pattern_ids[i], color_ids[i], reg) for i in range(count)]
+    return pixels, layers
+
+
+def generate_random_stacks(
+    count: int,
+    excluded_patterns: list[str] | None = None,
+    allowed_colors: list[str] | None = None,
+    registry: PrimitiveRegistry | None = None,
+    constraints: banner_sampler.Constraints | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """sample_random_stacks, or blank stacks when base.png is missing."""
+    reg = registry or load_registry()
+    if reg.base_id < 0:
+        blank = np.full((count, 1), -1, dtype=np.intp)
+        return blank, blank.copy()
+    return sample_random_stacks(
+        count, excluded_patterns, allowed_colors, registry=reg, constraints=constraints
+    )
+
+
+def generate_random_layers(
+    count: int,
+    excluded_patterns: list[str] | None = None,
+    allowed_colors: list[str] | None = None,
+    constraints: banner_sampler.Constraints | None = None,
+) -> list[list[dict]]:
+    """
+    Sample `count` random layer stacks without rendering them, for clients
+    that composite themselves (see /api/primitives).
+    """
+    reg = load_registry()
+    pattern_ids, color_ids = generate_random_stacks(
+        count, excluded_patterns, allowed_colors, registry=reg, constraints=constraints
+    )
+    return [stack_to_layers(pattern_ids[i], color_ids[i], reg) for i in range(count)]
+
+
+def generate_random_banners(
+    count: int,
+    excluded_patterns: list[str] | None = None,
+    allowed_colors: list[str] | None = None,
+    constraints: banner_sampler.Constraints | None = None,
+) -> list[tuple[Image.Image, list[dict]]]:
+    """Batch counterpart of generate_random_banner."""
+    pixels, layers = generate_random_banner_pixels(
+        count, excluded_patterns, allowed_colors, constraints
+    )
+    return [(Image.fromarray(pixels[i]), layers[i]) for i in range(count)]
+
+
+def run_render_tasks(fn, items: list) -> list:
+    """
+    [fn(item) for item in items], run on render_pool as one fair batch in
+    async mode (see banner_pool). Tasks see a copy of the current request
+    context, so url_for works in them. Raises banner_pool.Saturated when the
+    pool is full.
+    """
+    if render_pool is None or not items:
+        return [fn(item) for item in items]
+    tasks = [functools.partial(fn, item) for item in items]
+    if flask.has_request_context():
+        tasks = [flask.copy_current_request_context(task) for task in tasks]
+    with render_pool.batch(len(tasks)) as batch:
+        futures = [batch.submit(task) for task in tasks]
+        return [f.result() for f in futures]
+
+
+def _chunks(items: list, size: int = RENDER_CHUNK_SIZE) -> list[list]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def _chunk_sizes(count: int, size: int = RENDER_CHUNK_SIZE) -> list[int]:
+    return [min(size, count - i) for i in range(0, count, size)]
+
+
+def render_random_srcs(
+    count: int,
+    output: str,
+    encoding: Encoding = DEFAULT_ENCODING,
+    excluded_patterns: list[str] | None = None,
+    allowed_colors: list[str] | None = None,
+    constraints: banner_sampler.Constraints | None = None,
+) -> list[tuple[str, list[dict]]]:
+    """
+    Sample, render and encode `count` random banners as (src, layers),
+    RENDER_CHUNK_SIZE per task; see run_render_tasks and banner_src.
+    """
+
+    def render(n: int) -> list[tuple[str, list[dict]]]:
+        return [
+            (banner_src(img, layers, output, encoding), layers)
+            for img, layers in generate_random_banners(
+                n, excluded_patterns, allowed_colors, constraints
+            )
+        ]
+
+    return [banner for part in run_render_tasks(render, _chunk_sizes(count)) for banner in part]
+
+
+def render_random_pixels(
+    count: int,
+    excluded_patterns: list[str] | None = None,
+    allowed_colors: list[str] | None = None,
+    constraints: banner_sampler.Constraints | None = None,
+) -> tuple[np.ndarray, list[list[dict]]]:
+    """generate_random_banner_pixels, split into tasks like render_random_srcs."""
+    parts = run_render_tasks(
+        lambda n: generate_random_banner_pixels(n, excluded_patterns, allowed_colors, constraints),
+        _chunk_sizes(count),
+    )
+    if not parts:
+        return generate_random_banner_pixels(0, excluded_patterns, allowed_colors)
+    return (
+        np.concatenate([pixels for pixels, _ in parts]),
+        [layers for _, part_layers in parts for layers in part_layers],
+    )
+
+
+def stacks_from_layers(
+    layer_lists: list[list[dict]],
+    registry: PrimitiveRegistry | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Convert layer dict lists into batch (pattern_ids, color_ids) arrays that
+    composite exactly like render_banner_from_layers. Unknown patterns are
+    skipped and empty lists become blank (all -1) rows.
+    """
+    reg = registry or load_registry()
+    stacks = [
+        [
+            (reg.ids[p], COLOR_INDEX[c])
+            for p, c in prune_layers(canonical_layers(layers), reg)
+            if p in reg.ids
+        ]
+        for layers in layer_lists
+    ]
+    depth = max((len(stack) for stack in stacks), default=0)
+    pattern_ids = np.full((len(stacks), max(depth, 1)), -1, dtype=np.intp)
+    color_ids = np.full((len(stacks), max(depth, 1)), -1, dtype=np.intp)
+    for row, stack in enumerate(stacks):
+        for col, (pid, cid) in enumerate(stack):
+            pattern_ids[row, col] = pid
+            color_ids[row, col] = cid
+    return pattern_ids, color_ids
+
+
+def pixels_to_atlas(pixels: np.ndarray, columns: int) -> Image.Image:
+    """Tile (N, H, W, 4) banner pixels row-major into one atlas image."""
+    n, height, width, _ = pixels.shape
+    rows = max(1, -(-n // columns))
+    tiles = np.zeros((rows * columns, height, width, 4), dtype=np.uint8)
+    tiles[:n] = pixels
+    tiles = tiles.reshape(rows, columns, height, width, 4).transpose(0, 2, 1, 3, 4)
+    return Image.fromarray(tiles.reshape(rows * height, columns * width, 4))
+
+
+def atlas_response(
+    width: int,
+    height: int,
+    pixels: np.ndarray,
+    layers: list[list[dict]],
+    encoding: Encoding | None = None,
+    extra: dict | None = None,
+    compact: bool = False,
+):
+    """
+    Build the "output": "atlas" response: one PNG holding every cell
+    plus per-cell layers and pixel offsets into it. `extra` adds top-level
+    fields. With `compact` the layers come as compact "stacks" and offsets
+    are left to the client: cell i sits at column i % width, row i // width.
+    """
+    cell_h, cell_w = pixels.shape[1:3]
+    atlas = {
+        "src": pil_to_data_url(pixels_to_atlas(pixels, width), encoding or DEFAULT_ENCODING),
+        "cell_width": cell_w,
+        "cell_height": cell_h,
+    }
+    if compact:
+        return compact_response(layers, width=width, height=height, atlas=atlas, **(extra or {}))
+    banners = [
+        {
+            "slug": uuid.uuid4().hex[:8],
+            "layers": cell_layers,
+            "x": (i % width) * cell_w,
+            "y": (i // width) * cell_h,
+        }
+        for i, cell_layers in enumerate(layers)
+    ]
+    return jsonify(
+        {
+            "width": width,
+            "height": height,
+            "atlas": atlas,
+            "banners": banners,
+            **(extra or {}),
+        }
+    )
+
+
+def primitive_atlas_png(registry: PrimitiveRegistry | None = None) -> bytes:
+    """
+    Every primitive's alpha mask side by side in registry ID order, as a
+    white RGBA PNG: cell i is x = i * W. Encoded once per registry version.
+    """
+    global primitive_atlas
+    reg = registry or load_registry()
+    cached = primitive_atlas
+    if cached is not None and cached[0] == reg.version:
+        return cached[1]
+
+    count, height, width = reg.masks.shape
+    strip = np.asarray(reg.masks).transpose(1, 0, 2).reshape(height, count * width)
+    png = encode_image(banner_bundle.mask_to_image(strip))
+    primitive_atlas = (reg.version, png)
+    return png
+
+
+# --- Layer canonicalization ---------------------------------------------
+
+
+def canonical_layers(layers: list[dict]) -> list[tuple[str, str]]:
+    """
+    Reduce layer dicts to the (pattern, color) pairs that
+    render_banner_from_layers actually draws, base first.
+
+    An empty list stays empty and stands for a blank banner.
+    """
+    if not layers:
+        return []
+
+    base_layer = next((l for l in layers if l.get("kind") == "base"), None)
+    if base_layer is None:
+        base_layer = {"kind": "base", "pattern": "base.png", "color": "white"}
+
+    def color_of(layer: dict, default: str | None) -> str:
+        color = layer.get("color", default)
+        return color if color in DYE_COLORS else "white"
+
+    canon = [(base_layer.get("pattern", "base.png"), color_of(base_layer, "white"))]
+    for layer in layers:
+        if layer.get("kind") == "base":
+            continue
+        pattern_name = layer.get("pattern")
+        if not pattern_name or not layer.get("color"):
+            continue
+        canon.append((pattern_name, color_of(layer, None)))
+    return canon
+
+
+def prune_layers(
+    pairs: list[tuple[str, str]],
+    registry: PrimitiveRegistry | None = None,
+) -> list[tuple[str, str]]:
+    """
+    Drop layers that cannot change the rendered banner, using the registry's
+    per-primitive coverage bitmasks. Base stays first. The result renders
+    pixel-identically to the input.
+
+      - Bottom-up: a layer is a no-op when every pixel it touches is already
+        opaque in its own color. Blending a color over itself is exact in
+        Pillow's arithmetic, so this covers repeated identical layers.
+      - Top-down: a layer is occluded when every pixel it touches is opaque
+        in some layer above it.
+      - A fully occluded base is kept but its color normalized to white.
+
+    Unknown patterns are dropped, as render_banner_from_layers skips them.
+    """
+    if not pairs:
+        return []
+    reg = registry or load_registry()
+    base_pattern, base_color = pairs[0]
+    if base_pattern not in reg.ids:
+        return list(pairs)
+
+    # Pixels known to be opaque in each color after the layers kept so far.
+    base_id = reg.ids[base_pattern]
+    solid = {base_color: reg.opaque_bits[base_id]}
+    kept = [(base_id, base_color)]
+    for pattern, color in pairs[1:]:
+        pid = reg.ids.get(pattern)
+        if pid is None:
+            continue
+        visible = reg.visible_bits[pid]
+        if not visible or visible & ~solid.get(color, 0) == 0:
+            continue
+        opaque = reg.opaque_bits[pid]
+        for other in solid:
+            if other != color:
+                solid[other] &= ~visible
+        solid[color] = solid.get(color, 0) | opaque
+        kept.append((pid, color))
+
+    covered = 0
+    pruned: list[tuple[int, str]] = []
+    for pid, color in reversed(kept[1:]):
+        if reg.visible_bits[pid] & ~covered:
+            pruned.append((pid, color))
+            covered |= reg.opaque_bits[pid]
+    if reg.visible_bits[base_id] & ~covered == 0:
+        base_color = "white"
+
+    pruned.append((base_id, base_color))
+    return [(reg.names[pid], color) for pid, color in reversed(pruned)]
+
+
+def canonicalize_layers(
+    layers: list[dict],
+    registry: PrimitiveRegistry | None = None,
+) -> list[dict]:
+    """
+    Return the minimal layer dicts that render exactly like `layers`:
+    normalized by canonical_layers, then pruned by prune_layers. Visually
+    identical stacks produced this way compare (and hash) equal.
+    """
+    pairs = prune_layers(canonical_layers(layers), registry)
+    return [
+        {"kind": "base" if i == 0 else "pattern", "pattern": pattern, "color": color}
+        for i, (pattern, color) in enumerate(pairs)
+    ]
+
+
+# --- Compact layer format -------------------------------------------------
+#
+# Opt-in ("format": "compact") alternative to per-banner layer dicts in API
+# bodies:
+#
+#   "stacks": {
+#     "patterns": [ "base.png", ... ],   pattern names, indexed by the data
+#     "colors": [ "white", ... ],        dye names, likewise
+#     "depth": <int>,                    layer slots per banner
+#     "data": "<base64>"                 N * depth (pattern, dye) byte pairs
+#   }
+#
+# The tables are sent once per body and every banner is `depth` byte pairs,
+# base layer first. Unused slots are COMPACT_EMPTY; a blank banner is all
+# padding. "data" decodes straight into a Uint8Array on the client.
+
+COMPACT_EMPTY = 255
+
+
+def _wants_compact(data: dict) -> bool:
+    return data.get("format") == "compact"
+
+
+def compact_stacks(
+    layer_lists: list[list[dict]],
+    registry: PrimitiveRegistry | None = None,
+) -> dict:
+    """
+    Pack layer dicts into the compact form, in canonical_layers order with
+    unknown patterns left out. The registry names are the pattern table.
+    """
+    reg = registry or load_registry()
+    stacks = []
+    for layers in layer_lists:
+        pairs = canonical_layers(layers)
+        if pairs and pairs[0][0] not in reg.ids:
+            pairs = []  # no base to draw on
+        stacks.append([(reg.ids[p], COLOR_INDEX[c]) for p, c in pairs if p in reg.ids])
+
+    depth = max((len(stack) for stack in stacks), default=0)
+    pattern_ids = np.full((len(stacks), depth), -1, dtype=np.intp)
+    color_ids = np.full((len(stacks), depth), -1, dtype=np.intp)
+    for row, stack in enumerate(stacks):
+        for col, (pid, cid) in enumerate(stack):
+            pattern_ids[row, col] = pid
+            color_ids[row, col] = cid
+    return compact_stacks_from_ids(pattern_ids, color_ids, reg)
+
+
+def compact_stacks_from_ids(
+    pattern_ids: np.ndarray,
+    color_ids: np.ndarray,
+    registry: PrimitiveRegistry | None = None,
+) -> dict:
+    """Pack batch stacks (see "Batch rendering") into the compact form."""
+    reg = registry or load_registry()
+    packed = np.stack([pattern_ids, color_ids], axis=-1)
+    packed = np.where(packed >= 0, packed, COMPACT_EMPTY).astype(np.uint8)
+    return {
+        "patterns": reg.names,
+        "colors": COLOR_NAMES,
+        "depth": packed.shape[1],
+        "data": base64.b64encode(packed.tobytes()).decode("ascii"),
+    }
+
+
+def layers_from_compact(stacks: dict) -> list[list[dict]]:
+    """
+    Unpack the compact form into layer dicts. Indices outside the tables are
+    skipped like unknown patterns; raises ValueError if the body is malformed.
+    """
+    try:
+        patterns = [str(p) for p in stacks["patterns"]]
+        colors = [str(c) for c in stacks["colors"]]
+        depth = int(stacks["depth"])
+        raw = base64.b64decode(stacks["data"], validate=True)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"malformed compact stacks: {e}") from None
+    if depth < 0 or (raw and (not depth or len(raw) % (2 * depth))):
+        raise ValueError("compact stack data is not a whole number of stacks")
+
+    layer_lists: list[list[dict]] = []
+    for row in range(len(raw) // (2 * depth) if depth else 0):
+        layers = []
+        for col in range(depth):
+            pid, cid = raw[2 * (row * depth + col)], raw[2 * (row * depth + col) + 1]
+            if pid >= len(patterns) or cid >= len(colors):
+                continue
+            layers.append(
+                {
+                    "kind": "base" if col == 0 else "pattern",
+                    "pattern": patterns[pid],
+                    "color": colors[cid],
+                }
+            )
+        layer_lists.append(layers)
+    return layer_lists
+
+
+def compact_response(
+    stacks: list[list[dict]] | dict,
+    srcs: list[str] | None = None,
+    **fields,
+):
+    """
+    A "format": "compact" response: `fields`, the stacks (layer dicts or an
+    already packed dict) and per-banner srcs.
+    """
+    if not isinstance(stacks, dict):
+        stacks = compact_stacks(stacks)
+    body = {"format": "compact", **fields, "stacks": stacks}
+    if srcs is not None:
+        body["srcs"] = srcs
+    return jsonify(body)
+
+
+# --- Render cache ---------------------------------------------------------
+
+
+def layers_hash(layers: list[dict]) -> str:
+    """Content hash of a layer stack; visually identical stacks share it."""
+    reg = load_registry()
+    canon = prune_layers(canonical_layers(layers), reg)
+    payload = reg.version + json.dumps(canon, separators=(",", ":"))
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def render_key(layers: list[dict], encoding: Encoding = DEFAULT_ENCODING) -> str:
+    """Render cache key: layers_hash plus the encoding's tag, if any."""
+    key = layers_hash(layers)
+    return f"{key}_{encoding.tag}" if encoding.tag else key
+
+
+def render_cache_get(key: str) -> bytes | None:
+    """Look a key up in memory, then in the disk cache if enabled."""
+    with render_cache_lock:
+        png = render_cache.get(key)
+        if png is not None:
+            render_cache.move_to_end(key)
+            return png
+    if disk_cache is not None:
+        png = disk_cache.get(key)
+        if png is not None:
+            _memory_cache_put(key, png)
+    return png
+
+
+def render_cache_put(key: str, png: bytes) -> None:
+    _memory_cache_put(key, png)
+    if disk_cache is not None:
+        disk_cache.put(key, png)
+
+
+def _memory_cache_put(key: str, png: bytes) -> None:
+    with render_cache_lock:
+        render_cache[key] = png
+        render_cache.move_to_end(key)
+        while len(render_cache) > RENDER_CACHE_MAX_ENTRIES:
+            render_cache.popitem(last=False)
+
+
+def cached_banner_image(
+    layers: list[dict],
+    img: Image.Image | None = None,
+    encoding: Encoding = DEFAULT_ENCODING,
+) -> tuple[str, bytes]:
+    """
+    Return (key, encoded image) for `layers` from the render cache, adding
+    it on a miss.
+
+    `img` may be passed when the banner is already rendered; otherwise it is
+    rendered only on a cache miss. An empty stack renders as a blank banner.
+    """
+    key = render_key(layers, encoding)
+    data = render_cache_get(key)
+    if data is None:
+        if img is None:
+            if layers:
+                img = _render_layers(layers)
+            else:
+                img = Image.new("RGBA", (20, 40), (0, 0, 0, 0))
+        data = encode_image(img, encoding)
+        render_cache_put(key, data)
+    return key, data
+
+
+def cache_banner_image(
+    layers: list[dict],
+    img: Image.Image | None = None,
+    encoding: Encoding = DEFAULT_ENCODING,
+) -> str:
+    """Make sure the encoded image for `layers` is in the render cache and return its key."""
+    return cached_banner_image(layers, img, encoding)[0]
+
+
+def banner_src(
+    img: Image.Image | None,
+    layers: list[dict],
+    output: str,
+    encoding: Encoding = DEFAULT_ENCODING,
+) -> str:
+    """
+    Return the "src" value for a banner in the requested output mode:
+    "data" inlines a data: URL, "url" points at /api/banner/<key>.<ext>.
+
+    `img` may be None, and is then rendered only when needed. With the disk
+    cache enabled, "data" for such a stack goes through the render cache
+    too, so a stack any worker process encoded before is neither composited
+    nor encoded again. Already rendered random banners, which rarely
+    repeat, are encoded directly.
+    """
+    if output == "url":
+        key = cache_banner_image(layers, img, encoding)
+        return url_for("api_banner_image", key=key, ext=encoding.ext)
+    if disk_cache is not None and img is None:
+        return bytes_to_data_url(cached_banner_image(layers, img, encoding)[1], encoding)
+    if img is None:
+        img = render_banner_from_layers(layers)
+    return pil_to_data_url(img, encoding)
+
+
+def jsonify(*args, **kwargs):
+    """flask.jsonify, timed as the "jsonify" stage."""
+    with banner_metrics.timed("jsonify"):
+        return flask.jsonify(*args, **kwargs)
+
+
+def _parse_output(data: dict, allowed: tuple[str, ...] = ("data", "url")) -> str:
+    """Read the requested "output" mode from a JSON body, defaulting to "data"."""
+    output = data.get("output", "data")
+    return output if output in allowed else "data"
+
+
+def _parse_encoding(data: dict) -> Encoding:
+    """
+    Read "encoding" ("png" | "png8" | "webp") and "compress_level" from a
+    JSON body. Without an explicit "encoding", a request whose Accept header
+    lists image/webp gets WebP.
+    """
+    name = data.get("encoding")
+    if name not in ENCODING_FORMATS:
+        accepts_webp = any(
+            mimetype == "image/webp" and quality > 0
+            for mimetype, quality in request.accept_mimetypes
+        )
+        name = "webp" if accepts_webp else "png"
+
+    level = data.get("compress_level")
+    try:
+        level = min(max(int(level), 0), ENCODING_FORMATS[name][3])
+    except (TypeError, ValueError):
+        level = None
+    return Encoding(name, level)
+
+
+# --- Mosaic export --------------------------------------------------------
+
+
+def mosaic_size(columns: int, rows: int, registry: PrimitiveRegistry | None = None) -> tuple[int, int]:
+    """Pixel size of a columns x rows wall before upscaling."""
+    height, width = (registry or load_registry()).masks.shape[1:]
+    return columns * width, rows * height
+
+
+def mirror_table(axis: str, role: str, registry: PrimitiveRegistry | None = None) -> np.ndarray:
+    """
+    Pattern-ID form of _translate_pattern: table[pid] is the ID pid maps to
+    for this axis and role, or -1 if the target file is missing (the layer
+    is then skipped, as render_banner_from_layers does).
+    """
+    reg = registry or load_registry()
+    return np.array(
+        [reg.ids.get(_translate_pattern(name, role=role, axis=axis), -1) for name in reg.names],
+        dtype=np.intp,
+    )
+
+
+def _mirror_sources(n: int, axis: str) -> tuple[list[int], list[str]]:
+    """
+    For each of n rows (horizontal) or columns (vertical): the index it is
+    copied from and its mirror role, as in /api/mirror_grid.
+    """
+    first, second = ("top", "bottom") if axis == "horizontal" else ("left", "right")
+    sources, roles = [], []
+    for i in range(n):
+        j = n - 1 - i
+        sources.append(min(i, j))
+        roles.append(first if i < j else second if i > j else "middle")
+    return sources, roles
+
+
+def _apply_mirror(pattern_ids: np.ndarray, table: np.ndarray) -> np.ndarray:
+    """Translate the pattern columns of a stack batch; base is kept as-is."""
+    out = pattern_ids.copy()
+    layers = out[:, 1:]
+    out[:, 1:] = np.where(layers >= 0, table[layers], -1)
+    return out
+
+
+def mosaic_bands(
+    columns: int,
+    rows: int,
+    mirror: str = "none",
+    seed: int = 0,
+    excluded_patterns: list[str] | None = None,
+    allowed_colors: list[str] | None = None,
+    registry: PrimitiveRegistry | None = None,
+    constraints: banner_sampler.Constraints | None = None,
+) -> Iterator[np.ndarray]:
+    """
+    Render a columns x rows wall of random banners one banner row at a time,
+    yielding (banner height, columns * banner width, 4) uint8 bands from top
+    to bottom; see banner_mosaic.iter_png.
+
+    mirror is "none", "horizontal" (bottom rows mirror the top ones),
+    "vertical" (right columns mirror the left ones) or "both", using the
+    same maps and roles as /api/mirror_grid. Each source row has its own
+    RNG seeded from (seed, row), so a mirrored row re-draws the row it
+    copies instead of the whole wall being kept around. Constraints apply
+    to the drawn stacks; mirroring then swaps patterns for their mirror
+    images.
+    """
+    reg = registry or load_registry()
+    height, width = reg.masks.shape[1:]
+    tables: dict[tuple[str, str], np.ndarray] = {}
+
+    def table(axis: str, role: str) -> np.ndarray:
+        if (axis, role) not in tables:
+            tables[axis, role] = mirror_table(axis, role, reg)
+        return tables[axis, role]
+
+    if mirror in ("horizontal", "both"):
+        row_sources, row_roles = _mirror_sources(rows, "horizontal")
+    else:
+        row_sources, row_roles = list(range(rows)), [None] * rows
+    if mirror in ("vertical", "both"):
+        col_sources, col_roles = _mirror_sources(columns, "vertical")
+        col_roles = np.array(col_roles)
+    else:
+        col_sources, col_roles = None, None
+
+    for row_source, row_role in zip(row_sources, row_roles):
+        pattern_ids, color_ids = sample_random_stacks(
+            columns,
+            excluded_patterns=excluded_patterns,
+            allowed_colors=allowed_colors,
+            rng=np.random.default_rng([seed, row_source]),
+            registry=reg,
+            constraints=constraints,
+        )
+        if row_role is not None:
+            pattern_ids = _apply_mirror(pattern_ids, table("horizontal", row_role))
+        if col_sources is not None:
+            pattern_ids, color_ids = pattern_ids[col_sources], color_ids[col_sources]
+            for role in ("left", "right", "middle"):
+                cols = col_roles == role
+                if cols.any():
+                    pattern_ids[cols] = _apply_mirror(pattern_ids[cols], table("vertical", role))
+
+        pixels = composite_banner_batch(pattern_ids, color_ids, registry=reg)
+        yield pixels.transpose(1, 0, 2, 3).reshape(height, columns * width, 4)
+
+
+# --- Near-duplicate detection ---------------------------------------------
+#
+# "unique" requests to /api/generate only get banners whose perceptual hash
+# is further than a Hamming distance from every banner this process served
+# that way before. Hidden layers leave the pixels, and so the hash, as they
+# are, and a near-identical dye moves only a few bits.
+
+
+def perceptual_hasher(registry: PrimitiveRegistry | None = None) -> banner_phash.PerceptualHasher:
+    """
+    The perceptual hasher for the registry, fitted once per registry version
+    to UNIQUE_FIT_SAMPLE seeded random banners. A new version also empties
+    seen_banners, whose hashes the new hasher cannot be compared with.
+    """
+    global banner_hasher
+    reg = registry or load_registry()
+    cached = banner_hasher
+    if cached is not None and cached[0] == reg.version:
+        return cached[1]
+    with banner_hasher_lock:
+        if banner_hasher is None or banner_hasher[0] != reg.version:
+            rng = np.random.default_rng(0)  # same hashes after a restart
+            stacks = sample_random_stacks(UNIQUE_FIT_SAMPLE, rng=rng, registry=reg)
+            pixels = composite_banner_batch(*stacks, registry=reg)
+            banner_hasher = (reg.version, banner_phash.PerceptualHasher.fit(pixels))
+            seen_banners.clear()
+        return banner_hasher[1]
+
+
+def _parse_unique(data: dict) -> int | None:
+    """
+    Read "unique" and "unique_distance" from a JSON body: the Hamming
+    distance at which a banner counts as a repeat, or None for no check.
+    """
+    if not data.get("unique"):
+        return None
+    try:
+        distance = int(data.get("unique_distance", UNIQUE_DISTANCE))
+    except (TypeError, ValueError):
+        distance = UNIQUE_DISTANCE
+    return min(max(distance, 0), UNIQUE_MAX_DISTANCE)
+
+
+def _parse_constraints(data: dict) -> banner_sampler.Constraints | None:
+    """
+    Read "pattern_weights", "distinct_patterns", "min_top_coverage" and
+    "min_contrast" from a JSON body; None when none of them applies.
+    Malformed and non-finite values are ignored and the rest clamped, like
+    "count"; weights to [0, banner_sampler.MAX_WEIGHT].
+    """
+    weights: dict[str, float] = {}
+    raw = data.get("pattern_weights")
+    if isinstance(raw, dict):
+        for name, weight in raw.items():
+            try:
+                weight = float(weight)
+            except (TypeError, ValueError):
+                continue
+            if math.isfinite(weight):
+                weights[str(name)] = min(max(weight, 0.0), banner_sampler.MAX_WEIGHT)
+
+    def number(key: str) -> float:
+        try:
+            value = float(data.get(key) or 0)
+        except (TypeError, ValueError):
+            return 0.0
+        return value if math.isfinite(value) else 0.0
+
+    constraints = banner_sampler.Constraints(
+        pattern_weights=weights,
+        distinct_patterns=bool(data.get("distinct_patterns")),
+        min_top_coverage=min(max(number("min_top_coverage"), 0.0), 1.0),
+        min_contrast=max(number("min_contrast"), 0.0),
+    )
+    return constraints if constraints.active() else None
+
+
+def _query_constraints(args) -> banner_sampler.Constraints | None:
+    """
+    _parse_constraints for query args, with "pattern_weights" as
+    comma-separated name:weight pairs, e.g. "border.png:0.2,bricks.png:3".
+    """
+    weights = {}
+    for item in args.get("pattern_weights", "").split(","):
+        name, _, weight = item.partition(":")
+        if name and weight:
+            weights[name] = weight
+    return _parse_constraints(
+        {
+            "pattern_weights": weights,
+            "distinct_patterns": args.get("distinct_patterns", "").lower() in ("1", "true", "yes"),
+            "min_top_coverage": args.get("min_top_coverage"),
+            "min_contrast": args.get("min_contrast"),
+        }
+    )
+
 
-            layers.append(
-                {
-                    "kind": "pattern",
-                    "pattern": pat_file,
-                    "color": dye_name,
-                }
-            )
+def render_unique_banners(
+    count: int,
+    distance: int,
+    output: str,
+    encoding: Encoding = DEFAULT_ENCODING,
+    excluded_patterns: list[str] | None = None,
+    allowed_colors: list[str] | None = None,
+    constraints: banner_sampler.Constraints | None = None,
+) -> list[tuple[str | None, list[dict]]]:
+    """
+    render_random_srcs, but only banners further than `distance` from every
+    banner served this way before and from each other. src is None with
+    output "layers".
+
+    Candidates are sampled, composited and hashed in batches, and only the
+    banners kept are encoded. Fewer than `count` come back if
+    UNIQUE_MAX_ROUNDS batches do not turn up enough new ones, e.g. when the
+    exclude lists leave few designs.
+    """
+    reg = load_registry()
+    hasher = perceptual_hasher(reg)
 
-    return result, layers
+    def candidates(n: int) -> tuple[np.ndarray, list[list[dict]], np.ndarray]:
+        pixels, layers = generate_random_banner_pixels(
+            n, excluded_patterns, allowed_colors, constraints
+        )
+        return pixels, layers, hasher(pixels)
+
+    kept: list[tuple[np.ndarray, list[dict]]] = []
+    for _ in range(UNIQUE_MAX_ROUNDS):
+        missing = count - len(kept)
+        if missing <= 0:
+            break
+        if len(seen_banners) >= UNIQUE_INDEX_MAX:
+            seen_banners.clear()
+        # Oversample a little so that the usual few repeats cost no extra round.
+        for pixels, layers, hashes in run_render_tasks(
+            candidates, _chunk_sizes(missing + missing // 8 + 1)
+        ):
+            for i in seen_banners.add_unique(hashes, distance, limit=count - len(kept)):
+                kept.append((pixels[i], layers[i]))
+
+    if output == "layers":
+        return [(None, layers) for _, layers in kept]
+
+    def encode(part: list[tuple[np.ndarray, list[dict]]]) -> list[tuple[str, list[dict]]]:
+        return [
+            (banner_src(Image.fromarray(pixels), layers, output, encoding), layers)
+            for pixels, layers in part
+        ]
 
+    return [banner for part in run_render_tasks(encode, _chunks(kept)) for banner in part]
 
-def render_banner_from_layers(layers: list[dict]) -> Image.Image:
+
+# --- Image approximation --------------------------------------------------
+
+
+@banner_metrics.timed_stage("approximate")
+def approximate_banner(
+    img: Image.Image,
+    max_layers: int = NUM_PATTERN_LAYERS,
+    beam_width: int = 16,
+    time_budget: float | None = None,
+    fit: str = "stretch",
+    excluded_patterns: list[str] | None = None,
+    allowed_colors: list[str] | None = None,
+) -> tuple[list[dict], banner_approx.Approximation]:
     """
-    Deterministically render a banner from a list of layer dicts
-    like the ones returned by generate_random_banner.
+    Find the layer stack whose banner looks most like `img`; see
+    banner_approx. Returns (layer dicts, search result).
     """
-    # Find base layer if present
-    base_layer = None
-    for layer in layers:
-        if layer.get("kind") == "base":
-            base_layer = layer
-            break
+    reg = load_registry()
+    if reg.base_id < 0:
+        raise ValueError("base.png is missing")
+    height, width = reg.masks.shape[1:]
+    target, weights = banner_approx.prepare_target(img, fit, (width, height))
+    result = banner_approx.beam_search(
+        target,
+        weights,
+        reg.masks,
+        COLOR_TABLE,
+        reg.base_id,
+        reg.pattern_pool(excluded_patterns),
+        dye_pool(allowed_colors),
+        max_layers=max_layers,
+        beam_width=beam_width,
+        time_budget=time_budget,
+    )
+    layers = [
+        {"kind": "base" if i == 0 else "pattern", "pattern": reg.names[pid], "color": COLOR_NAMES[cid]}
+        for i, (pid, cid) in enumerate(zip(result.pattern_ids, result.color_ids))
+    ]
+    return layers, result
 
-    if base_layer is None:
-        # Fallback: assume base.png with white if no explicit base
-        base_layer = {"kind": "base", "pattern": "base.png", "color": "white"}
 
-    base_pattern = base_layer.get("pattern", "base.png")
-    base_color_name = base_layer.get("color", "white")
-    base_rgb = DYE_COLORS.get(base_color_name, (255, 255, 255))
+def _list_param(params, name: str) -> list[str]:
+    """
+    A list of strings from JSON, or comma-separated from form fields.
+    Raises ValueError for any other type.
+    """
+    value = params.get(name) or []
+    if isinstance(value, str):
+        return [v for v in value.split(",") if v]
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"{name} must be a list of strings")
+    return value
 
-    base_img = load_primitive(base_pattern)
-    width, height = base_img.size
-    result = Image.new("RGBA", (width, height), (0, 0, 0, 0))
 
-    # Draw base first
-    base_colored = colorize_mask(base_img, base_rgb)
-    result.alpha_composite(base_colored)
+# --- Background jobs ------------------------------------------------------
 
-    # Draw the rest in order, skipping base since we already handled it
+
+def run_generate_job(
+    job: banner_jobs.Job,
+    excluded_patterns: list[str],
+    allowed_colors: list[str],
+    encoding: Encoding,
+    constraints: banner_sampler.Constraints | None = None,
+) -> None:
+    """
+    Render job.total random banners into a zip at job.path: one image per
+    banner plus manifest.jsonl, a {"file", "layers"} line per banner.
+
+    Images are stored uncompressed in the zip, since they are compressed
+    already. The manifest is spooled to disk, so memory does not grow with
+    the job.
+    """
+    tmp_path = job.path.with_suffix(".zip.tmp")
+    manifest_path = job.path.with_suffix(".jsonl.tmp")
+    try:
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED) as zf, \
+                open(manifest_path, "w", encoding="utf-8") as manifest:
+            index = 0
+            while index < job.total:
+                job.check()
+                batch = min(JOB_BATCH_SIZE, job.total - index)
+                for img, layers in generate_random_banners(
+                    batch,
+                    excluded_patterns=excluded_patterns,
+                    allowed_colors=allowed_colors,
+                    constraints=constraints,
+                ):
+                    name = f"banner_{index:07d}.{encoding.ext}"
+                    zf.writestr(name, encode_image(img, encoding))
+                    manifest.write(json.dumps({"file": name, "layers": layers}) + "\n")
+                    index += 1
+                job.advance(batch)
+                time.sleep(0)  # let request threads in between batches
+
+            manifest.close()
+            zf.write(manifest_path, "manifest.jsonl")
+        tmp_path.replace(job.path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+        manifest_path.unlink(missing_ok=True)
+
+
+def _job_response(job: banner_jobs.Job, status: int = 200):
+    body = job.to_dict()
+    body["url"] = url_for("api_job", job_id=job.id)
+    if job.status == "done":
+        body["download"] = url_for("api_job_download", job_id=job.id)
+    return jsonify(body), status
+
+
+# --- Editing sessions -----------------------------------------------------
+
+
+def _session_draw(pattern: str, color: str) -> Image.Image | None:
+    """banner_sessions compositor: the colored layer, None for unknown patterns."""
+    if pattern not in load_registry().ids:
+        return None
+    return load_colored_layer(pattern, DYE_COLORS.get(color, DYE_COLORS["white"]))
+
+
+def _blank_banner() -> Image.Image:
+    height, width = load_registry().masks.shape[1:]
+    return Image.new("RGBA", (width, height), (0, 0, 0, 0))
+
+
+def _pairs_to_layers(pairs: list[tuple[str, str]]) -> list[dict]:
+    return [
+        {"kind": "base" if i == 0 else "pattern", "pattern": pattern, "color": color}
+        for i, (pattern, color) in enumerate(pairs)
+    ]
+
+
+def _check_pairs(pairs: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    if len(pairs) > 1 + SESSION_MAX_LAYERS:
+        raise ValueError(f"at most {SESSION_MAX_LAYERS} pattern layers per banner")
+    return pairs
+
+
+def _check_names(layer: dict) -> None:
+    """Raise ValueError unless a layer dict or edit names its pattern and color as strings."""
+    for key in ("kind", "pattern", "color"):
+        if layer.get(key) is not None and not isinstance(layer[key], str):
+            raise ValueError(f"{key} must be a string")
+
+
+def _session_pairs(layers) -> list[tuple[str, str]]:
+    """
+    canonical_layers for a client's layer list, checked first: raises
+    ValueError for anything but a list of layer objects with string names.
+    """
+    if not isinstance(layers, list) or not all(isinstance(layer, dict) for layer in layers):
+        raise ValueError("layers must be a list of layer objects")
     for layer in layers:
-        if layer is base_layer:
-            continue
-        if layer.get("kind") == "base":
-            continue  # ignore any extra base layers
+        _check_names(layer)
+    return _check_pairs(canonical_layers(layers))
 
-        pattern_name = layer.get("pattern")
-        color_name = layer.get("color")
-        if not pattern_name or not color_name:
-            continue
 
-        try:
-            prim_img = load_primitive(pattern_name)
-        except FileNotFoundError:
-            continue
+def _edited_pairs(pairs: list[tuple[str, str]], edit: dict) -> list[tuple[str, str]]:
+    """
+    Apply one edit (see api_session) to a canonical stack, returning a new
+    one. Raises ValueError for edits that do not fit the stack.
+    """
+    if "layers" in edit:
+        return _session_pairs(edit["layers"] or [])
+
+    _check_names(edit)
+    pairs = list(pairs)
+    op = edit.get("op", "set")
+    k = int(edit["layer"])
+    if op == "insert":
+        if not 1 <= k <= len(pairs):
+            raise ValueError(f"cannot insert at layer {k}")
+        if not edit.get("pattern") or not edit.get("color"):
+            raise ValueError("inserted layers need a pattern and a color")
+        pairs.insert(k, (edit["pattern"], edit["color"]))
+    elif not 0 <= k < len(pairs):
+        raise ValueError(f"banner has no layer {k}")
+    elif op == "delete":
+        if k == 0:
+            raise ValueError("cannot delete the base layer")
+        del pairs[k]
+    elif op == "set":
+        pattern, color = pairs[k]
+        pairs[k] = (edit.get("pattern") or pattern, edit.get("color") or color)
+    else:
+        raise ValueError(f"unknown op {op!r}")
+    # Same color fallback as canonical_layers
+    pairs = [(p, c if c in DYE_COLORS else "white") for p, c in pairs]
+    return _check_pairs(pairs)
 
-        rgb = DYE_COLORS.get(color_name, (255, 255, 255))
-        colored = colorize_mask(prim_img, rgb)
-        result.alpha_composite(colored)
 
-    return result
+def _session_banner(session: banner_sessions.Session, index: int) -> dict:
+    banner = session.banners[index]
+    layers = _pairs_to_layers(banner.pairs)
+    output, encoding = session.options["output"], session.options["encoding"]
+    return {
+        "index": index,
+        "src": banner_src(banner.image, layers, output, encoding),
+        "layers": layers,
+    }
 
 
-def pil_to_data_url(img: Image.Image) -> str:
-    """Encode a PIL image as a data: URL."""
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    b64 = base64.b64encode(buf.getvalue()).decode("ascii")
-    return f"data:image/png;base64,{b64}"
+def _session_response(session: banner_sessions.Session, indices: list[int], status: int = 200):
+    body = {
+        "id": session.id,
+        "revision": session.revision,
+        "url": url_for("api_session", session_id=session.id),
+        "banners": [_session_banner(session, i) for i in indices],
+    }
+    return jsonify(body), status
 
 
 # --- Routes ---------------------------------------------------------------
 
 
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    endpoint = request.endpoint or "unknown"
+    started = g.get("request_started")
+    if started is not None:
+        banner_metrics.observe(
+            "bannerlab_request_seconds", endpoint, time.perf_counter() - started
+        )
+    # Streamed responses have no length up front; they are not counted.
+    if response.content_length is not None:
+        banner_metrics.inc("bannerlab_response_bytes_total", endpoint, response.content_length)
+    return response
+
+
+@app.errorhandler(banner_pool.Saturated)
+def _render_pool_saturated(e):
+    """Async mode backpressure: tell clients to come back instead of queueing."""
+    resp = jsonify({"error": "server busy, retry shortly"})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "1"
+    return resp
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus text exposition of the timings recorded by banner_metrics."""
+    if not banner_metrics.enabled:
+        abort(404)
+    return app.response_class(
+        banner_metrics.render_prometheus(), mimetype="text/plain; version=0.0.4"
+    )
+
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -312,10 +1978,211 @@ def index():
 @app.route("/api/patterns")
 def api_patterns():
     """Return list of pattern filenames (excluding base.png)."""
-    primitive_files = list_primitive_files()
-    base_filename = "base.png"
-    pattern_files = [f for f in primitive_files if f != base_filename]
-    return jsonify({"patterns": pattern_files})
+    return jsonify({"patterns": load_registry().pattern_files()})
+
+
+@app.route("/api/primitives")
+def api_primitives():
+    """
+    Everything a client needs to composite banners itself ("output":
+    "layers"): the primitive atlas URL, which changes whenever the
+    primitives do, the atlas layout and the dye colors.
+    """
+    reg = load_registry()
+    height, width = reg.masks.shape[1:]
+    resp = jsonify(
+        {
+            "version": reg.version,
+            "src": url_for("api_primitive_atlas", version=reg.version),
+            "cell_width": width,
+            "cell_height": height,
+            "patterns": reg.names,
+            "colors": {name: list(rgb) for name, rgb in DYE_COLORS.items()},
+        }
+    )
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+@app.route("/api/primitives/<version>.png")
+def api_primitive_atlas(version: str):
+    """Serve the primitive alpha atlas; immutable, since the URL names its version."""
+    reg = load_registry()
+    if version != reg.version:
+        abort(404)
+
+    resp = app.response_class(primitive_atlas_png(reg), mimetype="image/png")
+    resp.set_etag(version)
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp.make_conditional(request)
+
+
+@app.route("/api/banner/<key>.<ext>")
+def api_banner_image(key: str, ext: str):
+    """Serve a cached banner image by render_key."""
+    encoding = Encoding.from_tag(key.partition("_")[2])
+    if encoding is None or encoding.ext != ext:
+        abort(404)
+    body = render_cache_get(key)
+    if body is None:
+        abort(404)
+
+    resp = app.response_class(body, mimetype=encoding.mimetype)
+    resp.set_etag(key)
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp.make_conditional(request)
+
+
+@app.route("/api/mosaic.png")
+def api_mosaic():
+    """
+    Download a wall of random banners as one PNG, rendered and streamed one
+    banner row at a time.
+
+    Query args:
+      columns, rows     wall size in banners (default 16 x 8)
+      scale             nearest-neighbor upscale factor (default 1)
+      mirror            "none" | "horizontal" | "vertical" | "both"
+      seed              non-negative wall seed (random if omitted; echoed in X-Mosaic-Seed)
+      level             zlib level 0-9
+      exclude_patterns  comma-separated pattern files
+      exclude_colors    comma-separated dye colors
+      pattern_weights, distinct_patterns, min_top_coverage, min_contrast
+                        sampling constraints as for /api/generate, with
+                        pattern_weights as "name:weight,..."; see
+                        _query_constraints
+
+    Walls over MOSAIC_MAX_PIXELS output pixels, scale included, answer 400;
+    banner_mosaic.py renders those from the command line.
+    """
+    args = request.args
+    columns = min(max(args.get("columns", 16, type=int), 1), MOSAIC_MAX_SIDE)
+    rows = min(max(args.get("rows", 8, type=int), 1), MOSAIC_MAX_SIDE)
+    scale = min(max(args.get("scale", 1, type=int), 1), MOSAIC_MAX_SCALE)
+    level = min(max(args.get("level", 6, type=int), 0), 9)
+    mirror = args.get("mirror", "none")
+    if mirror not in banner_mosaic.MIRROR_MODES:
+        mirror = "none"
+    seed = args.get("seed", type=int)
+    if seed is None:
+        seed = random.randrange(2**32)
+    elif seed < 0:
+        return jsonify({"error": "seed must be non-negative"}), 400
+
+    width, height = mosaic_size(columns, rows)
+    if width * height * scale * scale > MOSAIC_MAX_PIXELS:
+        return jsonify(
+            {"error": f"wall too large: over {MOSAIC_MAX_PIXELS} output pixels"}
+        ), 400
+    banner_metrics.observe("bannerlab_banners_per_request", request.endpoint, columns * rows)
+
+    excluded_patterns = [p for p in args.get("exclude_patterns", "").split(",") if p]
+    excluded_colors = [c for c in args.get("exclude_colors", "").split(",") if c]
+    allowed_colors = [c for c in DYE_COLORS if c not in excluded_colors]
+    if not allowed_colors:
+        allowed_colors = list(DYE_COLORS)
+
+    bands = mosaic_bands(
+        columns,
+        rows,
+        mirror=mirror,
+        seed=seed,
+        excluded_patterns=excluded_patterns,
+        allowed_colors=allowed_colors,
+        constraints=_query_constraints(args),
+    )
+    filename = f"mosaic_{columns}x{rows}_{seed}.png"
+    return app.response_class(
+        stream_with_context(banner_mosaic.iter_png(width, height, bands, scale, level)),
+        mimetype="image/png",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Mosaic-Seed": str(seed),
+        },
+    )
+
+
+@app.route("/api/approximate", methods=["POST"])
+def api_approximate():
+    """
+    Approximate an uploaded image (a logo, say) with a banner.
+
+    Either multipart form data with an "image" file, or JSON with "image"
+    as a data: URL or plain base64. Other fields, all optional:
+      {
+        "layers": <int>,            most pattern layers (default NUM_PATTERN_LAYERS)
+        "beam_width": <int>,        stacks kept per depth (default 16)
+        "time_budget": <seconds>,   stop deepening after this (default and cap APPROX_MAX_SECONDS)
+        "fit": "stretch" | "crop",
+        "exclude_patterns": [...],  comma-separated in form data
+        "exclude_colors": [...],
+        "output": "data" | "url",
+        "encoding": "png" | "png8" | "webp",
+        "compress_level": <int>
+      }
+
+    Returns { "layers", "src", "error" (RMS, 0-255 scale), "depth", "elapsed" }.
+    """
+    if (request.content_length or 0) > 2 * APPROX_MAX_IMAGE_BYTES:
+        abort(413)
+    upload = request.files.get("image")
+    if upload is not None:
+        params = request.form
+        raw = upload.read(APPROX_MAX_IMAGE_BYTES + 1)
+    else:
+        params = request.get_json(silent=True) or {}
+        src = str(params.get("image") or "")
+        try:
+            raw = base64.b64decode(src.partition(",")[2] if src.startswith("data:") else src)
+        except ValueError:
+            raw = b""
+    if len(raw) > APPROX_MAX_IMAGE_BYTES:
+        abort(413)
+    try:
+        img = Image.open(io.BytesIO(raw))
+        img.load()
+    except Exception:  # Pillow raises a zoo of types for bad input
+        return jsonify({"error": "image missing or not decodable"}), 400
+
+    output = _parse_output(params)
+    encoding = _parse_encoding(params)
+    try:
+        max_layers = min(max(int(params.get("layers", NUM_PATTERN_LAYERS)), 0), APPROX_MAX_LAYERS)
+        beam_width = min(max(int(params.get("beam_width", 16)), 1), APPROX_MAX_BEAM)
+        time_budget = min(float(params.get("time_budget", APPROX_MAX_SECONDS)), APPROX_MAX_SECONDS)
+    except (TypeError, ValueError):
+        return jsonify({"error": "layers, beam_width and time_budget must be numbers"}), 400
+    fit = params.get("fit", "stretch")
+    if fit not in banner_approx.FIT_MODES:
+        fit = "stretch"
+    try:
+        excluded_patterns = _list_param(params, "exclude_patterns")
+        excluded_colors = _list_param(params, "exclude_colors")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    allowed_colors = [c for c in DYE_COLORS if c not in excluded_colors]
+
+    (layers, result), = run_render_tasks(
+        lambda _: approximate_banner(
+            img,
+            max_layers=max_layers,
+            beam_width=beam_width,
+            time_budget=time_budget,
+            fit=fit,
+            excluded_patterns=excluded_patterns,
+            allowed_colors=allowed_colors,
+        ),
+        [None],
+    )
+    return jsonify(
+        {
+            "layers": layers,
+            "src": banner_src(None, layers, output, encoding),
+            "error": result.error ** 0.5,
+            "depth": result.depth,
+            "elapsed": result.elapsed,
+        }
+    )
 
 
 @app.route("/api/colors")
@@ -333,16 +2200,52 @@ def api_generate():
       {
         "count": <int>,
         "exclude_patterns": [ "border.png", ... ],
-        "exclude_colors": [ "red", "lime", ... ]
+        "exclude_colors": [ "red", "lime", ... ],
+        "output": "data" | "url" | "layers",
+        "encoding": "png" | "png8" | "webp",
+        "compress_level": <int>,
+        "format": "compact",
+        "unique": true,
+        "unique_distance": <int>,
+        "pattern_weights": { "border.png": 0.2, ... },
+        "distinct_patterns": true,
+        "min_top_coverage": <float 0-1>,
+        "min_contrast": <float>
       }
+
+    With "output": "url", each "src" is a cacheable /api/banner/<key>.<ext>
+    URL instead of an inline data: URL. With "output": "layers" nothing is
+    rendered and banners carry no "src"; the client composites them from
+    /api/primitives. "encoding" and "compress_level" are optional; see
+    Encoding and _parse_encoding.
+
+    With "format": "compact" the answer is columnar instead of a list of
+    banner objects: { "format", "count", "stacks", "srcs" } ("srcs" is
+    left out with "output": "layers"); see compact_stacks.
+
+    With "unique": true no banner is a near duplicate (perceptual hash
+    within "unique_distance" bits, default UNIQUE_DISTANCE) of another in
+    the answer or of one served with "unique" before. The answer may then
+    hold fewer than "count" banners; see render_unique_banners.
+
+    "pattern_weights" (relative odds per pattern, default 1),
+    "distinct_patterns" (no pattern twice in a banner), "min_top_coverage"
+    (least fraction of the banner the top layer covers) and "min_contrast"
+    (least CIE76 delta E between a layer's dye and the dyes under it) shape
+    the random stacks; see banner_sampler. All are optional.
     """
     data = request.get_json(silent=True) or {}
+    output = _parse_output(data, ("data", "url", "layers"))
+    encoding = _parse_encoding(data)
+    compact = _wants_compact(data)
+    unique = _parse_unique(data)
+    constraints = _parse_constraints(data)
 
     count = int(data.get("count", 1))
     if count < 1:
         count = 1
     if count > 1000:
-        count = 1000  # soft cap
+        count = 1000  # soft cap; larger batches go through /api/jobs
 
     excluded_patterns = data.get("exclude_patterns") or []
     excluded_colors = data.get("exclude_colors") or []
@@ -355,23 +2258,323 @@ def api_generate():
 
     banners: list[dict] = []
 
-    for _ in range(count):
-        img, layers = generate_random_banner(
+    if unique is not None:
+        rendered = render_unique_banners(
+            count,
+            unique,
+            output,
+            encoding,
             excluded_patterns=excluded_patterns,
             allowed_colors=allowed_colors,
+            constraints=constraints,
         )
-        slug = uuid.uuid4().hex[:8]
-        banners.append(
-            {
-                "slug": slug,
-                "src": pil_to_data_url(img),
-                "layers": layers,
-            }
+        banner_metrics.observe("bannerlab_banners_per_request", request.endpoint, len(rendered))
+        if compact:
+            srcs = None if output == "layers" else [src for src, _ in rendered]
+            return compact_response(
+                [layers for _, layers in rendered], srcs, count=len(rendered)
+            )
+        for src, layers in rendered:
+            banner = {"slug": uuid.uuid4().hex[:8], "layers": layers}
+            if src is not None:
+                banner["src"] = src
+            banners.append(banner)
+        return jsonify({"banners": banners})
+
+    if compact:
+        banner_metrics.observe("bannerlab_banners_per_request", request.endpoint, count)
+        if output == "layers":
+            stacks = generate_random_stacks(
+                count,
+                excluded_patterns=excluded_patterns,
+                allowed_colors=allowed_colors,
+                constraints=constraints,
+            )
+            return compact_response(compact_stacks_from_ids(*stacks), count=count)
+        rendered = render_random_srcs(
+            count,
+            output,
+            encoding,
+            excluded_patterns=excluded_patterns,
+            allowed_colors=allowed_colors,
+            constraints=constraints,
         )
+        srcs = [src for src, _ in rendered]
+        return compact_response([layers for _, layers in rendered], srcs, count=count)
+
+    if output == "layers":
+        for layers in generate_random_layers(
+            count,
+            excluded_patterns=excluded_patterns,
+            allowed_colors=allowed_colors,
+            constraints=constraints,
+        ):
+            banners.append({"slug": uuid.uuid4().hex[:8], "layers": layers})
+    else:
+        for src, layers in render_random_srcs(
+            count,
+            output,
+            encoding,
+            excluded_patterns=excluded_patterns,
+            allowed_colors=allowed_colors,
+            constraints=constraints,
+        ):
+            slug = uuid.uuid4().hex[:8]
+            banners.append({"slug": slug, "src": src, "layers": layers})
 
+    banner_metrics.observe("bannerlab_banners_per_request", request.endpoint, len(banners))
     return jsonify({"banners": banners})
 
 
+@app.route("/api/generate_stream", methods=["POST"])
+def api_generate_stream():
+    """
+    Streaming variant of /api/generate.
+
+    Takes the same JSON body and answers with NDJSON: one banner object
+    ({ "slug", "src", "layers" }) per line, written as soon as its batch of
+    STREAM_BATCH_SIZE is rendered. Memory stays flat regardless of count.
+    """
+    data = request.get_json(silent=True) or {}
+    output = _parse_output(data, ("data", "url", "layers"))
+    encoding = _parse_encoding(data)
+    constraints = _parse_constraints(data)
+
+    count = int(data.get("count", 1))
+    if count < 1:
+        count = 1
+    if count > STREAM_MAX_COUNT:
+        count = STREAM_MAX_COUNT  # soft cap
+    banner_metrics.observe("bannerlab_banners_per_request", request.endpoint, count)
+
+    excluded_patterns = data.get("exclude_patterns") or []
+    excluded_colors = data.get("exclude_colors") or []
+
+    all_colors = list(DYE_COLORS.keys())
+    allowed_colors = [c for c in all_colors if c not in excluded_colors]
+    if not allowed_colors:
+        allowed_colors = all_colors
+
+    def generate():
+        remaining = count
+        while remaining > 0:
+            batch = min(remaining, STREAM_BATCH_SIZE)
+            remaining -= batch
+            lines = []
+            if output == "layers":
+                banners = [
+                    {"slug": uuid.uuid4().hex[:8], "layers": layers}
+                    for layers in generate_random_layers(
+                        batch,
+                        excluded_patterns=excluded_patterns,
+                        allowed_colors=allowed_colors,
+                        constraints=constraints,
+                    )
+                ]
+            else:
+                banners = [
+                    {
+                        "slug": uuid.uuid4().hex[:8],
+                        "src": banner_src(img, layers, output, encoding),
+                        "layers": layers,
+                    }
+                    for img, layers in generate_random_banners(
+                        batch,
+                        excluded_patterns=excluded_patterns,
+                        allowed_colors=allowed_colors,
+                        constraints=constraints,
+                    )
+                ]
+            for banner in banners:
+                lines.append(json.dumps(banner, separators=(",", ":")) + "\n")
+            yield "".join(lines)
+
+    return app.response_class(
+        stream_with_context(generate()), mimetype="application/x-ndjson"
+    )
+
+
+@app.route("/api/jobs", methods=["POST"])
+def api_jobs_submit():
+    """
+    Queue a large batch of random banners to render in the background.
+
+    JSON body: like /api/generate ("count", "exclude_patterns",
+    "exclude_colors", "encoding", "compress_level" and the sampling
+    constraints), with count capped at JOB_MAX_COUNT instead of 1000.
+
+    Answers 202 with the job (see api_job), or 429 when JOB_MAX_PENDING
+    jobs are already queued or running.
+    """
+    data = request.get_json(silent=True) or {}
+    encoding = _parse_encoding(data)
+    constraints = _parse_constraints(data)
+
+    count = int(data.get("count", 1))
+    if count < 1:
+        count = 1
+    if count > JOB_MAX_COUNT:
+        count = JOB_MAX_COUNT  # soft cap
+
+    excluded_patterns = data.get("exclude_patterns") or []
+    excluded_colors = data.get("exclude_colors") or []
+
+    all_colors = list(DYE_COLORS.keys())
+    allowed_colors = [c for c in all_colors if c not in excluded_colors]
+    if not allowed_colors:
+        allowed_colors = all_colors
+
+    job = job_queue.submit(
+        count,
+        lambda job: run_generate_job(
+            job, excluded_patterns, allowed_colors, encoding, constraints
+        ),
+    )
+    if job is None:
+        return jsonify({"error": "too many jobs in progress"}), 429
+    return _job_response(job, 202)
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET", "DELETE"])
+def api_job(job_id: str):
+    """
+    Poll a job:
+      { "id", "status": "queued" | "running" | "done" | "failed" | "cancelled",
+        "total", "done", "progress", "error", "created", "finished",
+        "url", "download" (once done) }
+
+    DELETE cancels a queued or running job and answers the same shape.
+    """
+    if request.method == "DELETE":
+        job = job_queue.cancel(job_id)
+    else:
+        job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    return _job_response(job)
+
+
+@app.route("/api/jobs/<job_id>/download")
+def api_job_download(job_id: str):
+    """Stream a finished job's zip; 409 while it is still queued or running."""
+    job = job_queue.get(job_id)
+    if job is None or job.status in ("failed", "cancelled"):
+        abort(404)
+    if job.status != "done":
+        abort(409)
+    return send_file(
+        job.path,
+        mimetype="application/zip",
+        as_attachment=True,
+        download_name=f"banners_{job.id[:8]}.zip",
+        max_age=0,
+    )
+
+
+@app.route("/api/sessions", methods=["POST"])
+def api_sessions_create():
+    """
+    Start an editing session over a set of banners.
+
+    JSON body:
+      {
+        "banners": [ { "layers": [...] }, ... ],
+        "output": "data" | "url",
+        "encoding": "png" | "png8" | "webp",
+        "compress_level": <int>
+      }
+
+    Answers 201 with { "id", "revision", "url", "banners" }, each banner as
+    { "index", "src", "layers" } with layers in canonical order (base first).
+    Output mode and encoding apply to the whole session. Sessions live in
+    this process only; see banner_sessions.
+    """
+    data = request.get_json(silent=True) or {}
+    banners_in = (data.get("banners") or [])[:SESSION_MAX_BANNERS]
+    banner_metrics.observe("bannerlab_banners_per_request", request.endpoint, len(banners_in))
+
+    banners: list[banner_sessions.EditableBanner] = []
+    for banner in banners_in:
+        try:
+            banner = banner or {}
+            if not isinstance(banner, dict):
+                raise ValueError("banners must be objects")
+            layers = banner.get("layers") or []
+            pairs = _session_pairs(layers)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        img = render_banner_from_layers(layers) if pairs else _blank_banner()
+        banners.append(banner_sessions.EditableBanner(pairs, img))
+
+    options = {"output": _parse_output(data), "encoding": _parse_encoding(data)}
+    session = session_store.create(banners, options)
+    return _session_response(session, list(range(len(banners))), 201)
+
+
+@app.route("/api/sessions/<session_id>", methods=["GET", "PATCH", "DELETE"])
+def api_session(session_id: str):
+    """
+    GET returns the whole session, as on creation. DELETE ends it.
+
+    PATCH applies edits in order and returns only the banners whose image
+    changed, plus the new "revision":
+      {
+        "edits": [
+          { "banner": <index>, "layers": [...] },
+          { "banner": <index>, "layer": <k>, "pattern": "...", "color": "..." },
+          { "banner": <index>, "layer": <k>, "op": "insert", "pattern": "...", "color": "..." },
+          { "banner": <index>, "layer": <k>, "op": "delete" },
+          ...
+        ]
+      }
+
+    Layer indices count from the base (0) in canonical order. "layers"
+    replaces a whole stack; either way only the layers from the first
+    changed one upwards are composited again. An invalid edit answers 400
+    and leaves the session unchanged.
+    """
+    if request.method == "DELETE":
+        if not session_store.delete(session_id):
+            abort(404)
+        return "", 204
+
+    session = session_store.get(session_id)
+    if session is None:
+        abort(404)
+    if request.method == "GET":
+        with session.lock:
+            return _session_response(session, list(range(len(session.banners))))
+
+    data = request.get_json(silent=True) or {}
+    edits = data.get("edits") or []
+    with session.lock:
+        # Validate everything before touching the session.
+        staged: dict[int, list[tuple[str, str]]] = {}
+        try:
+            for edit in edits:
+                index = int(edit["banner"])
+                if not 0 <= index < len(session.banners):
+                    raise ValueError(f"no banner {index}")
+                pairs = staged.get(index, session.banners[index].pairs)
+                staged[index] = _edited_pairs(pairs, edit)
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"error": f"invalid edit: {e}"}), 400
+
+        changed = []
+        blank = _blank_banner()
+        for index, pairs in sorted(staged.items()):
+            banner = session.banners[index]
+            before = banner.image
+            banner.set_pairs(pairs, _session_draw, blank)
+            if banner.image is not before and banner.image.tobytes() != before.tobytes():
+                changed.append(index)
+        if changed:
+            session.revision += 1
+        if staged:
+            session_store.update(session)
+        return _session_response(session, changed)
+
+
 @app.route("/api/generate_grid", methods=["POST"])
 def api_generate_grid():
     """
@@ -382,7 +2585,10 @@ def api_generate_grid():
         "width": <int>,
         "height": <int>,
         "exclude_patterns": [...],
-        "exclude_colors": [...]
+        "exclude_colors": [...],
+        "output": "data" | "url" | "atlas" | "layers",
+        "encoding": "png" | "png8" | "webp",
+        "compress_level": <int>
       }
 
     Returns:
@@ -391,8 +2597,19 @@ def api_generate_grid():
         "height": <int>,
         "banners": [ ... length = width*height ... ]
       }
+
+    With "output": "atlas" the cells come back as one PNG instead; see
+    atlas_response. With "output": "layers" they carry no "src" at all; see
+    api_generate. "format": "compact" replaces "banners" with "stacks" and
+    "srcs", as in api_generate. The sampling constraints of api_generate
+    ("pattern_weights", "distinct_patterns", "min_top_coverage",
+    "min_contrast") apply as well.
     """
     data = request.get_json(silent=True) or {}
+    output = _parse_output(data, ("data", "url", "atlas", "layers"))
+    encoding = _parse_encoding(data)
+    compact = _wants_compact(data)
+    constraints = _parse_constraints(data)
 
     width = int(data.get("width", 1))
     height = int(data.get("height", 1))
@@ -413,6 +2630,7 @@ def api_generate_grid():
         # clamp total but keep aspect roughly similar
         height = max(1, 400 // max(1, width))
         total = width * height
+    banner_metrics.observe("bannerlab_banners_per_request", request.endpoint, total)
 
     excluded_patterns = data.get("exclude_patterns") or []
     excluded_colors = data.get("exclude_colors") or []
@@ -422,21 +2640,50 @@ def api_generate_grid():
     if not allowed_colors:
         allowed_colors = all_colors
 
-    banners: list[dict] = []
-
-    for _ in range(total):
-        img, layers = generate_random_banner(
+    if output == "atlas":
+        pixels, layers = render_random_pixels(
+            total,
             excluded_patterns=excluded_patterns,
             allowed_colors=allowed_colors,
+            constraints=constraints,
         )
-        slug = uuid.uuid4().hex[:8]
-        banners.append(
-            {
-                "slug": slug,
-                "src": pil_to_data_url(img),
-                "layers": layers,
-            }
+        return atlas_response(width, height, pixels, layers, encoding, compact=compact)
+
+    if output == "layers":
+        if compact:
+            stacks = generate_random_stacks(
+                total,
+                excluded_patterns=excluded_patterns,
+                allowed_colors=allowed_colors,
+                constraints=constraints,
+            )
+            return compact_response(compact_stacks_from_ids(*stacks), width=width, height=height)
+        layer_lists = generate_random_layers(
+            total,
+            excluded_patterns=excluded_patterns,
+            allowed_colors=allowed_colors,
+            constraints=constraints,
         )
+        banners = [{"slug": uuid.uuid4().hex[:8], "layers": layers} for layers in layer_lists]
+        return jsonify({"width": width, "height": height, "banners": banners})
+
+    rendered = render_random_srcs(
+        total,
+        output,
+        encoding,
+        excluded_patterns=excluded_patterns,
+        allowed_colors=allowed_colors,
+        constraints=constraints,
+    )
+    if compact:
+        srcs = [src for src, _ in rendered]
+        return compact_response([layers for _, layers in rendered], srcs, width=width, height=height)
+
+    banners: list[dict] = []
+
+    for src, layers in rendered:
+        slug = uuid.uuid4().hex[:8]
+        banners.append({"slug": slug, "src": src, "layers": layers})
 
     return jsonify(
         {
@@ -491,6 +2738,33 @@ def _transform_layers_for_role(layers: list[dict], role: str, axis: str) -> list
     return new_layers
 
 
+def _dedupe_stacks(layer_lists: list[list[dict]]) -> tuple[list[list[dict]], list[int]]:
+    """
+    Group layer stacks that render identically (same pruned canonical form).
+
+    Returns (one representative stack per group, group index per input).
+    """
+    reg = load_registry()
+    groups: dict[tuple, int] = {}
+    # Copies of the same input stack skip canonicalization; canonical_layers
+    # only reads these three fields.
+    seen: dict[tuple, int] = {}
+    unique: list[list[dict]] = []
+    index: list[int] = []
+    for layers in layer_lists:
+        raw = tuple((l.get("kind"), l.get("pattern"), l.get("color")) for l in layers)
+        i = seen.get(raw)
+        if i is None:
+            key = tuple(prune_layers(canonical_layers(layers), reg))
+            i = groups.get(key)
+            if i is None:
+                i = groups[key] = len(unique)
+                unique.append(layers)
+            seen[raw] = i
+        index.append(i)
+    return unique, index
+
+
 @app.route("/api/mirror_grid", methods=["POST"])
 def api_mirror_grid():
     """
@@ -505,7 +2779,10 @@ def api_mirror_grid():
         "banners": [
           { "layers": [...] },
           ...
-        ]
+        ],
+        "output": "data" | "url" | "atlas" | "layers",
+        "encoding": "png" | "png8" | "webp",
+        "compress_level": <int>
       }
 
     Returns the same shape:
@@ -515,19 +2792,39 @@ def api_mirror_grid():
         "banners": [
           { "slug": "...", "src": "data:image/png;...", "layers": [...] },
           ...
-        ]
+        ],
+        "unique_renders": <int>
       }
+
+    or, with "output": "atlas", the atlas_response shape plus
+    "unique_renders". Mirrored grids repeat stacks, so each visually
+    distinct stack is rendered and encoded once and shared between cells.
+    With "output": "layers" only the mirrored layers come back, unrendered.
+
+    The grid may also be sent as compact "stacks" (see compact_stacks) in
+    place of "banners", and "format": "compact" answers in that form too.
     """
     data = request.get_json(silent=True) or {}
+    output = _parse_output(data, ("data", "url", "atlas", "layers"))
+    encoding = _parse_encoding(data)
+    compact = _wants_compact(data)
     axis = data.get("axis", "horizontal")
     if axis not in ("horizontal", "vertical"):
         axis = "horizontal"
 
     width = int(data.get("width", 1))
     height = int(data.get("height", 1))
-    banners_in = data.get("banners") or []
+    if "stacks" in data:
+        try:
+            banners_in = [{"layers": layers} for layers in layers_from_compact(data["stacks"])]
+        except ValueError as e:
+            abort(400, description=str(e))
+    else:
+        banners_in = data.get("banners") or []
 
     if width < 1 or height < 1 or not banners_in:
+        if compact:
+            return compact_response([], width=width, height=height, unique_renders=0)
         return jsonify({"width": width, "height": height, "banners": []})
 
     # Normalize sizes
@@ -538,6 +2835,7 @@ def api_mirror_grid():
         banners_in = list(banners_in) + [{}] * pad
     elif len(banners_in) > total:
         banners_in = banners_in[:total]
+    banner_metrics.observe("bannerlab_banners_per_request", request.endpoint, total)
 
     # Build 2D array of layers (row-major)
     grid_layers: list[list[list[dict]]] = []
@@ -617,30 +2915,60 @@ def api_mirror_grid():
                     new_grid_layers[r][right_c] = new_right_layers
 
 
-    # Flatten back to row-major and render images
-    out_banners: list[dict] = []
-    for r in range(height):
-        for c in range(width):
-            layers = new_grid_layers[r][c]
+    flat_layers = [new_grid_layers[r][c] for r in range(height) for c in range(width)]
+    if output == "layers":
+        if compact:
+            return compact_response(flat_layers, width=width, height=height, unique_renders=0)
+        banners = [{"slug": uuid.uuid4().hex[:8], "layers": layers} for layers in flat_layers]
+        return jsonify({"width": width, "height": height, "banners": banners, "unique_renders": 0})
+
+    unique_layers, cell_index = _dedupe_stacks(flat_layers)
+    stats = {"unique_renders": len(unique_layers)}
+
+    if output == "atlas":
+        pixels = np.concatenate(
+            run_render_tasks(
+                lambda part: composite_banner_batch(*stacks_from_layers(part)),
+                _chunks(unique_layers),
+            )
+        )
+        return atlas_response(
+            width, height, pixels[cell_index], flat_layers, encoding, stats, compact=compact
+        )
+
+    # Render and encode each distinct stack once
+    def render(part: list[list[dict]]) -> list[str]:
+        srcs = []
+        for layers in part:
             if not layers:
                 # Keep it blank if we somehow ended up with no layers
                 img = Image.new("RGBA", (20, 40), (0, 0, 0, 0))
-                rendered_layers: list[dict] = []
             else:
-                img = render_banner_from_layers(layers)
-                rendered_layers = layers
+                # Rendered by banner_src, and only on a render cache miss
+                # when the cache applies
+                img = None
+            srcs.append(banner_src(img, layers, output, encoding))
+        return srcs
 
-            slug = uuid.uuid4().hex[:8]
-            out_banners.append(
-                {
-                    "slug": slug,
-                    "src": pil_to_data_url(img),
-                    "layers": rendered_layers,
-                }
-            )
+    unique_srcs = [src for part in run_render_tasks(render, _chunks(unique_layers)) for src in part]
+
+    if compact:
+        srcs = [unique_srcs[i] for i in cell_index]
+        return compact_response(flat_layers, srcs, width=width, height=height, **stats)
+
+    # Fan back out to the cells, row-major
+    out_banners = [
+        {
+            "slug": uuid.uuid4().hex[:8],
+            "src": unique_srcs[i],
+            "layers": layers,
+        }
+        for layers, i in zip(flat_layers, cell_index)
+    ]
 
-    return jsonify({"width": width, "height": height, "banners": out_banners})
+    return jsonify({"width": width, "height": height, "banners": out_banners, **stats})
 
 
 if __name__ == "__main__":
+    warm_colored_layer_cache()
     app.run(debug=True)
@@ -1,13 +1,19 @@
+import argparse
 import os
 import random
-import uuid
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from PIL import Image
 
+import banner_bundle
+import banner_catalog
+
 # --- Config ---
 
 NUM_PATTERN_LAYERS = 5
-NUM_GENERATIONS = 100   # <-- how many banners you want each run
+NUM_GENERATIONS = 100   # <-- default number of banners per run (see --count)
+PRINT_BATCH = 256       # result lines buffered before writing to stdout
 
 DYE_COLORS = {
     "white":      (255, 255, 255),
@@ -31,8 +37,12 @@ DYE_COLORS = {
 SCRIPT_DIR = Path(__file__).parent.resolve()
 CROPPED_DIR = SCRIPT_DIR / "banner_cropped"
 GENERATED_DIR = SCRIPT_DIR / "generated"
+BUNDLE_PATH = SCRIPT_DIR / banner_bundle.BUNDLE_FILENAME
 
 primitive_cache: dict[str, Image.Image] = {}
+# Memory-mapped masks shared by all workers; None falls back to the PNGs.
+primitive_bundle = banner_bundle.load_bundle(BUNDLE_PATH, CROPPED_DIR)
+colored_cache: dict[tuple[str, str], Image.Image] = {}
 
 
 def colorize_mask(img: Image.Image, rgb: tuple[int, int, int]) -> Image.Image:
@@ -47,66 +57,155 @@ def load_primitive(filename: str) -> Image.Image:
     if filename in primitive_cache:
         return primitive_cache[filename]
 
-    path = CROPPED_DIR / filename
-    img = Image.open(path).convert("RGBA")
+    if primitive_bundle is not None and filename in primitive_bundle[0]:
+        names, masks, _ = primitive_bundle
+        img = banner_bundle.mask_to_image(masks[names.index(filename)])
+    else:
+        path = CROPPED_DIR / filename
+        img = Image.open(path).convert("RGBA")
     primitive_cache[filename] = img
     return img
 
 
+def load_colored(filename: str, dye: str) -> Image.Image:
+    key = (filename, dye)
+    if key not in colored_cache:
+        colored_cache[key] = colorize_mask(load_primitive(filename), DYE_COLORS[dye])
+    return colored_cache[key]
+
+
 def list_primitive_files() -> list[str]:
-    return [
+    if primitive_bundle is not None:
+        return list(primitive_bundle[0])
+    # Sorted so a given seed picks the same patterns on every machine.
+    return sorted(
         f.name
         for f in CROPPED_DIR.iterdir()
         if f.is_file() and f.suffix.lower() == ".png"
-    ]
+    )
 
 
-def generate_random_banner() -> Image.Image:
+def generate_random_banner(
+    rng: random.Random | None = None,
+    num_layers: int = NUM_PATTERN_LAYERS,
+) -> tuple[Image.Image, list[tuple[str, str]]]:
+    """Return a random banner and its (pattern, dye) layers, base first."""
+    rng = rng or random.Random()
     primitive_files = list_primitive_files()
     base_filename = "base.png"
     pattern_files = [f for f in primitive_files if f != base_filename]
+    dyes = list(DYE_COLORS.keys())
 
     base_img = load_primitive(base_filename)
     width, height = base_img.size
     result = Image.new("RGBA", (width, height), (0, 0, 0, 0))
 
-    base_color = random.choice(list(DYE_COLORS.keys()))
-    base_rgb = DYE_COLORS[base_color]
-
-    print(f"Base: {base_filename} ({base_color})")
-
-    base_colored = colorize_mask(base_img, base_rgb)
-    result.alpha_composite(base_colored)
-
-    for i in range(NUM_PATTERN_LAYERS):
-        pat_file = random.choice(pattern_files)
-        dye = random.choice(list(DYE_COLORS.keys()))
-        rgb = DYE_COLORS[dye]
-
-        print(f"Layer {i+1}: {pat_file} ({dye})")
-
-        pat_img = load_primitive(pat_file)
-        pat_colored = colorize_mask(pat_img, rgb)
-        result.alpha_composite(pat_colored)
-
-    return result
-
-
-def main():
-    GENERATED_DIR.mkdir(exist_ok=True)
-
-    print(f"Generating {NUM_GENERATIONS} banners...\n")
-
-    for i in range(NUM_GENERATIONS):
-        print(f"=== Banner {i+1}/{NUM_GENERATIONS} ===")
-        img = generate_random_banner()
-
-        slug = uuid.uuid4().hex[:8]
-        filename = f"banner_{slug}.png"
-        out_path = GENERATED_DIR / filename
-        img.save(out_path)
-
-        print(f"Saved to: {out_path}\n")
+    base_color = rng.choice(dyes)
+    result.alpha_composite(load_colored(base_filename, base_color))
+    layers = [(base_filename, base_color)]
+
+    for _ in range(num_layers):
+        pat_file = rng.choice(pattern_files)
+        dye = rng.choice(dyes)
+        result.alpha_composite(load_colored(pat_file, dye))
+        layers.append((pat_file, dye))
+
+    return result, layers
+
+
+def render_job(job: tuple[int, int, int, str]) -> tuple[int, str, list[tuple[str, str]]]:
+    """
+    Render and save banner number `index` of a run.
+
+    Each banner gets its own RNG seeded from (seed, index), so the output
+    does not depend on how banners are spread over workers. The file name
+    carries the same pair, so names never collide and a rerun with the
+    same seed rewrites the same files.
+    """
+    index, seed, num_layers, out_dir = job
+    rng = random.Random(f"{seed}:{index}")
+    img, layers = generate_random_banner(rng, num_layers)
+
+    out_path = Path(out_dir) / f"banner_{seed}_{index:07d}.png"
+    img.save(out_path)
+    return index, str(out_path), layers
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate random banners.")
+    parser.add_argument("-n", "--count", type=int, default=NUM_GENERATIONS,
+                        help="number of banners to generate")
+    parser.add_argument("-l", "--layers", type=int, default=NUM_PATTERN_LAYERS,
+                        help="pattern layers on top of the base")
+    parser.add_argument("-s", "--seed", type=int, default=None,
+                        help="run seed; the same seed gives the same banners")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (1 renders in-process)")
+    parser.add_argument("-o", "--out", type=Path, default=GENERATED_DIR,
+                        help="output directory")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="only print the final summary")
+    parser.add_argument("-c", "--catalog", type=Path, default=None,
+                        help="append new designs to this catalog (see banner_catalog.py)")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None):
+    args = parse_args(argv)
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    args.out.mkdir(parents=True, exist_ok=True)
+
+    catalog = None
+    if args.catalog is not None:
+        catalog = banner_catalog.Catalog(
+            args.catalog,
+            patterns=list_primitive_files(),
+            colors=list(DYE_COLORS),
+            layers=max(banner_catalog.DEFAULT_LAYERS, args.layers),
+        )
+        if catalog.layers < args.layers:
+            sys.exit(f"{args.catalog} holds at most {catalog.layers} pattern layers")
+
+    print(f"Generating {args.count} banners (seed {seed}, {args.workers} worker(s))...")
+
+    jobs = ((i, seed, args.layers, str(args.out)) for i in range(args.count))
+    pending: list[str] = []
+    pending_stacks: list[list[tuple[str, str]]] = []
+    added = 0
+
+    def flush_catalog():
+        nonlocal added
+        added += catalog.add_many(pending_stacks)
+        pending_stacks.clear()
+
+    def report(result: tuple[int, str, list[tuple[str, str]]]):
+        index, out_path, layers = result
+        if catalog is not None:
+            pending_stacks.append(layers)
+            if len(pending_stacks) >= PRINT_BATCH:
+                flush_catalog()
+        if args.quiet:
+            return
+        desc = " + ".join(f"{pattern} ({dye})" for pattern, dye in layers)
+        pending.append(f"[{index + 1}/{args.count}] {out_path}: {desc}\n")
+        if len(pending) >= PRINT_BATCH:
+            sys.stdout.write("".join(pending))
+            pending.clear()
+
+    if args.workers <= 1:
+        for job in jobs:
+            report(render_job(job))
+    else:
+        chunksize = max(1, min(256, args.count // (args.workers * 4)))
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for result in pool.map(render_job, jobs, chunksize=chunksize):
+                report(result)
+
+    sys.stdout.write("".join(pending))
+    print(f"Done! Saved {args.count} banners to {args.out}")
+    if catalog is not None:
+        flush_catalog()
+        print(f"Catalogued {added} new designs in {args.catalog} ({len(catalog)} total)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,235 @@
+"""
+Approximate an arbitrary image with a banner: pick a base dye and up to
+max_layers (pattern, dye) layers whose composite comes closest to the image.
+
+The target is fitted to the front panel (FRONT_W x FRONT_H from
+banner_crop.py) and compared in RGB, each pixel weighted by its alpha, so
+transparent areas of a logo are "don't care".
+
+beam_search() keeps the beam_width best stacks per depth. Expanding a stack
+by every (pattern, dye) option is a handful of matrix products: with
+D = current - target, adding mask a in color c gives
+
+  err = sum w |D + a (c - current)|^2
+      = sum w |D|^2 + 2 sum w a D.(c - current) + sum w a^2 |c - current|^2
+
+so all P x C candidate errors of all stacks in the beam come out of
+(P, N) @ (N, B * C) products instead of P * C composites each. Compositing
+is done in floats here; app.py renders the chosen stack exactly.
+
+app.py serves this as POST /api/approximate, and this file is also the
+command-line front end:
+
+    python banner_approx.py logo.png -o logo_banner.png --layers 6 --beam 16
+"""
+
+import argparse
+import json
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from banner_crop import FRONT_H, FRONT_W
+
+FIT_MODES = ("stretch", "crop")
+
+
+@dataclass
+class Approximation:
+    pattern_ids: list[int]  # indices into the masks given to beam_search, base first
+    color_ids: list[int]  # indices into the colors, same length
+    error: float  # weighted mean squared RGB error of the float composite
+    depth: int  # deepest layer count fully searched
+    elapsed: float
+
+
+def prepare_target(
+    img: Image.Image,
+    fit: str = "stretch",
+    size: tuple[int, int] = (FRONT_W, FRONT_H),
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Fit an image to the front panel. Returns (target, weights): (N, 3)
+    float32 RGB and (N,) alpha weights in [0, 1], N = width * height.
+
+    "stretch" resizes to the panel; "crop" first center-crops to its aspect.
+    """
+    img = img.convert("RGBA")
+    width, height = size
+    if fit == "crop":
+        scale = min(img.width / width, img.height / height)
+        crop_w, crop_h = round(width * scale), round(height * scale)
+        left, top = (img.width - crop_w) // 2, (img.height - crop_h) // 2
+        img = img.crop((left, top, left + crop_w, top + crop_h))
+    elif fit != "stretch":
+        raise ValueError(f"unknown fit {fit!r}")
+    pixels = np.asarray(img.resize(size, Image.Resampling.BOX), dtype=np.float32)
+    pixels = pixels.reshape(-1, 4)
+    return pixels[:, :3], pixels[:, 3] / 255
+
+
+def _by_pixel(x: np.ndarray) -> np.ndarray:
+    """(B, N, C) -> (N, B * C), ready to multiply with (P, N) masks."""
+    return x.transpose(1, 0, 2).reshape(x.shape[1], -1)
+
+
+def beam_search(
+    target: np.ndarray,
+    weights: np.ndarray,
+    masks: np.ndarray,
+    colors: np.ndarray,
+    base_id: int,
+    pattern_pool: np.ndarray,
+    color_pool: np.ndarray,
+    max_layers: int = 6,
+    beam_width: int = 8,
+    time_budget: float | None = None,
+) -> Approximation:
+    """
+    Search base dye + up to max_layers pattern layers minimizing the
+    weighted squared error to target (see prepare_target).
+
+    masks is (P, H, W) uint8 alpha, colors (C, 3) RGB; only patterns in
+    pattern_pool and colors in color_pool are used; an empty pattern_pool
+    gives a base-only stack. Search stops deepening once time_budget seconds
+    have passed, returning the best stack so far.
+    """
+    started = time.perf_counter()
+    target = np.asarray(target, dtype=np.float32)
+    weights = np.asarray(weights, dtype=np.float32)
+    total_weight = max(float(weights.sum()), 1e-6)
+    pool_colors = np.asarray(colors, dtype=np.float32)[color_pool]  # (C, 3)
+    color_sq = (pool_colors**2).sum(axis=1)  # (C,)
+    alpha = masks.reshape(len(masks), -1)[pattern_pool].astype(np.float32) / 255  # (P, N)
+    alpha_w = alpha * weights  # (P, N)
+    alpha2_w = alpha * alpha_w  # (P, N)
+    n_patterns, n_colors = len(pattern_pool), len(color_pool)
+
+    def error(images: np.ndarray) -> np.ndarray:
+        return (((images - target) ** 2).sum(axis=-1) * weights).sum(axis=-1)
+
+    # Depth 0: one state per base dye
+    base_alpha = masks[base_id].reshape(-1, 1).astype(np.float32) / 255
+    images = base_alpha[None] * pool_colors[:, None, :]  # (C, N, 3)
+    errors = error(images)
+    keep = np.argsort(errors)[:beam_width]
+    images, errors = images[keep], errors[keep]
+    stacks: list[list[tuple[int, int]]] = [[(base_id, int(color_pool[c]))] for c in keep]
+    best = (float(errors[0]), stacks[0])
+    depth = 0
+    if not n_patterns:
+        max_layers = 0  # nothing to layer on; the best base dye is the answer
+
+    for depth in range(1, max_layers + 1):
+        if time_budget is not None and time.perf_counter() - started > time_budget:
+            depth -= 1
+            break
+        beam = len(stacks)
+        diff = images - target  # (B, N, 3)
+        # candidate[p, b, c] = errors[b] + 2 * cross + square; see the module docstring
+        diff_dot_color = diff @ pool_colors.T  # (B, N, C)
+        diff_dot_image = (diff * images).sum(axis=-1)  # (B, N)
+        image_dot_color = images @ pool_colors.T  # (B, N, C)
+        image_sq = (images**2).sum(axis=-1)  # (B, N)
+
+        cross = (alpha_w @ _by_pixel(diff_dot_color)).reshape(n_patterns, beam, n_colors)
+        cross -= (alpha_w @ diff_dot_image.T)[:, :, None]
+        square = (alpha2_w @ _by_pixel(image_dot_color)).reshape(n_patterns, beam, n_colors)
+        square *= -2
+        square += alpha2_w.sum(axis=1)[:, None, None] * color_sq[None, None, :]
+        square += (alpha2_w @ image_sq.T)[:, :, None]
+        candidate = errors[None, :, None] + 2 * cross + square  # (P, B, C)
+
+        # Re-drawing a stack's top layer changes nothing; skip those.
+        for b, stack in enumerate(stacks):
+            pid, cid = stack[-1]
+            p = np.flatnonzero(pattern_pool == pid)
+            c = np.flatnonzero(color_pool == cid)
+            if p.size and c.size:
+                candidate[p[0], b, c[0]] = np.inf
+
+        order = np.argsort(candidate, axis=None)[:beam_width]
+        p_idx, b_idx, c_idx = np.unravel_index(order, candidate.shape)
+        a = alpha[p_idx][:, :, None]  # (B', N, 1)
+        images = images[b_idx] * (1 - a) + pool_colors[c_idx][:, None, :] * a
+        errors = error(images)  # exact float error, free of cancellation
+        stacks = [
+            stacks[b] + [(int(pattern_pool[p]), int(color_pool[c]))]
+            for p, b, c in zip(p_idx.tolist(), b_idx.tolist(), c_idx.tolist())
+        ]
+        i = int(np.argmin(errors))
+        if errors[i] < best[0]:
+            best = (float(errors[i]), stacks[i])
+
+    err, stack = best
+    return Approximation(
+        pattern_ids=[p for p, _ in stack],
+        color_ids=[c for _, c in stack],
+        error=err / total_weight,
+        depth=depth,
+        elapsed=time.perf_counter() - started,
+    )
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Approximate an image with a banner.")
+    parser.add_argument("image", type=Path, help="image to approximate")
+    parser.add_argument("-o", "--out", type=Path, default=None,
+                        help="write the banner render here (PNG)")
+    parser.add_argument("-x", "--scale", type=int, default=8,
+                        help="nearest-neighbor upscale factor for --out")
+    parser.add_argument("-l", "--layers", type=int, default=6, help="most pattern layers")
+    parser.add_argument("-b", "--beam", type=int, default=16, help="beam width")
+    parser.add_argument("-t", "--time", type=float, default=None,
+                        help="time budget in seconds")
+    parser.add_argument("--fit", choices=FIT_MODES, default="stretch",
+                        help="how to fit the image to the banner")
+    parser.add_argument("--exclude-patterns", default="",
+                        help="comma-separated pattern files to leave out")
+    parser.add_argument("--exclude-colors", default="",
+                        help="comma-separated dye colors to leave out")
+    parser.add_argument("--json", action="store_true", help="print the layers as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    if args.layers < 0 or args.beam < 1 or args.scale < 1:
+        print("layers must be >= 0, beam and scale positive", file=sys.stderr)
+        return 2
+
+    # app imports this module, so import it only when run as a script.
+    import app
+
+    excluded_colors = [c for c in args.exclude_colors.split(",") if c]
+    layers, result = app.approximate_banner(
+        Image.open(args.image),
+        max_layers=args.layers,
+        beam_width=args.beam,
+        time_budget=args.time,
+        fit=args.fit,
+        excluded_patterns=[p for p in args.exclude_patterns.split(",") if p],
+        allowed_colors=[c for c in app.DYE_COLORS if c not in excluded_colors] or None,
+    )
+
+    if args.json:
+        print(json.dumps(layers, indent=2))
+    else:
+        print(" + ".join(f"{layer['pattern']} ({layer['color']})" for layer in layers))
+    print(f"RMS error {result.error ** 0.5:.1f} after {result.depth} layers searched "
+          f"in {result.elapsed:.2f}s", file=sys.stderr)
+
+    if args.out is not None:
+        img = app.render_banner_from_layers(layers)
+        img = img.resize((img.width * args.scale, img.height * args.scale), Image.Resampling.NEAREST)
+        img.save(args.out)
+        print(f"Saved {args.out}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""
+Microbenchmarks for the rendering pipeline in app.py.
+
+    python banner_bench.py                          # run, print a table
+    python banner_bench.py --out bench.json         # also write results
+    python banner_bench.py --save-baseline base.json
+    python banner_bench.py --baseline base.json --margin 0.2
+
+With --baseline, exits 1 if any case's median got slower than the stored
+median by more than --margin (a fraction: 0.2 = 20%). Cases missing from
+the baseline are reported but never fail.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from collections.abc import Callable
+
+import numpy as np
+from PIL import Image
+
+import app
+
+SAMPLE_LAYERS = [
+    {"kind": "base", "pattern": "base.png", "color": "magenta"},
+    {"kind": "pattern", "pattern": "border.png", "color": "yellow"},
+    {"kind": "pattern", "pattern": "circle.png", "color": "black"},
+    {"kind": "pattern", "pattern": "stripe_top.png", "color": "cyan"},
+    {"kind": "pattern", "pattern": "gradient.png", "color": "white"},
+]
+
+BATCH_SIZES = (1, 100, 1000)
+GRID_SIZES = ((4, 3), (10, 10), (20, 20))
+ENCODINGS = (
+    app.Encoding("png"),
+    app.Encoding("png", 1),
+    app.Encoding("png8"),
+    app.Encoding("webp"),
+    app.Encoding("webp", 0),
+)
+
+
+def _cold_primitive():
+    app.primitive_cache.clear()
+    app.load_primitive("border.png")
+
+
+def _cold_registry():
+    app._build_registry(0, -1)
+
+
+def _post(client, path: str, body: dict):
+    resp = client.post(path, json=body)
+    if resp.status_code != 200:
+        raise RuntimeError(f"{path} returned {resp.status_code}")
+    return resp
+
+
+def _post_unique(client, body: dict):
+    """POST a "unique" /api/generate against an empty seen-banner index, so every call does the same work."""
+    app.seen_banners.clear()
+    return _post(client, "/api/generate", body)
+
+
+def _encoding_label(enc) -> str:
+    return enc.name if enc.level is None else f"{enc.name},level={enc.level}"
+
+
+def build_cases() -> list[tuple[str, Callable[[], object]]]:
+    """Return (name, zero-argument callable) pairs, in run order."""
+    client = app.app.test_client()
+    reg = app.load_registry()
+    base = app.load_primitive("base.png")
+    banner = app.render_banner_from_layers(SAMPLE_LAYERS)
+
+    cases = [
+        ("colorize_mask", lambda: app.colorize_mask(base, (178, 76, 216))),
+        ("load_primitive.cold", _cold_primitive),
+        ("load_primitive.warm", lambda: app.load_primitive("border.png")),
+        ("load_registry.cold", _cold_registry),
+        ("generate_random_banner", app.generate_random_banner),
+        ("render_banner_from_layers", lambda: app.render_banner_from_layers(SAMPLE_LAYERS)),
+        ("pil_to_data_url", lambda: app.pil_to_data_url(banner)),
+    ]
+
+    # A fixed random sample; sizes are summed over it.
+    sample = app.composite_banner_batch(
+        *app.sample_random_stacks(100, rng=np.random.default_rng(0), registry=reg), registry=reg
+    )
+    sample_imgs = [Image.fromarray(p) for p in sample]
+    for enc in ENCODINGS:
+        cases.append((f"encode_image[{_encoding_label(enc)},n=100]",
+                      lambda enc=enc: b"".join(app.encode_image(im, enc) for im in sample_imgs)))
+    cases.append(("perceptual_hash[n=100]", lambda: app.perceptual_hasher(reg)(sample)))
+
+    for n in BATCH_SIZES:
+        stacks = app.sample_random_stacks(n, rng=np.random.default_rng(n), registry=reg)
+        cases.append((f"composite_banner_batch[n={n}]",
+                      lambda stacks=stacks: app.composite_banner_batch(*stacks, registry=reg)))
+
+    for n in BATCH_SIZES:
+        for output in ("data", "url", "layers"):
+            body = {"count": n, "output": output}
+            cases.append((f"POST /api/generate[count={n},output={output}]",
+                          lambda body=body: _post(client, "/api/generate", body)))
+        for output in ("url", "layers"):
+            body = {"count": n, "output": output, "format": "compact"}
+            cases.append((f"POST /api/generate[count={n},output={output},compact]",
+                          lambda body=body: _post(client, "/api/generate", body)))
+        body = {"count": n, "output": "layers", "unique": True}
+        cases.append((f"POST /api/generate[count={n},output=layers,unique]",
+                      lambda body=body: _post_unique(client, body)))
+        body = {"count": n, "output": "layers", "distinct_patterns": True,
+                "min_top_coverage": 0.3, "min_contrast": 30}
+        cases.append((f"POST /api/generate[count={n},output=layers,constrained]",
+                      lambda body=body: _post(client, "/api/generate", body)))
+    for enc in ENCODINGS[1:]:
+        body = {"count": 100, "output": "data", "encoding": enc.name, "compress_level": enc.level}
+        cases.append((f"POST /api/generate[count=100,output=data,{_encoding_label(enc)}]",
+                      lambda body=body: _post(client, "/api/generate", body)))
+
+    for w, h in GRID_SIZES:
+        for output in ("data", "url", "atlas", "layers"):
+            body = {"width": w, "height": h, "output": output}
+            cases.append((f"POST /api/generate_grid[{w}x{h},output={output}]",
+                          lambda body=body: _post(client, "/api/generate_grid", body)))
+        body = {"width": w, "height": h, "output": "layers", "format": "compact"}
+        cases.append((f"POST /api/generate_grid[{w}x{h},output=layers,compact]",
+                      lambda body=body: _post(client, "/api/generate_grid", body)))
+
+    for w, h in GRID_SIZES:
+        grid = _post(client, "/api/generate_grid", {"width": w, "height": h, "output": "url"}).json
+        for output in ("data", "url", "atlas", "layers"):
+            body = {"axis": "horizontal", "width": w, "height": h,
+                    "banners": grid["banners"], "output": output}
+            cases.append((f"POST /api/mirror_grid[{w}x{h},output={output}]",
+                          lambda body=body: _post(client, "/api/mirror_grid", body)))
+        stacks = app.compact_stacks([b["layers"] for b in grid["banners"]])
+        body = {"axis": "horizontal", "width": w, "height": h,
+                "stacks": stacks, "output": "layers", "format": "compact"}
+        cases.append((f"POST /api/mirror_grid[{w}x{h},output=layers,compact]",
+                      lambda body=body: _post(client, "/api/mirror_grid", body)))
+
+    return cases
+
+
+def time_case(fn, min_time: float, repeats: int) -> dict:
+    """
+    Time fn: calibrate an inner loop so one sample takes ~min_time, then
+    take `repeats` samples. Times are seconds per call; "bytes" is the size
+    of fn's result when it has one (encoded images, response bodies).
+    """
+    size = _payload_size(fn())  # warm-up
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        samples.append((time.perf_counter() - start) / loops)
+
+    return {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "mean": statistics.fmean(samples),
+        "loops": loops,
+        "repeats": repeats,
+        "bytes": size,
+    }
+
+
+def _payload_size(result) -> int | None:
+    if isinstance(result, (bytes, str)):
+        return len(result)
+    data = getattr(result, "data", None)  # test client responses
+    return len(data) if isinstance(data, bytes) else None
+
+
+def compare(results: dict, baseline: dict, margin: float) -> list[str]:
+    """Return the names of cases slower than baseline by more than margin."""
+    regressed = []
+    for name, res in results.items():
+        ref = baseline.get(name)
+        if ref and res["median"] > ref["median"] * (1 + margin):
+            regressed.append(name)
+    return regressed
+
+
+def _fmt_seconds(s: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if s >= scale:
+            return f"{s / scale:8.2f} {unit}"
+    return f"{s / 1e-9:8.2f} ns"
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the banner rendering pipeline.")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", help="write results as a new baseline")
+    parser.add_argument("--margin", type=float, default=0.25,
+                        help="allowed slowdown vs baseline (fraction, default 0.25)")
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="target seconds per sample (default 0.05)")
+    parser.add_argument("--repeats", type=int, default=5, help="samples per case")
+    parser.add_argument("-k", "--filter", default="", help="only run cases containing this")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for name, fn in build_cases():
+        if args.filter not in name:
+            continue
+        res = time_case(fn, args.min_time, args.repeats)
+        results[name] = res
+
+        delta = ""
+        ref = baseline.get(name)
+        if ref:
+            change = res["median"] / ref["median"] - 1
+            flag = "  REGRESSION" if change > args.margin else ""
+            delta = f"  {change:+7.1%}{flag}"
+        size = f"{res['bytes']:>10,d} B" if res["bytes"] is not None else " " * 12
+        print(f"{name:62s} {_fmt_seconds(res['median'])} {size}{delta}", flush=True)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    regressed = compare(results, baseline, args.margin)
+    if regressed:
+        print(f"\n{len(regressed)} case(s) regressed by more than {args.margin:.0%}:")
+        for name in regressed:
+            print(f"  {name}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Packed primitive bundle: every cropped primitive's alpha mask in one file.
+
+Layout (little-endian):
+
+  8 bytes   magic b"BNRPACK1"
+  4 bytes   header length N (uint32)
+  N bytes   JSON header: {"names": [...], "shape": [P, H, W], "source_hash": "...",
+                          "source_stamp": "..."}
+  padding   zeros up to the next 64-byte boundary
+  P*H*W     uint8 alpha tensor, one (H, W) slice per name
+
+banner_crop.py writes the bundle next to banner_cropped/. app.py and
+banner.py memory-map it so worker processes share the same pages, and fall
+back to decoding the PNGs when the bundle is missing or stale.
+
+Freshness is checked against source_stamp, a hash of the PNGs' names,
+sizes and mtimes, so a load reads no PNG bytes. Only when the stamp differs,
+e.g. after a fresh checkout reset the mtimes, are the contents hashed and
+compared with source_hash.
+"""
+
+import hashlib
+import json
+import struct
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+MAGIC = b"BNRPACK1"
+ALIGN = 64
+BUNDLE_FILENAME = "banner_cropped.pack"  # written next to banner_cropped/
+
+
+def list_pngs(src_dir: Path) -> list[Path]:
+    return sorted(
+        (f for f in src_dir.iterdir() if f.is_file() and f.suffix.lower() == ".png"),
+        key=lambda f: f.name,
+    )
+
+
+def source_hash(src_dir: Path) -> str:
+    """Hash of the names and bytes of every PNG in src_dir."""
+    h = hashlib.sha256()
+    for path in list_pngs(src_dir):
+        data = path.read_bytes()
+        h.update(path.name.encode("utf-8") + b"\0")
+        h.update(struct.pack("<Q", len(data)))
+        h.update(data)
+    return h.hexdigest()
+
+
+def source_stamp(src_dir: Path) -> str:
+    """Hash of the names, sizes and mtimes of every PNG in src_dir; stats only."""
+    h = hashlib.sha256()
+    for path in list_pngs(src_dir):
+        st = path.stat()
+        h.update(path.name.encode("utf-8") + b"\0")
+        h.update(struct.pack("<Qq", st.st_size, st.st_mtime_ns))
+    return h.hexdigest()
+
+
+def write_bundle(src_dir: Path, out_path: Path) -> str:
+    """Pack the alpha channel of every PNG in src_dir into out_path."""
+    src_dir, out_path = Path(src_dir), Path(out_path)
+    paths = list_pngs(src_dir)
+    masks = [np.asarray(Image.open(p).convert("RGBA").getchannel("A")) for p in paths]
+    tensor = np.stack(masks) if masks else np.zeros((0, 40, 20), dtype=np.uint8)
+    digest = source_hash(src_dir)
+
+    header = {
+        "names": [p.name for p in paths],
+        "shape": list(tensor.shape),
+        "source_hash": digest,
+        "source_stamp": source_stamp(src_dir),
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    offset = data_offset(len(header_bytes))
+
+    tmp_path = out_path.with_suffix(out_path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (offset - f.tell()))
+        f.write(np.ascontiguousarray(tensor, dtype=np.uint8).tobytes())
+    tmp_path.replace(out_path)
+    return digest
+
+
+def data_offset(header_length: int) -> int:
+    prefix = len(MAGIC) + 4 + header_length
+    return -(-prefix // ALIGN) * ALIGN
+
+
+def read_header(path: Path) -> dict | None:
+    """Return the bundle header, or None if path is not a bundle."""
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            (length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(length))
+    except (OSError, ValueError, struct.error):
+        return None
+    header["offset"] = data_offset(length)
+    return header
+
+
+def load_bundle(
+    path: Path, src_dir: Path | None = None
+) -> tuple[list[str], np.ndarray, str] | None:
+    """
+    Memory-map a bundle as (names, read-only (P, H, W) uint8 tensor,
+    source hash).
+
+    Returns None when the bundle is missing, unreadable, or stale, i.e. the
+    PNGs in src_dir no longer match it; see the module docstring.
+    """
+    header = read_header(Path(path))
+    if header is None:
+        return None
+    digest = header.get("source_hash", "")
+    if src_dir is not None and Path(src_dir).is_dir():
+        src_dir = Path(src_dir)
+        if source_stamp(src_dir) != header.get("source_stamp"):
+            if source_hash(src_dir) != digest:
+                return None
+
+    shape = tuple(header["shape"])
+    if not shape[0]:
+        return header["names"], np.zeros(shape, dtype=np.uint8), digest
+    tensor = np.memmap(path, dtype=np.uint8, mode="r", offset=header["offset"], shape=shape)
+    return header["names"], tensor, digest
+
+
+def mask_to_image(alpha: np.ndarray) -> Image.Image:
+    """
+    Rebuild an RGBA primitive from its alpha mask. RGB is white; every
+    consumer only looks at the alpha channel.
+    """
+    height, width = alpha.shape
+    img = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+    img.putalpha(Image.fromarray(np.ascontiguousarray(alpha)))
+    return img
@@ -0,0 +1,224 @@
+"""
+Append-only catalog of generated banner designs in a compact binary form.
+
+A design is a layer stack of (pattern, dye) pairs, base first, as produced by
+banner.py or app.canonical_layers. It is packed into one fixed-width record:
+
+  1 byte        number of pattern layers n
+  1 byte        base dye ID
+  2*L bytes     n (pattern ID, dye ID) pairs, then EMPTY padding up to L pairs
+
+IDs index the pattern and dye tables stored in the catalog header, so records
+stay valid however banner_cropped/ changes later. File layout:
+
+  8 bytes   magic b"BNRCAT01"
+  4 bytes   header length N (uint32, little-endian)
+  N bytes   JSON header: {"base": ..., "patterns": [...], "colors": [...], "layers": L}
+  padding   zeros up to the next 64-byte boundary
+  records   2 + 2*L bytes each, in insertion order
+
+Records are only ever appended, so the file can be memory-mapped straight
+into NumPy (Catalog.records) while new designs are added. A truncated
+trailing record, e.g. from a crash mid-write, is ignored. One process
+should write a catalog at a time; readers pick up appends with refresh().
+"""
+
+import json
+import os
+import struct
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b"BNRCAT01"
+ALIGN = 64
+EMPTY = 0xFF  # pattern/dye ID of an unused layer slot
+DEFAULT_LAYERS = 7  # pattern layers per record; 7 makes a 16-byte record
+
+Stack = Sequence[tuple[str, str]]
+
+
+def record_dtype(layers: int) -> np.dtype:
+    return np.dtype([("count", "u1"), ("base", "u1"), ("layers", "u1", (layers, 2))])
+
+
+def _data_offset(header_length: int) -> int:
+    prefix = len(MAGIC) + 4 + header_length
+    return -(-prefix // ALIGN) * ALIGN
+
+
+class Catalog:
+    """
+    Catalog file at `path`, created with the given tables when missing.
+
+    An existing catalog keeps the tables it was created with; `patterns`,
+    `colors` and `layers` are then ignored.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        patterns: Sequence[str] | None = None,
+        colors: Sequence[str] | None = None,
+        layers: int = DEFAULT_LAYERS,
+        base: str = "base.png",
+    ):
+        self.path = Path(path)
+        if not self.path.exists():
+            if patterns is None or colors is None:
+                raise FileNotFoundError(f"{self.path} does not exist and no tables were given")
+            self._create(list(patterns), list(colors), layers, base)
+
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a banner catalog")
+            (length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(length))
+        self.offset = _data_offset(length)
+        self.base: str = header["base"]
+        self.patterns: list[str] = header["patterns"]
+        self.colors: list[str] = header["colors"]
+        self.layers: int = header["layers"]
+        self.dtype = record_dtype(self.layers)
+        self.pattern_ids = {name: i for i, name in enumerate(self.patterns)}
+        self.color_ids = {name: i for i, name in enumerate(self.colors)}
+
+        self._keys: set[bytes] = set()
+        self._count = 0  # whole records indexed in _keys
+        self.refresh()
+
+    def _create(self, patterns: list[str], colors: list[str], layers: int, base: str) -> None:
+        if len(patterns) >= EMPTY or len(colors) >= EMPTY:
+            raise ValueError(f"at most {EMPTY - 1} patterns and dyes fit in a byte ID")
+        if not 0 < layers < 256:
+            raise ValueError("layers must be between 1 and 255")
+        header = {"base": base, "patterns": patterns, "colors": colors, "layers": layers}
+        header_bytes = json.dumps(header).encode("utf-8")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(header_bytes)))
+            f.write(header_bytes)
+            f.write(b"\0" * (_data_offset(len(header_bytes)) - f.tell()))
+        tmp_path.replace(self.path)
+
+    # --- Packing ----------------------------------------------------------
+
+    def pack(self, stack: Stack) -> bytes:
+        """
+        Pack a (pattern, dye) stack, base first, into one record. Raises
+        ValueError for an empty stack, unknown names or too many layers.
+        """
+        if not stack:
+            raise ValueError("cannot pack an empty stack")
+        (base_pattern, base_color), rest = stack[0], stack[1:]
+        if base_pattern != self.base:
+            raise ValueError(f"stack does not start with {self.base}")
+        if len(rest) > self.layers:
+            raise ValueError(f"{len(rest)} pattern layers; this catalog holds {self.layers}")
+        try:
+            out = bytearray((len(rest), self.color_ids[base_color]))
+            for pattern, color in rest:
+                out += bytes((self.pattern_ids[pattern], self.color_ids[color]))
+        except KeyError as e:
+            raise ValueError(f"{e.args[0]!r} is not in the catalog tables") from None
+        out += bytes((EMPTY, EMPTY)) * (self.layers - len(rest))
+        return bytes(out)
+
+    def unpack(self, record: bytes | np.void) -> list[tuple[str, str]]:
+        """Inverse of pack()."""
+        record = bytes(record)
+        stack = [(self.base, self.colors[record[1]])]
+        for i in range(record[0]):
+            stack.append((self.patterns[record[2 + 2 * i]], self.colors[record[3 + 2 * i]]))
+        return stack
+
+    # --- Queries ----------------------------------------------------------
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, stack: Stack) -> bool:
+        try:
+            return self.pack(stack) in self._keys
+        except ValueError:
+            return False
+
+    def contains_records(self, records: np.ndarray) -> np.ndarray:
+        """Membership of each record in an array like records() returns, as bools."""
+        data = np.ascontiguousarray(records, dtype=self.dtype).tobytes()
+        size, keys = self.dtype.itemsize, self._keys
+        return np.fromiter(
+            (data[i : i + size] in keys for i in range(0, len(data), size)),
+            dtype=bool,
+            count=len(data) // size,
+        )
+
+    def records(self) -> np.ndarray:
+        """
+        All records as a read-only structured array, memory-mapped: fields
+        "count", "base" and "layers" ((n, L, 2) pattern and dye IDs).
+        """
+        count = self._file_records()
+        if not count:
+            return np.zeros(0, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode="r", offset=self.offset, shape=(count,))
+
+    def id_arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Bulk load as (pattern_ids, dye_ids), each (n, L) int16 with -1 for
+        unused slots. Base layers are left out; see records()["base"].
+        """
+        layers = np.asarray(self.records()["layers"], dtype=np.int16)
+        layers[layers == EMPTY] = -1
+        return layers[..., 0], layers[..., 1]
+
+    # --- Appending --------------------------------------------------------
+
+    def _file_records(self) -> int:
+        return max(0, self.path.stat().st_size - self.offset) // self.dtype.itemsize
+
+    def refresh(self) -> None:
+        """Index records appended since the last refresh (e.g. by another process)."""
+        count = self._file_records()
+        if count <= self._count:
+            return
+        size = self.dtype.itemsize
+        with open(self.path, "rb") as f:
+            f.seek(self.offset + self._count * size)
+            data = f.read((count - self._count) * size)
+        self._keys.update(data[i : i + size] for i in range(0, len(data), size))
+        self._count = count
+
+    def add(self, stack: Stack) -> bool:
+        """Append a stack unless it is already catalogued; True if added."""
+        return self.add_many([stack]) == 1
+
+    def add_many(self, stacks: Iterable[Stack]) -> int:
+        """
+        Append every stack not yet catalogued in one write; returns how many.
+        The index only learns the new records once they are written, so a
+        bad stack or a failed write leaves nothing counted as catalogued.
+        """
+        self.refresh()
+        new: list[bytes] = []
+        batch: set[bytes] = set()
+        for stack in stacks:
+            record = self.pack(stack)
+            if record not in self._keys and record not in batch:
+                batch.add(record)
+                new.append(record)
+        if not new:
+            return 0
+        # Drop a torn trailing record before appending whole ones after it.
+        end = self.offset + self._count * self.dtype.itemsize
+        with open(self.path, "r+b") as f:
+            if f.seek(0, os.SEEK_END) != end:
+                f.truncate(end)
+                f.seek(end)
+            f.write(b"".join(new))
+        self._keys.update(batch)
+        self._count += len(new)
+        return len(new)
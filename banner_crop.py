@@ -1,6 +1,8 @@
 import os
 from PIL import Image
 
+from banner_bundle import BUNDLE_FILENAME, write_bundle
+
 # 20x40 region starting at (1,1)
 FRONT_X, FRONT_Y = 1, 1
 FRONT_W, FRONT_H = 20, 40
@@ -31,5 +33,10 @@ def main():
 
     print("Done! Cropped primitives saved to banner_cropped/")
 
+    # Pack every cropped alpha mask into one memory-mappable file
+    bundle_path = os.path.join(script_dir, BUNDLE_FILENAME)
+    digest = write_bundle(output_dir, bundle_path)
+    print(f"Packed bundle → {bundle_path} ({digest[:12]})")
+
 if __name__ == "__main__":
     main()
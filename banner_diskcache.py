@@ -0,0 +1,129 @@
+"""
+Persistent render cache for app.py: encoded banner images in one SQLite file
+shared by every worker process on the host.
+
+Keys are app.render_key values. These hash the pruned canonical layer stack
+together with the primitive-set version and the encoding, so entries for old
+primitives are never served; they simply age out. Eviction is least recently
+used once the stored bytes exceed max_bytes.
+
+The database runs in WAL mode, so readers never block and writers in other
+processes wait up to busy_timeout. Each thread of each process opens its own
+connection. Any SQLite error counts as a miss or a skipped write: the cache
+never fails a request.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS renders (
+    key      TEXT PRIMARY KEY,
+    data     BLOB NOT NULL,
+    size     INTEGER NOT NULL,
+    accessed REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS renders_accessed ON renders (accessed);
+CREATE TABLE IF NOT EXISTS stats (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO stats VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS renders_insert AFTER INSERT ON renders BEGIN
+    UPDATE stats SET bytes = bytes + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS renders_update AFTER UPDATE OF size ON renders BEGIN
+    UPDATE stats SET bytes = bytes + new.size - old.size;
+END;
+CREATE TRIGGER IF NOT EXISTS renders_delete AFTER DELETE ON renders BEGIN
+    UPDATE stats SET bytes = bytes - old.size;
+END;
+"""
+
+TOUCH_INTERVAL = 60.0  # seconds; reads refresh `accessed` at most this often
+EVICT_TO = 0.9  # evict down to this fraction of max_bytes
+EVICT_BATCH = 256  # rows deleted per eviction statement
+
+
+class DiskCache:
+    def __init__(self, path: str | Path, max_bytes: int, busy_timeout: float = 5.0):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: autocommit, with explicit BEGIN IMMEDIATE for writes
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        # Keyed by pid too: a connection must not be reused across fork().
+        cached = getattr(self._local, "conn", None)
+        if cached is None or cached[0] != os.getpid():
+            cached = self._local.conn = (os.getpid(), self._connect())
+        return cached[1]
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT data, accessed FROM renders WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if row[1] < now - TOUCH_INTERVAL:
+                conn.execute("UPDATE renders SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+        except sqlite3.Error:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO renders (key, data, size, accessed) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET data = excluded.data, "
+                    "size = excluded.size, accessed = excluded.accessed",
+                    (key, data, len(data), time.time()),
+                )
+                self._evict(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Drop least recently used rows until under EVICT_TO * max_bytes."""
+        (total,) = conn.execute("SELECT bytes FROM stats WHERE id = 0").fetchone()
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * EVICT_TO)
+        while total > target:
+            conn.execute(
+                "DELETE FROM renders WHERE key IN "
+                "(SELECT key FROM renders ORDER BY accessed LIMIT ?)",
+                (EVICT_BATCH,),
+            )
+            (total,) = conn.execute("SELECT bytes FROM stats WHERE id = 0").fetchone()
+            if total <= 0:
+                break
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        (count,) = conn.execute("SELECT COUNT(*) FROM renders").fetchone()
+        (total,) = conn.execute("SELECT bytes FROM stats WHERE id = 0").fetchone()
+        return {"entries": count, "bytes": total, "max_bytes": self.max_bytes}
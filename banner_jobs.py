@@ -0,0 +1,156 @@
+"""
+Background jobs for app.py: large generation batches run on a small thread
+pool instead of inside a request.
+
+A job's work function gets the Job, reports progress with job.advance() and
+calls job.check() between steps, which raises JobCancelled once the job is
+cancelled. Results are files under the queue's directory (job.path); they are
+deleted when a job fails, is cancelled, or expires `ttl` seconds after it
+finished.
+"""
+
+import atexit
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# queued -> running -> done | failed | cancelled; queued -> cancelled
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    total: int
+    path: Path
+    status: str = "queued"
+    done: int = 0
+    error: str | None = None
+    created: float = field(default_factory=time.time)
+    finished: float | None = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def check(self) -> None:
+        """Raise JobCancelled if the job has been cancelled."""
+        if self.cancel_event.is_set():
+            raise JobCancelled(self.id)
+
+    def advance(self, amount: int = 1) -> None:
+        self.done += amount
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "done": self.done,
+            "progress": self.done / self.total if self.total else 1.0,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    """
+    At most `workers` jobs run at once; at most `max_pending` may be queued
+    or running before submit() refuses more.
+    """
+
+    def __init__(self, workers: int, max_pending: int, ttl: float, suffix: str = ""):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.suffix = suffix
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._pool: ThreadPoolExecutor | None = None
+        self._root: Path | None = None
+
+    def _start(self) -> None:
+        # Created on first use, so importing app.py leaves no threads or temp dirs.
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="bannerlab-job")
+            self._root = Path(tempfile.mkdtemp(prefix="bannerlab-jobs-"))
+            atexit.register(self.shutdown)
+
+    def submit(self, total: int, work: Callable[[Job], None]) -> Job | None:
+        """Queue work(job); returns None when the queue is full."""
+        with self._lock:
+            self._expire()
+            pending = sum(1 for j in self._jobs.values() if j.status not in FINISHED_STATES)
+            if pending >= self.max_pending:
+                return None
+            self._start()
+            job_id = uuid.uuid4().hex
+            job = Job(id=job_id, total=total, path=self._root / f"{job_id}{self.suffix}")
+            self._jobs[job_id] = job
+        self._pool.submit(self._run, job, work)
+        return job
+
+    def _run(self, job: Job, work: Callable[[Job], None]) -> None:
+        with self._lock:
+            if job.cancel_event.is_set():
+                return
+            job.status = "running"
+        try:
+            work(job)
+            status = "done"
+        except JobCancelled:
+            status = "cancelled"
+        except Exception as e:  # reported through the job, not the pool
+            job.error = f"{type(e).__name__}: {e}"
+            status = "failed"
+        with self._lock:
+            job.status = status
+            job.finished = time.time()
+        if status != "done":
+            job.path.unlink(missing_ok=True)
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job | None:
+        """Cancel a queued or running job; finished jobs are left as they are."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return job
+            job.cancel_event.set()
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished = time.time()
+            return job
+
+    def _expire(self) -> None:
+        """Forget finished jobs older than ttl and delete their files. Holds _lock."""
+        cutoff = time.time() - self.ttl
+        for job_id, job in list(self._jobs.items()):
+            if job.finished is not None and job.finished < cutoff:
+                job.path.unlink(missing_ok=True)
+                del self._jobs[job_id]
+
+    def shutdown(self) -> None:
+        """Cancel everything, stop the workers and remove the job directory."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            self.cancel(job.id)
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            shutil.rmtree(self._root, ignore_errors=True)
+            self._pool = self._root = None
+        with self._lock:
+            self._jobs.clear()
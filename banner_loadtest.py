@@ -0,0 +1,270 @@
+"""
+Offline load generator for app.py.
+
+Starts the app in a child process on a free localhost port (or targets
+--url), then drives it from --concurrency client threads with a weighted mix
+of requests:
+
+  generate   POST /api/generate with count drawn log-uniformly from 1..--max-count
+  grid       POST /api/generate_grid up to --max-grid x --max-grid
+  mirror     POST /api/mirror_grid, feeding back the layers of the client's
+             last grid (a grid is fetched first if it has none yet)
+
+    python banner_loadtest.py -c 8 -d 30
+    python banner_loadtest.py --mix generate=1,grid=1,mirror=2 --output url
+    python banner_loadtest.py --url http://127.0.0.1:5000 --json report.json
+    BANNERLAB_ASYNC=1 python banner_loadtest.py    # app in async serving mode
+
+Only the standard library is used on the client side.
+"""
+
+import argparse
+import json
+import math
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).parent.resolve()
+
+KINDS = ("generate", "grid", "mirror")
+
+# Runs in the child process: serve app.app with werkzeug's threaded server.
+SERVER_CODE = """
+import sys
+from werkzeug.serving import make_server
+import app
+app.warm_colored_layer_cache()
+server = make_server("127.0.0.1", int(sys.argv[1]), app.app, threaded=True)
+server.serve_forever()
+"""
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in KINDS:
+            raise argparse.ArgumentTypeError(f"unknown request kind {name!r}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("mix needs at least one positive weight")
+    return mix
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, timeout: float = 30.0) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-c", SERVER_CODE, str(port)],
+        cwd=SCRIPT_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"app exited with status {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("app did not start listening in time")
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Client:
+    """One simulated user: sends requests and remembers its last grid."""
+
+    def __init__(self, base_url: str, args: argparse.Namespace, rng: random.Random):
+        self.base_url = base_url
+        self.args = args
+        self.rng = rng
+        self.last_grid: dict | None = None
+
+    def post(self, path: str, body: dict) -> tuple[int, bytes]:
+        req = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.args.timeout) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def request(self, kind: str) -> tuple[int, bytes]:
+        args, rng = self.args, self.rng
+        if kind == "generate":
+            count = int(math.exp(rng.uniform(0, math.log(args.max_count + 1))))
+            return self.post("/api/generate", {"count": max(1, count), "output": args.output})
+
+        if kind == "mirror" and self.last_grid is not None:
+            grid = self.last_grid
+            return self.post("/api/mirror_grid", {
+                "axis": rng.choice(("horizontal", "vertical")),
+                "width": grid["width"],
+                "height": grid["height"],
+                "banners": [{"layers": b["layers"]} for b in grid["banners"]],
+                "output": args.output,
+            })
+
+        # "grid", or a "mirror" with nothing to mirror yet
+        width = rng.randint(1, args.max_grid)
+        height = rng.randint(1, args.max_grid)
+        status, body = self.post("/api/generate_grid",
+                                 {"width": width, "height": height, "output": args.output})
+        if status == 200:
+            self.last_grid = json.loads(body)
+        return status, body
+
+
+def run_load(base_url: str, args: argparse.Namespace) -> dict:
+    kinds = list(args.mix)
+    weights = [args.mix[k] for k in kinds]
+    samples: dict[str, list[tuple[float, int, bool]]] = {k: [] for k in KINDS}
+    lock = threading.Lock()
+    sent = 0
+    stop_at = time.monotonic() + args.duration
+
+    def next_ticket() -> bool:
+        nonlocal sent
+        with lock:
+            if args.requests and sent >= args.requests:
+                return False
+            if not args.requests and time.monotonic() >= stop_at:
+                return False
+            sent += 1
+            return True
+
+    def worker(worker_id: int):
+        rng = random.Random(f"{args.seed}:{worker_id}")
+        client = Client(base_url, args, rng)
+        while next_ticket():
+            kind = rng.choices(kinds, weights)[0]
+            start = time.perf_counter()
+            try:
+                status, body = client.request(kind)
+                ok, size = status == 200, len(body)
+            except OSError:
+                ok, size = False, 0
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[kind].append((elapsed, size, ok))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True)
+               for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    report = {"wall_seconds": wall, "concurrency": args.concurrency, "kinds": {}}
+    everything: list[tuple[float, int, bool]] = []
+    for kind, rows in samples.items():
+        if rows:
+            report["kinds"][kind] = summarize(rows, wall)
+            everything.extend(rows)
+    report["total"] = summarize(everything, wall)
+    return report
+
+
+def summarize(rows: list[tuple[float, int, bool]], wall: float) -> dict:
+    latencies = sorted(r[0] for r in rows)
+    sizes = [r[1] for r in rows]
+    return {
+        "requests": len(rows),
+        "errors": sum(1 for r in rows if not r[2]),
+        "throughput_rps": len(rows) / wall if wall else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": latencies[-1] if latencies else 0.0,
+        "bytes_mean": sum(sizes) / len(sizes) if sizes else 0.0,
+        "bytes_total": sum(sizes),
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['total']['requests']} requests in {report['wall_seconds']:.1f}s "
+          f"at concurrency {report['concurrency']}")
+    header = f"{'kind':10s} {'reqs':>6s} {'err':>5s} {'req/s':>8s} " \
+             f"{'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'avg KiB':>9s}"
+    print(header)
+    print("-" * len(header))
+    rows = list(report["kinds"].items()) + [("total", report["total"])]
+    for kind, s in rows:
+        print(f"{kind:10s} {s['requests']:6d} {s['errors']:5d} {s['throughput_rps']:8.1f} "
+              f"{s['latency_p50'] * 1e3:8.1f} {s['latency_p95'] * 1e3:8.1f} "
+              f"{s['latency_p99'] * 1e3:8.1f} {s['bytes_mean'] / 1024:9.1f}")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Drive the banner app with concurrent load.")
+    parser.add_argument("--url", help="target a running app instead of starting one")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="client threads")
+    parser.add_argument("-d", "--duration", type=float, default=10.0,
+                        help="seconds to run (ignored with --requests)")
+    parser.add_argument("-n", "--requests", type=int, default=0,
+                        help="stop after this many requests instead of a duration")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("generate=2,grid=1,mirror=1"),
+                        help="request weights, e.g. generate=2,grid=1,mirror=1")
+    parser.add_argument("--max-count", type=int, default=1000, help="largest /api/generate count")
+    parser.add_argument("--max-grid", type=int, default=32, help="largest grid side")
+    parser.add_argument("--output", choices=("data", "url", "atlas"), default="data",
+                        help="output mode (/api/generate treats atlas as data)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="request mix seed")
+    parser.add_argument("--json", help="also write the report here")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    proc = None
+    base_url = args.url
+    if base_url is None:
+        port = free_port()
+        proc = start_server(port)
+        base_url = f"http://127.0.0.1:{port}"
+    base_url = base_url.rstrip("/")
+
+    try:
+        report = run_load(base_url, args)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["total"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
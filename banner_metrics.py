@@ -0,0 +1,136 @@
+"""
+Lightweight in-process metrics for app.py, exposed in Prometheus text format.
+
+Histograms and counters are plain dicts behind one lock; recording costs two
+perf_counter calls and a bisect. Set BANNERLAB_METRICS=0 to turn everything
+off: timed() then returns a shared no-op context manager and app.py answers
+/metrics with 404.
+"""
+
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+enabled = os.environ.get("BANNERLAB_METRICS", "1") != "0"
+
+# Bucket upper bounds; +Inf is implicit.
+SECONDS_BUCKETS = (
+    0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005,
+    0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+COUNT_BUCKETS = (1, 5, 10, 50, 100, 250, 500, 1000, 5000, 10000)
+
+# name -> (type, label name, help, buckets)
+METRICS = {
+    "bannerlab_stage_seconds": (
+        "histogram", "stage", "Time spent in each rendering pipeline stage.", SECONDS_BUCKETS,
+    ),
+    "bannerlab_request_seconds": (
+        "histogram", "endpoint", "Request latency per endpoint.", SECONDS_BUCKETS,
+    ),
+    "bannerlab_banners_per_request": (
+        "histogram", "endpoint", "Banners returned per request.", COUNT_BUCKETS,
+    ),
+    "bannerlab_response_bytes_total": (
+        "counter", "endpoint", "Response body bytes sent.", None,
+    ),
+}
+
+_lock = threading.Lock()
+# (name, label value) -> [per-bucket counts..., +Inf count, sum] for histograms,
+# or [total] for counters
+_values: dict[tuple[str, str], list[float]] = {}
+_noop = nullcontext()
+
+
+def observe(name: str, label: str, value: float) -> None:
+    """Record one histogram sample."""
+    if not enabled:
+        return
+    buckets = METRICS[name][3]
+    slot = bisect.bisect_left(buckets, value)
+    with _lock:
+        row = _values.get((name, label))
+        if row is None:
+            row = _values[(name, label)] = [0.0] * (len(buckets) + 2)
+        row[slot] += 1
+        row[-1] += value
+
+
+def inc(name: str, label: str, amount: float = 1) -> None:
+    """Add to a counter."""
+    if not enabled:
+        return
+    with _lock:
+        row = _values.setdefault((name, label), [0.0])
+        row[0] += amount
+
+
+@contextmanager
+def _timer(name: str, label: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, label, time.perf_counter() - start)
+
+
+def timed(stage: str, name: str = "bannerlab_stage_seconds"):
+    """Context manager timing a block into a seconds histogram."""
+    if not enabled:
+        return _noop
+    return _timer(name, stage)
+
+
+def timed_stage(stage: str):
+    """Decorator form of timed() for a whole function."""
+    def decorate(fn):
+        if not enabled:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def reset() -> None:
+    with _lock:
+        _values.clear()
+
+
+def _fmt(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render_prometheus() -> str:
+    """Render every recorded metric in Prometheus text exposition format."""
+    with _lock:
+        snapshot = {key: list(row) for key, row in _values.items()}
+
+    lines: list[str] = []
+    for name, (kind, label_name, help_text, buckets) in METRICS.items():
+        rows = sorted((label, row) for (n, label), row in snapshot.items() if n == name)
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for label, row in rows:
+            labels = f'{label_name}="{label}"'
+            if kind == "counter":
+                lines.append(f"{name}{{{labels}}} {_fmt(row[0])}")
+                continue
+            cumulative = 0.0
+            for bound, count in zip(buckets, row):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {_fmt(cumulative)}')
+            cumulative += row[len(buckets)]
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {_fmt(cumulative)}')
+            lines.append(f"{name}_sum{{{labels}}} {_fmt(row[-1])}")
+            lines.append(f"{name}_count{{{labels}}} {_fmt(cumulative)}")
+    return "\n".join(lines) + "\n"
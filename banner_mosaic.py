@@ -0,0 +1,177 @@
+"""
+Streaming PNG export for large banner walls.
+
+app.mosaic_bands() renders a wall one banner row at a time; iter_png() turns
+those bands into a single RGBA PNG piece by piece, so memory stays at one
+band no matter how large the wall is. app.py serves the result from
+/api/mosaic.png, and this file is also the command-line front end:
+
+    python banner_mosaic.py 200 100 -o wall.png --scale 4 --mirror both --seed 7
+"""
+
+import argparse
+import random
+import struct
+import sys
+import time
+import zlib
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+import numpy as np
+
+import banner_sampler
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+IDAT_CHUNK_SIZE = 1 << 16  # compressed bytes collected per IDAT chunk
+MIRROR_MODES = ("none", "horizontal", "vertical", "both")
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def iter_png(
+    width: int,
+    height: int,
+    bands: Iterable[np.ndarray],
+    scale: int = 1,
+    level: int = 6,
+) -> Iterator[bytes]:
+    """
+    Encode a width x height RGBA image, given top to bottom as (rows, width, 4)
+    uint8 bands, as PNG bytes. Each pixel is upscaled to a scale x scale
+    block (nearest-neighbor) on the fly, one output scanline at a time, so
+    only a single upscaled line is held besides the band.
+    """
+    out_width, out_height = width * scale, height * scale
+    yield PNG_SIGNATURE + png_chunk(
+        b"IHDR", struct.pack(">IIBBBBB", out_width, out_height, 8, 6, 0, 0, 0)
+    )
+
+    compressor = zlib.compressobj(level)
+    pending: list[bytes] = []
+    pending_size = 0
+    rows_seen = 0
+    line = np.zeros(1 + out_width * 4, dtype=np.uint8)  # filter byte 0, then pixels
+    for band in bands:
+        band = np.asarray(band, dtype=np.uint8)
+        if band.shape[1:] != (width, 4):
+            raise ValueError(f"band of shape {band.shape} in a {width}-pixel-wide image")
+        rows_seen += band.shape[0]
+        if rows_seen > height:
+            raise ValueError(f"more than {height} rows of pixels")
+
+        for row in band:
+            line[1:] = np.repeat(row, scale, axis=0).reshape(-1)
+            for _ in range(scale):
+                piece = compressor.compress(line)
+                if piece:
+                    pending.append(piece)
+                    pending_size += len(piece)
+        if pending_size >= IDAT_CHUNK_SIZE:
+            yield png_chunk(b"IDAT", b"".join(pending))
+            pending.clear()
+            pending_size = 0
+
+    if rows_seen != height:
+        raise ValueError(f"got {rows_seen} rows of pixels, expected {height}")
+    pending.append(compressor.flush())
+    yield png_chunk(b"IDAT", b"".join(pending)) + png_chunk(b"IEND", b"")
+
+
+def write_png(out_path: Path, chunks: Iterable[bytes]) -> int:
+    """Write PNG pieces to out_path via a temporary file; returns the size."""
+    out_path = Path(out_path)
+    tmp_path = out_path.with_suffix(out_path.suffix + ".tmp")
+    size = 0
+    with open(tmp_path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+            size += len(chunk)
+    tmp_path.replace(out_path)
+    return size
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Export a wall of random banners as one PNG.")
+    parser.add_argument("columns", type=int, help="banners per row")
+    parser.add_argument("rows", type=int, help="rows of banners")
+    parser.add_argument("-o", "--out", type=Path, default=None,
+                        help="output file (default generated/mosaic_<columns>x<rows>_<seed>.png)")
+    parser.add_argument("-x", "--scale", type=int, default=1,
+                        help="nearest-neighbor upscale factor")
+    parser.add_argument("-m", "--mirror", choices=MIRROR_MODES, default="none",
+                        help="mirror rows (horizontal), columns (vertical) or both")
+    parser.add_argument("-s", "--seed", type=int, default=None,
+                        help="non-negative wall seed; the same seed gives the same wall")
+    parser.add_argument("--level", type=int, default=6, help="zlib level 0-9")
+    parser.add_argument("--exclude-patterns", default="",
+                        help="comma-separated pattern files to leave out")
+    parser.add_argument("--exclude-colors", default="",
+                        help="comma-separated dye colors to leave out")
+    parser.add_argument("--pattern-weights", default="",
+                        help="comma-separated name:weight odds, e.g. border.png:0.2")
+    parser.add_argument("--distinct-patterns", action="store_true",
+                        help="no pattern twice in one banner")
+    parser.add_argument("--min-top-coverage", type=float, default=0.0,
+                        help="least fraction of a banner its top layer covers")
+    parser.add_argument("--min-contrast", type=float, default=0.0,
+                        help="least delta E between a layer's dye and the dyes under it")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    if args.columns < 1 or args.rows < 1 or args.scale < 1:
+        print("columns, rows and scale must be positive", file=sys.stderr)
+        return 2
+    if args.seed is not None and args.seed < 0:
+        print("seed must be non-negative", file=sys.stderr)
+        return 2
+    try:
+        weights = {
+            name: float(weight)
+            for name, _, weight in (p.partition(":") for p in args.pattern_weights.split(",") if p)
+        }
+    except ValueError:
+        print("pattern weights must be name:number pairs", file=sys.stderr)
+        return 2
+    constraints = banner_sampler.Constraints(
+        pattern_weights=weights,
+        distinct_patterns=args.distinct_patterns,
+        min_top_coverage=args.min_top_coverage,
+        min_contrast=args.min_contrast,
+    )
+
+    # app imports this module, so import it only when run as a script.
+    import app
+
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    out = args.out or app.SCRIPT_DIR / "generated" / f"mosaic_{args.columns}x{args.rows}_{seed}.png"
+    out.parent.mkdir(parents=True, exist_ok=True)
+
+    excluded_colors = [c for c in args.exclude_colors.split(",") if c]
+    allowed_colors = [c for c in app.DYE_COLORS if c not in excluded_colors] or None
+    excluded_patterns = [p for p in args.exclude_patterns.split(",") if p]
+
+    width, height = app.mosaic_size(args.columns, args.rows)
+    print(f"Rendering {args.columns}x{args.rows} banners "
+          f"({width * args.scale}x{height * args.scale} px, seed {seed})...")
+    started = time.perf_counter()
+    bands = app.mosaic_bands(
+        args.columns,
+        args.rows,
+        mirror=args.mirror,
+        seed=seed,
+        excluded_patterns=excluded_patterns,
+        allowed_colors=allowed_colors,
+        constraints=constraints,
+    )
+    size = write_png(out, iter_png(width, height, bands, args.scale, args.level))
+    print(f"Done! Saved {out} ({size / 1e6:.1f} MB in {time.perf_counter() - started:.1f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
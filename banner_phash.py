@@ -0,0 +1,272 @@
+"""
+Perceptual hashes of rendered banners, and an index for finding near
+duplicates among millions of them.
+
+PerceptualHasher maps a banner to 64 bits. The Hamming distance between two
+hashes grows with how different the banners look. Each banner is split into
+luma and two color-difference channels, and each channel's low-frequency 2D
+DCT coefficients form its feature vector. fit() learns the principal
+components of those vectors over sample banners. The hash quantizes the
+projections onto them at quantiles of the sample: the first COARSE
+components, which carry most of the variance, get a thermometer code of
+COARSE_BITS bits each, and the rest one bit each at the median.
+Each code level thus holds about as many typical banners, and a bigger
+change along the main components flips more bits.
+
+Color is part of the features, so the same layout in different dyes hashes
+far apart. A layer hidden under others changes nothing, because the pixels
+are the same. A small visible change moves a few bits.
+
+HashIndex answers "is anything stored within Hamming distance d of h" by
+multi-index hashing. The 64 bits are cut into CHUNKS 16-bit chunks. Any
+hash within d of a query matches it in at least one chunk to within
+d // CHUNKS bits. Each chunk column is kept sorted, so a query takes a few
+binary searches plus a popcount over the candidates they return.
+"""
+
+import functools
+import threading
+
+import numpy as np
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+MERGE_SIZE = 4096  # hashes buffered unsorted before merging into the chunk columns
+DCT_SIZE = (10, 5)  # (vertical, horizontal) frequencies kept per channel
+COARSE = 8  # leading components quantized with a thermometer code
+COARSE_BITS = 4
+
+# Luma and color differences (B - luma, R - luma) from RGB
+_OPPONENT = np.array(
+    [[0.299, 0.587, 0.114], [-0.299, -0.587, 0.886], [0.701, -0.587, -0.114]],
+    dtype=np.float32,
+)
+# Bit j of the code is stored at bit (j % CHUNKS) * CHUNK_BITS + j // CHUNKS,
+# so the thermometer bits of one component land in different chunks.
+_SHIFTS = np.array(
+    [(j % CHUNKS) * CHUNK_BITS + j // CHUNKS for j in range(HASH_BITS)], dtype=np.uint64
+)
+
+
+@functools.lru_cache(maxsize=8)
+def _dct_rows(size: int, count: int) -> np.ndarray:
+    """First `count` DCT-II basis rows over `size` samples; row 0 averages."""
+    n = np.arange(size)
+    rows = np.cos(np.pi * (n[None, :] + 0.5) * np.arange(count)[:, None] / size)
+    rows[1:] *= 2
+    return (rows / size).astype(np.float32)
+
+
+def features(pixels: np.ndarray) -> np.ndarray:
+    """
+    (N, H, W, 4) uint8 RGBA banners -> (N, 3 * U * V) float32 low-frequency
+    DCT coefficients of luma and color differences. Pixels are taken
+    premultiplied by alpha, i.e. as drawn over black.
+    """
+    pixels = np.asarray(pixels)
+    n, height, width = pixels.shape[:3]
+    rgb = pixels[..., :3] * (pixels[..., 3:] / np.float32(255))  # (N, H, W, 3)
+    coefs = np.tensordot(rgb, _dct_rows(width, DCT_SIZE[1]), axes=([2], [1]))  # (N, H, 3, V)
+    coefs = np.tensordot(_dct_rows(height, DCT_SIZE[0]), coefs, axes=([1], [1]))  # (U, N, 3, V)
+    coefs = np.tensordot(coefs, _OPPONENT, axes=([2], [1]))  # (U, N, V, 3)
+    return coefs.transpose(1, 3, 0, 2).reshape(n, -1)
+
+
+class PerceptualHasher:
+    """
+    Hash function fitted to a sample of banners, see fit(). Hashes from
+    different hashers are not comparable.
+    """
+
+    def __init__(self, mean: np.ndarray, projection: np.ndarray, thresholds: np.ndarray):
+        self.mean = mean  # (F,) feature mean
+        self.projection = projection  # (F, HASH_BITS) component of each bit
+        self.thresholds = thresholds  # (HASH_BITS,)
+
+    @classmethod
+    def fit(cls, pixels: np.ndarray) -> "PerceptualHasher":
+        """Fit to (N, H, W, 4) sample banners; a few thousand random ones do."""
+        x = features(pixels).astype(np.float64)
+        mean = x.mean(axis=0)
+        x -= mean
+        _, vectors = np.linalg.eigh(x.T @ x)
+        vectors = vectors[:, ::-1]  # by decreasing variance
+        levels = [COARSE_BITS] * COARSE + [1] * (HASH_BITS - COARSE * COARSE_BITS)
+        components = np.repeat(np.arange(len(levels)), levels)
+        quantiles = np.concatenate([np.arange(1, k + 1) / (k + 1) for k in levels])
+        projected = np.sort(x @ vectors[:, : len(levels)], axis=0)
+        # Put each threshold halfway from its quantile to the next distinct
+        # value: plain one-dye banners are common, and a threshold right on
+        # their projection would leave their bit to float rounding.
+        thresholds = np.empty(len(components))
+        for j, (c, q) in enumerate(zip(components, quantiles)):
+            column = projected[:, c]
+            below = column[int(q * (len(column) - 1))]
+            above = column[np.searchsorted(column, below, side="right") :]
+            thresholds[j] = (below + above[0]) / 2 if len(above) else below
+        return cls(
+            mean.astype(np.float32),
+            vectors[:, components].astype(np.float32),
+            thresholds.astype(np.float32),
+        )
+
+    def __call__(self, pixels: np.ndarray) -> np.ndarray:
+        """Hash (N, H, W, 4) uint8 RGBA banners; returns (N,) uint64."""
+        projected = (features(pixels) - self.mean) @ self.projection
+        bits = (projected > self.thresholds).astype(np.uint64) << _SHIFTS
+        return np.bitwise_or.reduce(bits, axis=1)
+
+
+def _chunks(hashes: np.ndarray) -> list[np.ndarray]:
+    mask = np.uint64((1 << CHUNK_BITS) - 1)
+    return [
+        ((hashes >> np.uint64(i * CHUNK_BITS)) & mask).astype(np.uint16) for i in range(CHUNKS)
+    ]
+
+
+@functools.lru_cache(maxsize=CHUNK_BITS)
+def _flips(radius: int) -> np.ndarray:
+    """Every CHUNK_BITS-bit mask with at most `radius` bits set."""
+    masks = np.arange(1 << CHUNK_BITS, dtype=np.uint16)
+    return masks[np.bitwise_count(masks) <= radius]
+
+
+class HashIndex:
+    """
+    Growing set of 64-bit hashes searchable by Hamming distance. Hashes
+    get IDs in insertion order. Any distance may be queried; queries stay
+    fast up to d = 3 * CHUNKS - 1 (two bits per chunk).
+
+    New hashes are buffered and merged into the sorted chunk columns
+    MERGE_SIZE at a time, so adding one costs a few microseconds however
+    large the index is.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._hashes = np.zeros(MERGE_SIZE, dtype=np.uint64)  # by ID, grown by doubling
+            self._count = 0  # IDs in use
+            self._merged = 0  # IDs below this are in the chunk columns
+            # Per chunk: chunk values of merged hashes, sorted, and their IDs
+            self._keys = [np.zeros(0, dtype=np.uint16) for _ in range(CHUNKS)]
+            self._ids = [np.zeros(0, dtype=np.uint32) for _ in range(CHUNKS)]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, h: int) -> bool:
+        return self.nearest(h, 0) is not None
+
+    def nearest(self, h: int, d: int) -> tuple[int, int] | None:
+        """(ID, distance) of a stored hash within d of h, or None."""
+        with self._lock:
+            return self._find(np.uint64(h), d)
+
+    def add(self, hashes: np.ndarray) -> None:
+        with self._lock:
+            for h in np.asarray(hashes, dtype=np.uint64).ravel():
+                self._append(h)
+
+    def add_unique(self, hashes: np.ndarray, d: int, limit: int | None = None) -> list[int]:
+        """
+        Add each hash further than d from everything stored, including those
+        added before it in the same call, stopping after `limit`. Returns the
+        positions of the added hashes.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64).ravel()
+        with self._lock:
+            candidates = np.flatnonzero(~self._near_any(hashes, d))
+            # Among themselves, a candidate is dropped if it is near an earlier kept one.
+            near = np.bitwise_count(hashes[candidates, None] ^ hashes[None, candidates]) <= d
+            added: list[int] = []
+            kept = np.zeros(len(candidates), dtype=bool)
+            for k, i in enumerate(candidates.tolist()):
+                if limit is not None and len(added) >= limit:
+                    break
+                if not (near[k] & kept).any():
+                    kept[k] = True
+                    added.append(i)
+            for i in added:
+                self._append(hashes[i])
+        return added
+
+    # --- Internals, called with _lock held --------------------------------
+
+    def _append(self, h: np.uint64) -> None:
+        if self._count == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+        self._hashes[self._count] = h
+        self._count += 1
+        if self._count - self._merged >= MERGE_SIZE:
+            self._merge()
+
+    def _merge(self) -> None:
+        new = self._hashes[self._merged : self._count]
+        new_ids = np.arange(self._merged, self._count, dtype=np.uint32)
+        for i, chunk in enumerate(_chunks(new)):
+            order = np.argsort(chunk, kind="stable")
+            at = np.searchsorted(self._keys[i], chunk[order])
+            self._keys[i] = np.insert(self._keys[i], at, chunk[order])
+            self._ids[i] = np.insert(self._ids[i], at, new_ids[order])
+        self._merged = self._count
+
+    def _near_any(self, hashes: np.ndarray, d: int) -> np.ndarray:
+        """Whether each of `hashes` is within d of a stored hash, as bools."""
+        near = np.zeros(len(hashes), dtype=bool)
+        pending = self._hashes[self._merged : self._count]
+        if len(pending) and len(hashes):
+            near |= (np.bitwise_count(hashes[:, None] ^ pending[None, :]) <= d).any(axis=1)
+        if not self._merged:
+            return near
+
+        probes = _flips(d // CHUNKS)
+        for i, chunks in enumerate(_chunks(hashes)):
+            todo = np.flatnonzero(~near)
+            if not len(todo):
+                break
+            # One binary search per (query, probe), then every ID in the
+            # matching runs, tagged with the query it came from.
+            values = (chunks[todo, None] ^ probes[None, :]).ravel()
+            lo = np.searchsorted(self._keys[i], values, side="left")
+            counts = np.searchsorted(self._keys[i], values, side="right") - lo
+            total = int(counts.sum())
+            if not total:
+                continue
+            ends = np.cumsum(counts)
+            positions = np.arange(total) - np.repeat(ends - counts - lo, counts)
+            owners = np.repeat(np.repeat(todo, len(probes)), counts)
+            ids = self._ids[i][positions]
+            hit = np.bitwise_count(self._hashes[ids] ^ hashes[owners]) <= d
+            near[owners[hit]] = True
+        return near
+
+    def _find(self, h: np.uint64, d: int) -> tuple[int, int] | None:
+        # Unmerged hashes: a plain scan
+        dist = np.bitwise_count(self._hashes[self._merged : self._count] ^ h)
+        if len(dist):
+            j = int(dist.argmin())
+            if dist[j] <= d:
+                return self._merged + j, int(dist[j])
+        if not self._merged:
+            return None
+
+        probes = _flips(d // CHUNKS)
+        for i, chunk in enumerate(_chunks(np.array([h]))):
+            keys = self._keys[i]
+            values = probes ^ chunk[0]
+            lo = np.searchsorted(keys, values, side="left")
+            hi = np.searchsorted(keys, values, side="right")
+            hit = lo < hi
+            if not hit.any():
+                continue
+            ids = np.concatenate([self._ids[i][a:b] for a, b in zip(lo[hit], hi[hit])])
+            dist = np.bitwise_count(self._hashes[ids] ^ h)
+            j = int(dist.argmin())
+            if dist[j] <= d:
+                return int(ids[j]), int(dist[j])
+        return None
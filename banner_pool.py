@@ -0,0 +1,178 @@
+"""
+Concurrency helpers for app.py: single-flight cache loading and a bounded,
+fair render pool for the async serving mode.
+
+SingleFlight fills a cache dict so that threads asking for the same missing
+key at once wait for one load instead of each doing it.
+
+With FairPool, requests hand their rendering and encoding to a fixed set of
+worker threads (Pillow, zlib and most NumPy kernels release the GIL, so they
+run in parallel) as a Batch of small tasks. Workers take one task at a time from
+each active batch in turn, so a 1000-banner request cannot hold every
+worker while a one-banner request waits behind its whole backlog: the small
+request waits for at most one task per active batch.
+
+At most max_pending tasks may be queued or running. batch() refuses a
+request that would go over with Saturated, which app.py turns into a 503
+with Retry-After instead of letting work pile up.
+"""
+
+import atexit
+import threading
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Load-through access to `cache`: get(key, load) returns cache[key],
+    calling load() in exactly one thread when it is missing. If that load
+    raises, the error goes to its caller and a waiting thread retries.
+    clear() empties the cache; loads already running are then not stored.
+    """
+
+    def __init__(self, cache: dict):
+        self.cache = cache
+        self.lock = threading.Lock()
+        self._loading: dict = {}  # key -> Event set when its load finishes
+        self._generation = 0
+
+    def get(self, key, load: Callable):
+        while True:
+            value = self.cache.get(key)
+            if value is not None:
+                return value
+            with self.lock:
+                value = self.cache.get(key)
+                if value is not None:
+                    return value
+                event = self._loading.get(key)
+                if event is None:
+                    event = self._loading[key] = threading.Event()
+                    generation = self._generation
+                    break
+            event.wait()
+
+        try:
+            value = load()
+            with self.lock:
+                if generation == self._generation:
+                    self.cache[key] = value
+            return value
+        finally:
+            with self.lock:
+                if self._loading.get(key) is event:
+                    del self._loading[key]
+            event.set()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache.clear()
+            self._loading.clear()
+            self._generation += 1
+
+
+class Saturated(Exception):
+    pass
+
+
+class Batch:
+    """Tasks of one request; see FairPool.batch."""
+
+    def __init__(self, pool: "FairPool", reserved: int):
+        self.pool = pool
+        self.reserved = reserved  # slots still unused
+        self.tasks: deque[tuple[Future, Callable, tuple]] = deque()
+
+    def submit(self, fn: Callable, *args) -> Future:
+        future: Future = Future()
+        with self.pool._cond:
+            if self.reserved <= 0:
+                raise RuntimeError("batch submitted more tasks than it reserved")
+            self.reserved -= 1
+            self.tasks.append((future, fn, args))
+            if len(self.tasks) == 1:
+                # Newly ready batches go first: a request's first task never
+                # waits behind a turn of every other active batch.
+                self.pool._ready.appendleft(self)
+            self.pool._cond.notify()
+        return future
+
+    def map(self, fn: Callable, items: list) -> list:
+        """Submit fn(item) for every item and return the results in order."""
+        futures = [self.submit(fn, item) for item in items]
+        return [f.result() for f in futures]
+
+    def __enter__(self) -> "Batch":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        with self.pool._cond:
+            # Give back slots that were reserved but never used.
+            self.pool._pending -= self.reserved
+            self.reserved = 0
+
+
+class FairPool:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._ready: deque[Batch] = deque()  # batches with queued tasks, round-robin
+        self._pending = 0  # reserved slots: queued + running + not yet submitted
+        self._threads: list[threading.Thread] = []
+        self._closed = False
+
+    def _start(self) -> None:
+        # Started on first use, so importing app.py leaves no threads behind.
+        if not self._threads:
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"bannerlab-render-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            atexit.register(self.shutdown)
+
+    def batch(self, tasks: int) -> Batch:
+        """Reserve room for `tasks` tasks; raises Saturated if the pool is full."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("pool is shut down")
+            # A request bigger than the whole pool is still let in when idle.
+            if self._pending and self._pending + tasks > self.max_pending:
+                raise Saturated(f"{self._pending} render tasks pending")
+            self._pending += tasks
+            self._start()
+        return Batch(self, tasks)
+
+    def pending(self) -> int:
+        with self._cond:
+            return self._pending
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready and not self._closed:
+                    self._cond.wait()
+                if not self._ready:
+                    return
+                batch = self._ready.popleft()
+                future, fn, args = batch.tasks.popleft()
+                if batch.tasks:
+                    self._ready.append(batch)
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+            with self._cond:
+                self._pending -= 1
+
+    def shutdown(self) -> None:
+        """Finish queued tasks, then stop the workers."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join()
+        self._threads.clear()
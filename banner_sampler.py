@@ -0,0 +1,195 @@
+"""
+Constrained and weighted sampling of random layer stacks.
+
+app.sample_random_stacks draws every pattern and dye uniformly. A
+Constraints narrows that down while the stacks are built, one layer column
+at a time for the whole batch, so nothing is drawn only to be thrown away:
+
+  pattern_weights    relative odds per pattern file (default 1)
+  distinct_patterns  no pattern twice in one stack
+  min_top_coverage   the top layer covers at least this fraction of the banner
+  min_contrast       each layer's dye differs by at least this much (CIE76
+                     delta E) from the dyes it is drawn over
+
+The checks only read precomputed Tables: each pattern's coverage of a coarse
+GRID of cells, and the delta E of every pair of dyes. "What a layer is
+drawn over" is tracked per stack as the top dye of each cell, i.e. a
+GRID-sized composite. A candidate dye is scored by its contrast against
+those dyes, weighted by how much of each cell the new pattern covers.
+
+When a constraint leaves nothing to choose from in some stack, that stack
+gets the closest option instead: the largest pattern for the top layer, or
+the dye with the most contrast.
+"""
+
+import math
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+
+import numpy as np
+
+GRID = (8, 4)  # (rows, columns) of cells in the coarse coverage grid
+CELL_COVERED = 0.5  # a layer covering this much of a cell becomes its top dye
+MAX_WEIGHT = 1e6  # pattern weights are clamped to [0, MAX_WEIGHT]; non-finite ones ignored
+
+
+@dataclass
+class Constraints:
+    pattern_weights: dict[str, float] = field(default_factory=dict)
+    distinct_patterns: bool = False
+    min_top_coverage: float = 0.0
+    min_contrast: float = 0.0
+
+    def active(self) -> bool:
+        return bool(
+            self.pattern_weights
+            or self.distinct_patterns
+            or self.min_top_coverage > 0
+            or self.min_contrast > 0
+        )
+
+
+@dataclass(frozen=True)
+class Tables:
+    coverage: np.ndarray  # (P, cells) mean alpha of each pattern per grid cell, 0-1
+    area: np.ndarray  # (P,) fraction of the banner each pattern covers
+    contrast: np.ndarray  # (C, C) delta E between dyes
+
+
+def _srgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """(N, 3) 0-255 sRGB -> (N, 3) CIELAB under D65."""
+    c = np.asarray(rgb, dtype=np.float64) / 255
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array(
+        [[0.4124, 0.3576, 0.1805], [0.2126, 0.7152, 0.0722], [0.0193, 0.1192, 0.9505]]
+    ).T
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack(
+        [116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1
+    )
+
+
+def build_tables(masks: np.ndarray, colors: np.ndarray) -> Tables:
+    """Tables for (P, H, W) uint8 alpha masks and (C, 3) RGB dye colors."""
+    count, height, width = masks.shape
+    rows = np.arange(height) * GRID[0] // height
+    cols = np.arange(width) * GRID[1] // width
+    cell = (rows[:, None] * GRID[1] + cols[None, :]).ravel()  # grid cell of each pixel
+    pixels_per_cell = np.bincount(cell, minlength=GRID[0] * GRID[1])
+    alpha = masks.reshape(count, -1).astype(np.float64) / 255
+    coverage = np.zeros((count, GRID[0] * GRID[1]))
+    for c in range(GRID[0] * GRID[1]):
+        coverage[:, c] = alpha[:, cell == c].sum(axis=1)
+    coverage /= np.maximum(pixels_per_cell, 1)
+
+    lab = _srgb_to_lab(colors)
+    contrast = np.sqrt(((lab[:, None, :] - lab[None, :, :]) ** 2).sum(axis=-1))
+    return Tables(
+        coverage=coverage.astype(np.float32),
+        area=alpha.mean(axis=1).astype(np.float32),
+        contrast=contrast.astype(np.float32),
+    )
+
+
+def _weight(value: float) -> float:
+    """A pattern weight made safe to sum in float32; non-finite counts as the default 1."""
+    value = float(value)
+    return min(max(value, 0.0), MAX_WEIGHT) if math.isfinite(value) else 1.0
+
+
+def _weighted_choice(weights: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Per row of (R, K) non-negative weights with positive sums, a column index."""
+    cumulative = np.cumsum(weights, axis=1)
+    u = rng.random(len(weights)) * cumulative[:, -1]
+    return np.argmax(cumulative > u[:, None], axis=1)
+
+
+def sample_stacks(
+    count: int,
+    max_layers: int,
+    base_id: int,
+    pattern_pool: np.ndarray,
+    color_pool: np.ndarray,
+    names: Sequence[str],
+    tables: Tables,
+    constraints: Constraints,
+    rng: np.random.Generator,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Draw `count` stacks like app.sample_random_stacks, honoring constraints.
+
+    pattern_pool and color_pool hold the pattern IDs (indices into names and
+    the tables) and dye indices to draw from. Returns (pattern_ids,
+    color_ids), each (count, 1 + max_layers) with -1 in unused slots.
+    """
+    pattern_ids = np.full((count, 1 + max_layers), -1, dtype=np.intp)
+    color_ids = np.full((count, 1 + max_layers), -1, dtype=np.intp)
+    pattern_ids[:, 0] = base_id
+    color_ids[:, 0] = rng.choice(color_pool, size=count)
+    if not pattern_pool.size:
+        return pattern_ids, color_ids
+
+    weights = np.array(
+        [_weight(constraints.pattern_weights.get(names[p], 1.0)) for p in pattern_pool],
+        dtype=np.float32,
+    )
+    if not weights.any():
+        weights[:] = 1.0
+    area = tables.area[pattern_pool]
+    big_enough = area >= constraints.min_top_coverage
+    coverage = tables.coverage[pattern_pool]  # (P, cells)
+    contrast = tables.contrast[:, color_pool]  # (C, pool dyes)
+    num_colors = len(contrast)
+
+    num_layers = rng.integers(0, max_layers + 1, size=count)
+    if constraints.distinct_patterns:
+        num_layers = np.minimum(num_layers, len(pattern_pool))
+        used = np.zeros((count, len(pattern_pool)), dtype=bool)
+    if constraints.min_contrast > 0:
+        top = np.repeat(color_ids[:, :1], coverage.shape[1], axis=1)  # (count, cells) dye IDs
+
+    for col in range(1, max_layers + 1):
+        rows = np.flatnonzero(num_layers >= col)
+        if not rows.size:
+            break
+
+        # Pattern
+        allowed = np.ones((len(rows), len(pattern_pool)), dtype=bool)
+        if constraints.distinct_patterns:
+            allowed &= ~used[rows]
+        fallback = allowed.astype(np.float32)
+        if constraints.min_top_coverage > 0:
+            is_top = num_layers[rows] == col
+            allowed[is_top] &= big_enough
+            fallback[is_top] *= area
+        odds = allowed * weights
+        stuck = odds.sum(axis=1) == 0
+        odds[stuck] = fallback[stuck]
+        choice = _weighted_choice(odds, rng)
+        if constraints.distinct_patterns:
+            used[rows, choice] = True
+        pattern_ids[rows, col] = pattern_pool[choice]
+
+        # Dye
+        if constraints.min_contrast > 0:
+            cover = coverage[choice]  # (R, cells)
+            # Covered area over each dye, then its coverage-weighted contrast
+            # with every candidate dye.
+            over = np.bincount(
+                (np.arange(len(rows))[:, None] * num_colors + top[rows]).ravel(),
+                weights=cover.ravel(),
+                minlength=len(rows) * num_colors,
+            ).reshape(len(rows), num_colors)
+            total = cover.sum(axis=1, keepdims=True)
+            score = (over @ contrast) / np.maximum(total, 1e-6)
+            ok = (score >= constraints.min_contrast) | (total == 0)
+            stuck = ~ok.any(axis=1)
+            ok[stuck, score[stuck].argmax(axis=1)] = True
+            dyes = color_pool[_weighted_choice(ok.astype(np.float32), rng)]
+            top[rows] = np.where(cover >= CELL_COVERED, dyes[:, None], top[rows])
+        else:
+            dyes = rng.choice(color_pool, size=len(rows))
+        color_ids[rows, col] = dyes
+
+    return pattern_ids, color_ids
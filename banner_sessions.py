@@ -0,0 +1,169 @@
+"""
+Editing sessions for app.py: a set of banners kept server-side between
+requests, so that tweaking one layer does not redraw the whole stack.
+
+Each banner remembers the composite after every layer of its stack (its
+prefixes). An edit that changes layer k keeps prefixes 0..k-1 and only
+composites layers k..n on top, so changing the top layer costs one
+alpha_composite however deep the stack is. Prefixes are built on a banner's
+first edit; banners that are never edited only keep their final image.
+SessionStore bounds the pixel bytes all sessions hold this way, besides
+their number.
+
+Stacks are (pattern, dye) pairs, base first, as from app.canonical_layers.
+The compositor is supplied by the caller as `draw(pattern, dye)`, returning
+the colored layer or None for a pattern that cannot be drawn.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass, field
+
+from PIL import Image
+
+Pair = tuple[str, str]
+Draw = Callable[[str, str], Image.Image | None]
+
+
+class EditableBanner:
+    def __init__(self, pairs: Sequence[Pair], image: Image.Image):
+        self.pairs: list[Pair] = list(pairs)
+        self.image = image
+        self._prefixes: list[Image.Image] | None = None
+        self._nbytes = self._measure()
+
+    def set_pairs(self, pairs: Sequence[Pair], draw: Draw, blank: Image.Image) -> None:
+        """
+        Replace the stack, compositing only the layers after the longest
+        unchanged prefix. If `draw` raises, the banner is left as it was.
+        """
+        pairs = list(pairs)
+        keep = 0
+        if self._prefixes is not None:
+            for old, new in zip(self.pairs, pairs):
+                if old != new:
+                    break
+                keep += 1
+        prefixes = (self._prefixes or [])[:keep]
+
+        img = prefixes[-1] if prefixes else blank
+        for pattern, dye in pairs[keep:]:
+            layer = draw(pattern, dye)
+            if layer is not None:
+                img = img.copy()
+                img.alpha_composite(layer)
+            prefixes.append(img)
+
+        self.pairs = pairs
+        self._prefixes = prefixes
+        self.image = prefixes[-1] if prefixes else blank
+        self._nbytes = self._measure()
+
+    def nbytes(self) -> int:
+        """Pixel bytes of the images this banner keeps (prefixes or final image)."""
+        return self._nbytes
+
+    def _measure(self) -> int:
+        images = {id(img): img for img in (self._prefixes or [self.image])}
+        return sum(img.width * img.height * len(img.getbands()) for img in images.values())
+
+
+@dataclass
+class Session:
+    id: str
+    banners: list[EditableBanner]
+    options: dict  # request options fixed at creation (output mode, encoding)
+    revision: int = 0
+    touched: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def nbytes(self) -> int:
+        return sum(banner.nbytes() for banner in self.banners)
+
+
+class SessionStore:
+    """
+    In-memory sessions of this process. Least recently used sessions are
+    dropped past `max_sessions`, or while all sessions together hold more
+    than `max_bytes` of images (see Session.nbytes), and any session idle
+    for `ttl` seconds. The session just created or updated is never the one
+    dropped.
+
+    Sizes are measured on create() and update(); call update() after editing
+    a session's banners.
+    """
+
+    def __init__(self, max_sessions: int, ttl: float, max_bytes: int):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def create(self, banners: list[EditableBanner], options: dict) -> Session:
+        session = Session(id=uuid.uuid4().hex, banners=banners, options=options)
+        size = session.nbytes()
+        with self._lock:
+            self._expire()
+            self._sessions[session.id] = session
+            self._sizes[session.id] = size
+            self._bytes += size
+            self._evict()
+        return session
+
+    def update(self, session: Session) -> None:
+        """Re-measure a session after edits, dropping others if over budget."""
+        size = session.nbytes()
+        with self._lock:
+            if session.id not in self._sessions:
+                return
+            self._bytes += size - self._sizes[session.id]
+            self._sizes[session.id] = size
+            self._sessions.move_to_end(session.id)
+            self._evict()
+
+    def get(self, session_id: str) -> Session | None:
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.touched = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._drop(session_id)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    # --- Internals, called with _lock held --------------------------------
+
+    def _drop(self, session_id: str) -> bool:
+        if self._sessions.pop(session_id, None) is None:
+            return False
+        self._bytes -= self._sizes.pop(session_id)
+        return True
+
+    def _evict(self) -> None:
+        """Drop the oldest sessions until within limits, keeping the newest."""
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+        ):
+            self._drop(next(iter(self._sessions)))
+
+    def _expire(self) -> None:
+        """Drop sessions idle for longer than ttl."""
+        cutoff = time.monotonic() - self.ttl
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.touched >= cutoff:
+                break
+            self._drop(session.id)
@@ -3,6 +3,17 @@ let currentPage = "generate";
 let currentGridWidth = null;
 let currentGridHeight = null;
 
+// Composite banners here from one primitive atlas (see /api/primitives), so
+// the server only samples layer stacks and never renders or encodes.
+const CLIENT_COMPOSITING = true;
+// Otherwise, ask the server for cacheable /api/banner/<key> URLs instead of
+// inline data: URLs, so repeated banners are downloaded once.
+const OUTPUT_MODE = CLIENT_COMPOSITING ? "layers" : "url";
+// Exact palette PNGs: smaller and quicker to encode than RGBA for banners.
+const ENCODING = "png8";
+// Server-rendered grids come back as a single atlas PNG drawn onto one canvas.
+const GRID_OUTPUT_MODE = CLIENT_COMPOSITING ? "layers" : "atlas";
+
 // --- Info panel ---
 
 function showBannerInfo(index) {
@@ -66,9 +77,102 @@ function getFilterConfig() {
   return { excludePatterns, excludeColors };
 }
 
+// --- Client-side compositing ---
+
+let primitivesPromise = null;
+const tintedLayers = new Map(); // "pattern|color" -> canvas
+
+// Fetch the primitive atlas once per page. Its URL names the primitive
+// version, so the browser caches the image itself forever.
+function loadPrimitives() {
+  if (!primitivesPromise) {
+    primitivesPromise = (async () => {
+      const res = await fetch("/api/primitives");
+      if (!res.ok) {
+        throw new Error("Could not load primitives");
+      }
+      const info = await res.json();
+      const sheet = new Image();
+      sheet.src = info.src;
+      await sheet.decode();
+      const index = new Map(info.patterns.map((name, i) => [name, i]));
+      return { ...info, sheet, index };
+    })();
+    primitivesPromise.catch(() => {
+      primitivesPromise = null; // retry on the next request
+    });
+  }
+  return primitivesPromise;
+}
+
+// One primitive filled with one dye color, cached.
+function tintedLayer(prims, pattern, color) {
+  const key = `${pattern}|${color}`;
+  let layer = tintedLayers.get(key);
+  if (layer) return layer;
+
+  const i = prims.index.get(pattern);
+  if (i === undefined) return null; // unknown patterns are skipped, as on the server
+  const w = prims.cell_width;
+  const h = prims.cell_height;
+  const rgb = prims.colors[color] || prims.colors.white;
+
+  layer = document.createElement("canvas");
+  layer.width = w;
+  layer.height = h;
+  const ctx = layer.getContext("2d");
+  ctx.drawImage(prims.sheet, i * w, 0, w, h, 0, 0, w, h);
+  ctx.globalCompositeOperation = "source-in";
+  ctx.fillStyle = `rgb(${rgb.join(",")})`;
+  ctx.fillRect(0, 0, w, h);
+
+  tintedLayers.set(key, layer);
+  return layer;
+}
+
+// Draw a banner's layers in the same order render_banner_from_layers uses:
+// base first (white base.png if missing), then the patterns.
+function drawBanner(prims, ctx, layers, dx = 0, dy = 0, scale = 1) {
+  if (!layers || !layers.length) return;
+  const base = layers.find((l) => l.kind === "base") || { pattern: "base.png", color: "white" };
+  const ordered = [base, ...layers.filter((l) => l.kind !== "base" && l.pattern && l.color)];
+
+  ctx.imageSmoothingEnabled = false;
+  ordered.forEach((layer) => {
+    const tinted = tintedLayer(prims, layer.pattern || "base.png", layer.color);
+    if (tinted) {
+      ctx.drawImage(tinted, dx, dy, prims.cell_width * scale, prims.cell_height * scale);
+    }
+  });
+}
+
 // --- Rendering helpers ---
 
-function renderGrid(width, height, banners) {
+// Atlas cells are drawn at the same size and spacing as .banner-image.
+const ATLAS_SCALE = 4;
+const ATLAS_GAP = 8;
+
+// An <img> for a server-rendered banner, or a canvas composited here.
+function createBannerElement(banner, index, prims, altPrefix) {
+  let el;
+  if (banner.src || !prims) {
+    el = document.createElement("img");
+    el.src = banner.src;
+    el.alt = banner.slug || `${altPrefix}-${index}`;
+  } else {
+    el = document.createElement("canvas");
+    el.width = prims.cell_width;
+    el.height = prims.cell_height;
+    el.title = banner.slug || `${altPrefix}-${index}`;
+    drawBanner(prims, el.getContext("2d"), banner.layers);
+  }
+  el.className = "banner-image";
+  el.dataset.index = String(index);
+  el.addEventListener("click", () => showBannerInfo(index));
+  return el;
+}
+
+function renderGrid(width, height, banners, atlas = null, prims = null) {
   const bannerArea = document.getElementById("banner-area");
 
   currentGridWidth = width;
@@ -76,24 +180,91 @@ function renderGrid(width, height, banners) {
   lastBanners = banners || [];
 
   bannerArea.innerHTML = "";
+
+  if (atlas) {
+    renderAtlasGrid(bannerArea, width, height, atlas);
+    return;
+  }
+  if (prims) {
+    const paint = renderCanvasGrid(bannerArea, width, height, prims.cell_width, prims.cell_height);
+    paint((ctx, banner, dx, dy) => drawBanner(prims, ctx, banner.layers, dx, dy, ATLAS_SCALE));
+    return;
+  }
+
   bannerArea.classList.add("grid-mode");
   bannerArea.style.gridTemplateColumns = `repeat(${width}, 80px)`; // keep in sync with CSS .banner-image width
 
   const frag = document.createDocumentFragment();
 
   lastBanners.forEach((banner, index) => {
-    const img = document.createElement("img");
-    img.src = banner.src;
-    img.className = "banner-image";
-    img.alt = banner.slug || `grid-banner-${index}`;
-    img.dataset.index = String(index);
-    img.addEventListener("click", () => showBannerInfo(index));
-    frag.appendChild(img);
+    frag.appendChild(createBannerElement(banner, index, null, "grid-banner"));
   });
 
   bannerArea.appendChild(frag);
 }
 
+// Draw every grid cell from one atlas image onto a single canvas.
+function renderAtlasGrid(bannerArea, width, height, atlas) {
+  const paint = renderCanvasGrid(bannerArea, width, height, atlas.cell_width, atlas.cell_height);
+  const sheet = new Image();
+  sheet.onload = () => {
+    paint((ctx, banner, dx, dy, cellW, cellH) => {
+      ctx.drawImage(
+        sheet,
+        banner.x, banner.y, atlas.cell_width, atlas.cell_height,
+        dx, dy, cellW, cellH
+      );
+    });
+  };
+  sheet.src = atlas.src;
+}
+
+// Lay the grid out as one canvas with click-to-inspect. Returns
+// paint(drawCell), which draws every cell with
+// drawCell(ctx, banner, dx, dy, cellW, cellH).
+function renderCanvasGrid(bannerArea, width, height, cellWidth, cellHeight) {
+  bannerArea.classList.remove("grid-mode");
+  bannerArea.style.gridTemplateColumns = "";
+
+  const cellW = cellWidth * ATLAS_SCALE;
+  const cellH = cellHeight * ATLAS_SCALE;
+  const pitchX = cellW + ATLAS_GAP;
+  const pitchY = cellH + ATLAS_GAP;
+
+  const canvas = document.createElement("canvas");
+  canvas.className = "banner-atlas";
+  canvas.width = width * pitchX - ATLAS_GAP;
+  canvas.height = height * pitchY - ATLAS_GAP;
+
+  const ctx = canvas.getContext("2d");
+
+  canvas.addEventListener("click", (e) => {
+    const rect = canvas.getBoundingClientRect();
+    const x = e.clientX - rect.left;
+    const y = e.clientY - rect.top;
+    const col = Math.floor(x / pitchX);
+    const row = Math.floor(y / pitchY);
+    if (x % pitchX >= cellW || y % pitchY >= cellH) return; // clicked a gap
+    const index = row * width + col;
+    if (col < width && index < lastBanners.length) {
+      showBannerInfo(index);
+    }
+  });
+
+  bannerArea.appendChild(canvas);
+
+  return (drawCell) => {
+    ctx.imageSmoothingEnabled = false;
+    lastBanners.forEach((banner, index) => {
+      const dx = (index % width) * pitchX;
+      const dy = Math.floor(index / width) * pitchY;
+      ctx.fillStyle = "#111";
+      ctx.fillRect(dx, dy, cellW, cellH);
+      drawCell(ctx, banner, dx, dy, cellW, cellH);
+    });
+  };
+}
+
 // --- Generate single batch (Generate tab) ---
 
 async function generateBanners() {
@@ -109,43 +280,57 @@ async function generateBanners() {
   status.textContent = "Generating...";
   bannerArea.innerHTML = "";
 
+  // Ensure we are in flex mode (not grid)
+  bannerArea.classList.remove("grid-mode");
+  bannerArea.style.gridTemplateColumns = "";
+  lastBanners = [];
+
   try {
-    const res = await fetch("/api/generate", {
+    const prims = OUTPUT_MODE === "layers" ? await loadPrimitives() : null;
+
+    // NDJSON stream: one banner per line, shown as soon as it arrives.
+    const res = await fetch("/api/generate_stream", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({
         count,
         exclude_patterns: excludePatterns,
         exclude_colors: excludeColors,
+        output: OUTPUT_MODE,
+        encoding: ENCODING,
       }),
     });
 
-    if (!res.ok) {
+    if (!res.ok || !res.body) {
       throw new Error("Server error");
     }
 
-    const data = await res.json();
-    const banners = data.banners || [];
-    lastBanners = banners;
-
-    // Ensure we are in flex mode (not grid)
-    bannerArea.classList.remove("grid-mode");
-    bannerArea.style.gridTemplateColumns = "";
-
-    const frag = document.createDocumentFragment();
-
-    banners.forEach((banner, index) => {
-      const img = document.createElement("img");
-      img.src = banner.src;
-      img.className = "banner-image";
-      img.alt = banner.slug || `banner-${index}`;
-      img.dataset.index = String(index);
-      img.addEventListener("click", () => showBannerInfo(index));
-      frag.appendChild(img);
-    });
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = "";
+
+    while (true) {
+      const { value, done } = await reader.read();
+      buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+
+      const lines = buffered.split("\n");
+      buffered = done ? "" : lines.pop();
+
+      const frag = document.createDocumentFragment();
+      lines.forEach((line) => {
+        if (!line.trim()) return;
+        const banner = JSON.parse(line);
+        const index = lastBanners.length;
+        lastBanners.push(banner);
+        frag.appendChild(createBannerElement(banner, index, prims, "banner"));
+      });
+      bannerArea.appendChild(frag);
+
+      if (done) break;
+      status.textContent = `Generating... ${lastBanners.length}/${count}`;
+    }
 
-    bannerArea.appendChild(frag);
-    status.textContent = `Generated ${banners.length} banner(s).`;
+    status.textContent = `Generated ${lastBanners.length} banner(s).`;
   } catch (err) {
     console.error(err);
     status.textContent = "Error: could not reach server.";
@@ -183,6 +368,7 @@ async function generateGrid() {
   bannerArea.innerHTML = "";
 
   try {
+    const primsPromise = GRID_OUTPUT_MODE === "layers" ? loadPrimitives() : null;
     const res = await fetch("/api/generate_grid", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
@@ -191,6 +377,7 @@ async function generateGrid() {
         height: h,
         exclude_patterns: excludePatterns,
         exclude_colors: excludeColors,
+        output: GRID_OUTPUT_MODE,
       }),
     });
 
@@ -201,7 +388,7 @@ async function generateGrid() {
     const data = await res.json();
     const banners = data.banners || [];
 
-    renderGrid(data.width || w, data.height || h, banners);
+    renderGrid(data.width || w, data.height || h, banners, data.atlas, await primsPromise);
 
     status.textContent = `Generated ${banners.length} banner(s) in a ${w}×${h} grid.`;
   } catch (err) {
@@ -231,6 +418,7 @@ async function mirrorGrid(axis) {
 
 
   try {
+    const primsPromise = GRID_OUTPUT_MODE === "layers" ? loadPrimitives() : null;
     const res = await fetch("/api/mirror_grid", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
@@ -239,6 +427,7 @@ async function mirrorGrid(axis) {
         width: currentGridWidth,
         height: currentGridHeight,
         banners: lastBanners,
+        output: GRID_OUTPUT_MODE,
       }),
     });
 
@@ -251,7 +440,7 @@ async function mirrorGrid(axis) {
     const width = data.width || currentGridWidth;
     const height = data.height || currentGridHeight;
 
-    renderGrid(width, height, banners);
+    renderGrid(width, height, banners, data.atlas, await primsPromise);
 
     if (axis === "horizontal") {
         status.textContent = "Mirrored grid horizontally (top/bottom).";
@@ -430,6 +619,9 @@ window.addEventListener("DOMContentLoaded", () => {
   loadPatterns();
   loadColors();
   setupTopNav();
+  if (CLIENT_COMPOSITING) {
+    loadPrimitives().catch((err) => console.error(err));
+  }
 
   // Wire up buttons
   const genBtn = document.getElementById("generate-button");